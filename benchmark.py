@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import glob
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+from functional_turing_machine import Machine, Program, OP_INPUT
+
+def input_specs(program):
+    "Returns (min_count, max_count) for every !input expression in the program, in the order they are defined."
+    specs = []
+    for function in program.functions:
+        for row in function["table"]:
+            for cmd in dict.fromkeys(row):
+                if cmd is not None and cmd[0] == OP_INPUT:
+                    specs.append((int(cmd[1]), int(cmd[2])))
+    return specs
+
+def scripted_inputs(program, sizes):
+    """Returns a list of (size, inputs) cases, one for each size, where size is a fraction of the largest input the
+    program accepts. Inputs are random bits, seeded so that every run of the benchmark uses the same inputs."""
+    cases = []
+    specs = input_specs(program)
+    for size in sizes:
+        rng = random.Random(f"{os.path.basename(program.path)}:{size}")
+        inputs = []
+        for min_count, max_count in specs:
+            length = max(min_count, round(size * max_count))
+            inputs.append(''.join(rng.choice('01') for _ in range(length)))
+        cases.append((size, inputs))
+    return cases
+
+def run_case(path, inputs, settings):
+    "Runs one benchmark case in the current process and returns its measurements."
+    program = Program.compile(path, use_cache=False)
+    machine = Machine(program, settings["max_tape_size"], settings["max_stack_size"], backend=settings["backend"])
+
+    # Repeat the run until it has taken long enough to time reliably, and keep the fastest run
+    runs = 0
+    best_time = None
+    total_time = 0.0
+    while runs == 0 or total_time < settings["min_time"]:
+        start = time.perf_counter()
+        steps = machine.run(output=io.StringIO(), inputs=inputs)
+        elapsed = time.perf_counter() - start
+        total_time += elapsed
+        runs += 1
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+
+    return {
+        "steps": steps,
+        "time": best_time,
+        "steps_per_sec": steps / best_time if best_time > 0 else None,
+        "runs": runs,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_tape": len(machine.tape),
+    }
+
+def _run_case_in_child(connection, path, inputs, settings):
+    try:
+        connection.send(run_case(path, inputs, settings))
+    except Exception as e:
+        connection.send({"error": f"{type(e).__name__}: {e}"})
+    connection.close()
+
+def run_isolated(path, inputs, settings):
+    "Runs one benchmark case in a fresh process, so that its peak memory use is not affected by other cases."
+    context = multiprocessing.get_context("spawn")
+    parent_connection, child_connection = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_in_child, args=(child_connection, path, inputs, settings))
+    process.start()
+    child_connection.close()
+    try:
+        result = parent_connection.recv()
+    except EOFError:
+        result = {"error": "Benchmark process exited unexpectedly."}
+    process.join()
+    return result
+
+def compare(results, baseline, tolerance):
+    "Returns a list of messages describing every regression of results against baseline."
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if "error" in result or "error" in old:
+            if result.get("error") != old.get("error"):
+                regressions.append(f"{name}: error changed from {old.get('error')} to {result.get('error')}")
+            continue
+        if result["steps"] != old["steps"]:
+            regressions.append(f"{name}: step count changed from {old['steps']} to {result['steps']}")
+        if old["steps_per_sec"] and result["steps_per_sec"] < old["steps_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['steps_per_sec']:.0f} steps/sec is slower than the baseline of "
+                               f"{old['steps_per_sec']:.0f}")
+        if result["peak_rss_kb"] > old["peak_rss_kb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS of {result['peak_rss_kb']} KB is above the baseline of "
+                               f"{old['peak_rss_kb']} KB")
+        if result["peak_tape"] != old["peak_tape"]:
+            regressions.append(f"{name}: peak tape length changed from {old['peak_tape']} to {result['peak_tape']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    # Get command line arguments
+    settings = {}
+    paths = []
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+
+        if arg == "--baseline":
+            # Compare the results against a saved baseline
+            if "baseline" in settings.keys():
+                raise ValueError("Argument --baseline specified more than once.")
+            settings["baseline"] = sys.argv[i+1]
+            i += 2
+
+        elif arg == "--save-baseline":
+            # Save the results as a new baseline
+            if "save_baseline" in settings.keys():
+                raise ValueError("Argument --save-baseline specified more than once.")
+            settings["save_baseline"] = sys.argv[i+1]
+            i += 2
+
+        elif arg == "--tolerance":
+            # Sets the fraction that speed and memory use may get worse by before being flagged
+            if "tolerance" in settings.keys():
+                raise ValueError("Argument --tolerance specified more than once.")
+            settings["tolerance"] = float(sys.argv[i+1])
+            if settings["tolerance"] < 0:
+                raise ValueError("Tolerance must not be negative.")
+            i += 2
+
+        elif arg == "--sizes":
+            # Sets the input sizes to run, as comma-separated fractions of the largest input
+            if "sizes" in settings.keys():
+                raise ValueError("Argument --sizes specified more than once.")
+            settings["sizes"] = [float(size) for size in sys.argv[i+1].split(',')]
+            if not all(0 <= size <= 1 for size in settings["sizes"]):
+                raise ValueError("Sizes must be between 0 and 1.")
+            i += 2
+
+        elif arg == "--min-time":
+            # Sets the minimum time in seconds to spend repeating each case
+            if "min_time" in settings.keys():
+                raise ValueError("Argument --min-time specified more than once.")
+            settings["min_time"] = float(sys.argv[i+1])
+            i += 2
+
+        elif arg == "--max-tape":
+            # Sets the maximum tape size
+            if "max_tape_size" in settings.keys():
+                raise ValueError("Argument --max-tape specified more than once.")
+            settings["max_tape_size"] = int(sys.argv[i+1])
+            i += 2
+
+        elif arg == "--max-stack":
+            # Sets the maximum stack size
+            if "max_stack_size" in settings.keys():
+                raise ValueError("Argument --max-stack specified more than once.")
+            settings["max_stack_size"] = int(sys.argv[i+1])
+            i += 2
+
+        elif arg == "--transpile":
+            # Benchmark the Python backend instead of the interpreter
+            if "backend" in settings.keys():
+                raise ValueError("Argument --transpile specified more than once.")
+            settings["backend"] = "python"
+            i += 1
+
+        elif arg.startswith("--"):
+            # Invalid command line argument
+            raise KeyError(f"Invalid argument: {arg}.")
+
+        else:
+            paths.append(arg)
+            i += 1
+
+    # Set defaults if not specified in comand line
+    if "tolerance" not in settings.keys():
+        settings["tolerance"] = 0.1
+    if "sizes" not in settings.keys():
+        settings["sizes"] = [0, 0.25, 0.5, 1]
+    if "min_time" not in settings.keys():
+        settings["min_time"] = 0.2
+    if "max_tape_size" not in settings.keys():
+        settings["max_tape_size"] = 10000
+    if "max_stack_size" not in settings.keys():
+        settings["max_stack_size"] = 1000
+    if "backend" not in settings.keys():
+        settings["backend"] = "interpreter"
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples", "*.ftm")))
+
+    results = {}
+    print(f"{'Benchmark':<28}{'Steps':>10}{'Time (ms)':>12}{'Steps/sec':>12}{'Peak RSS (KB)':>15}{'Peak tape':>11}")
+    for path in paths:
+        program = Program.compile(path, use_cache=False)
+        for size, inputs in scripted_inputs(program, settings["sizes"]):
+            name = f"{os.path.basename(path)}@{size:g}"
+            result = results[name] = run_isolated(path, inputs, settings)
+            if "error" in result:
+                print(f"{name:<28}{result['error']}")
+            else:
+                print(f"{name:<28}{result['steps']:>10}{1000 * result['time']:>12.3f}{result['steps_per_sec']:>12.0f}"
+                      f"{result['peak_rss_kb']:>15}{result['peak_tape']:>11}")
+
+    if "save_baseline" in settings.keys():
+        with open(settings["save_baseline"], 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if "baseline" in settings.keys():
+        with open(settings["baseline"]) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), settings["tolerance"])
+        print()
+        if regressions:
+            print(f"{len(regressions)} regression(s) found:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print("No regressions found.")
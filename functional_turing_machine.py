@@ -1,13 +1,66 @@
 #!/usr/bin/env python3
 
-import sys
+import bisect
+import collections
+import hashlib
+import io
+import json
+import marshal
+import mmap
+import os
+import pickle
 import re
+import signal
+import struct
+import sys
+import time
+
+# Translates cell values to the characters "0" and "1"
+_BIT_CHARACTERS = bytes.maketrans(b"\x00\x01", b"01")
+# Translates the characters "0" and "1" to cell values
+_CELL_CHARACTERS = bytes.maketrans(b"01", b"\x00\x01")
+
+# Position, length, new cell value, page size and page count of a packed tape, followed by its pages
+_TAPE_HEADER = struct.Struct('<QQBQQ')
+# Index and value of a packed page. The value is 0 or 1 if every cell of the page has that value, and otherwise
+# PAGE_DATA, in which case the cells follow (cut off at the length of the tape).
+_TAPE_PAGE = struct.Struct('<QB')
+PAGE_DATA = 2
+
+
+def _unpack_tape(max_size, data, offset):
+    """Reads a tape packed by the pack() method of TuringTape or PagedTuringTape at offset in data. Returns the
+    position, length and new cell value of the tape, a list of (start, size, value or cells) for its pages, and the
+    offset after the tape."""
+    try:
+        position, length, new_cell_value, page_size, page_count = _TAPE_HEADER.unpack_from(data, offset)
+        offset += _TAPE_HEADER.size
+        if not position < length <= max_size:
+            raise ValueError("Saved tape does not fit within the maximum tape size.")
+        pages = []
+        for _ in range(page_count):
+            index, value = _TAPE_PAGE.unpack_from(data, offset)
+            offset += _TAPE_PAGE.size
+            start = index * page_size
+            if value == PAGE_DATA:
+                size = min(page_size, length - start)
+                if offset + size > len(data):
+                    raise ValueError("Saved tape is truncated.")
+                pages.append((start, size, bytes(data[offset:offset + size])))
+                offset += size
+            else:
+                pages.append((start, min(page_size, length - start), value))
+    except struct.error:
+        raise ValueError("Saved tape is truncated.")
+    return position, length, new_cell_value, pages, offset
+
 
 class TuringTape:
     def __init__(self, max_size, new_cell_value=0):
         "Create a tape with maximum size max_size and where new cells are set to new_cell_value."
         self._new_cell_value = new_cell_value
-        self._tape = [self._new_cell_value]
+        # Cells are stored one per byte. bytearray over-allocates when extended, so growth is amortized.
+        self._tape = bytearray([self._new_cell_value])
         self._position = 0
         self._max_size = int(max_size)
         self._flags = {}
@@ -15,42 +68,138 @@ class TuringTape:
     @property
     def selected(self):
         "Returns the selected value."
-        return self._tape[self.get_position()]
+        return self._tape[self._position]
 
     @selected.setter
     def selected(self, new_val):
         "Sets the selected value."
-        self._tape[self.get_position()] = new_val
+        self._tape[self._position] = new_val
 
     def right(self, count, fill):
         "Moves the tape to the right and returns the selected value after the move."
-        if self.get_position() + count >= self._max_size:
+        position = self._position
+        if position + count >= self._max_size:
             raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
 
-        if self.get_position() + count >= len(self._tape):
+        if position + count >= len(self._tape):
             # Extend the tape
-            self._tape += [self._new_cell_value] * (1 + self.get_position() + count - len(self._tape))
+            self._tape.extend(bytes([self._new_cell_value]) * (1 + position + count - len(self._tape)))
 
         if fill != '*':
             # Change all cells that the tape moves over to the fill value
-            for i in range(self.get_position() + 1, self.get_position() + count + 1):
-                self._tape[i] = fill
+            self._tape[position + 1:position + count + 1] = bytes([fill]) * count
 
         # Move the cursor
-        self._position += count
+        self._position = position + count
 
     def left(self, count, fill):
         "Moves the tape to the left and returns the selected value after the move."
-        if self.get_position() - count < 0:
+        position = self._position
+        if position - count < 0:
             raise IndexError("TuringTape cannot extend below position 0.")
 
         if fill != '*':
             # Change all cells that the tape moves over to the fill value
-            for i in range(self.get_position() - count, self.get_position()):
-                self._tape[i] = fill
+            self._tape[position - count:position] = bytes([fill]) * count
 
         # Move the cursor
-        self._position -= count
+        self._position = position - count
+
+    def write(self, bits):
+        """Sets the cells from the selected one onwards to a string of bits and moves to the cell after them, like
+        setting the selected value and moving right by 1 for each bit. If that cell is past the maximum size, the bits
+        that fit are set and the same IndexError as right() is raised."""
+        position = self._position
+        cells = bits.encode().translate(_CELL_CHARACTERS)
+        end = position + len(cells)
+        overflow = end >= self._max_size
+        if overflow:
+            # Only set the cells up to the last one, like right() would
+            cells = cells[:self._max_size - position]
+            end = self._max_size - 1
+
+        if end >= len(self._tape):
+            # Extend the tape
+            self._tape.extend(bytes([self._new_cell_value]) * (1 + end - len(self._tape)))
+        self._tape[position:position + len(cells)] = cells
+        self._position = end
+
+        if overflow:
+            raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
+
+    def scan_right(self, count, value, limit=None):
+        """Moves the tape to the right by count cells for as long as the selected value is value (or forever if value
+        is None), but at most limit times, and returns the number of moves made. Raises the same IndexError as right()
+        at the maximum size."""
+        position = self._position
+        tape = self._tape
+
+        # Find the first cell on the path of the scan that does not match value
+        stop = None
+        if value is not None:
+            mismatch = bytes([1 - value])
+            if count == 1:
+                index = tape.find(mismatch, position)
+            else:
+                index = tape[position::count].find(mismatch)
+                if index != -1:
+                    index = position + index * count
+            if index != -1:
+                stop = index
+            elif self._new_cell_value != value:
+                # The scan stops at the first new cell
+                stop = position + -(-(len(tape) - position) // count) * count
+        if limit is not None:
+            end = position + limit * count
+            if (stop is None or stop > end) and end < self._max_size:
+                stop = end
+
+        if stop is None or stop >= self._max_size:
+            # Move as far as possible, then fail on the next move like right() does
+            moves = (self._max_size - 1 - position) // count
+            self.right(moves * count, '*')
+            raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
+
+        if stop >= len(tape):
+            # Extend the tape
+            tape.extend(bytes([self._new_cell_value]) * (1 + stop - len(tape)))
+
+        self._position = stop
+        return (stop - position) // count
+
+    def scan_left(self, count, value, limit=None):
+        """Moves the tape to the left by count cells for as long as the selected value is value (or forever if value
+        is None), but at most limit times, and returns the number of moves made. Raises the same IndexError as left()
+        at position 0."""
+        position = self._position
+        tape = self._tape
+
+        # Find the first cell on the path of the scan that does not match value
+        stop = -1
+        if value is not None:
+            mismatch = bytes([1 - value])
+            if count == 1:
+                stop = tape.rfind(mismatch, 0, position + 1)
+            else:
+                index = tape[position::-count].find(mismatch)
+                if index != -1:
+                    stop = position - index * count
+        if limit is not None:
+            end = position - limit * count
+            if (stop == -1 or stop < end) and end >= 0:
+                stop = end
+
+        if stop == -1:
+            # Move as far as possible, then fail on the next move like left() does
+            self._position = position % count
+            raise IndexError("TuringTape cannot extend below position 0.")
+
+        self._position = stop
+        return (position - stop) // count
+
+    def __len__(self):
+        "Returns the number of cells that the tape has extended to."
+        return len(self._tape)
 
     def get_position(self):
         "Returns the position of the tape."
@@ -71,6 +220,50 @@ class TuringTape:
         else:
             raise IndexError("Index out of range of tape")
 
+    def get_bits(self, start, end):
+        "Returns the values from position start up to (but not including) end as a string of bits."
+        if 0 <= start <= end <= len(self._tape):
+            return self._tape[start:end].translate(_BIT_CHARACTERS).decode()
+        else:
+            raise IndexError("Index out of range of tape")
+
+    def set_bits(self, start, bits):
+        "Sets the values from position start onwards to a string of bits, extending the tape to them if needed."
+        end = start + len(bits)
+        if not 0 <= start <= end <= self._max_size:
+            raise IndexError("Index out of range of tape")
+        if end > len(self._tape):
+            # Extend the tape
+            self._tape.extend(bytes([self._new_cell_value]) * (end - len(self._tape)))
+        self._tape[start:end] = bits.encode().translate(_CELL_CHARACTERS)
+
+    def pack(self):
+        "Returns the cells, position and new cell value of the tape as bytes, which restore() reads back."
+        length = len(self._tape)
+        return (_TAPE_HEADER.pack(self._position, length, self._new_cell_value, length, 1) +
+                _TAPE_PAGE.pack(0, PAGE_DATA) + self._tape)
+
+    def restore(self, data, offset=0):
+        """Replaces the tape with one packed by the pack() method of any kind of tape at offset in data, and returns the
+        offset after it."""
+        position, length, self._new_cell_value, pages, offset = _unpack_tape(self._max_size, data, offset)
+        tape = self._tape = bytearray([self._new_cell_value]) * length
+        for start, size, value in pages:
+            tape[start:start + size] = bytes([value]) * size if isinstance(value, int) else value
+        self._position = position
+        return offset
+
+    def window(self, size):
+        "Like repr(), but only shows the cells within size cells of the cursor. Hidden cells are shown as '...'."
+        position = self._position
+        start = max(0, position - size)
+        end = min(len(self._tape), position + size + 1)
+        return (('[' if position == 0 else '[ ' if start == 0 else '[... ') +
+                ' '.join(map(str, self._tape[start:position])) +
+                f">{self.selected}<" +
+                ' '.join(map(str, self._tape[position + 1:end])) +
+                (']' if position + 1 == len(self._tape) else ' ]' if end == len(self._tape) else ' ...]'))
+
     def __repr__(self):
         "A list-like representation of the tape, where the cursor looks like: '>X<'"
         return (('[' if self.get_position() == 0 else '[ ') +
@@ -79,452 +272,3849 @@ class TuringTape:
 			' '.join(str(cell) for cell in self._tape[self.get_position() + 1:]) +
 			(']' if self.get_position() + 1 == len(self._tape) else ' ]'))
 
-if __name__ == "__main__":
-    class Stack:
-        def __init__(self, max_size):
-            self._items = []
-            self._max_size = max_size
 
-        def is_empty(self):
-            return len(self._items) == 0
+class PagedTuringTape:
+    """A TuringTape that stores its cells in fixed-size pages, which are only allocated once a cell in them is written.
+    This makes very large maximum sizes practical for programs that only use scattered parts of the tape.
 
-        def __len__(self):
-            return len(self._items)
+    Pages that have never been written, or that were entirely overwritten by one fill, are stored as just their value,
+    so fill moves across them take time proportional to the number of pages rather than the number of cells. If path is
+    given, allocated pages are stored in a sparse memory-mapped file at path instead of in memory. Call close() to
+    release the file.
+    """
+    def __init__(self, max_size, new_cell_value=0, page_size=65536, path=None):
+        "Create a tape with maximum size max_size and where new cells are set to new_cell_value."
+        if page_size < 1:
+            raise ValueError("Page size must be at least 1.")
+        self._new_cell_value = new_cell_value
+        self._max_size = int(max_size)
+        self._page_size = page_size
+        # Cells beyond the length have never been moved to, so they always have the new cell value
+        self._length = 1
+        self._position = 0
+        # Maps page indices to the value of every cell of the page, or to the buffer that holds the page's cells.
+        # Missing pages have the new cell value.
+        self._pages = {}
+        self._file = None
+        self._mapped = None
+        if path is not None:
+            mapped_size = -(-self._max_size // page_size) * page_size
+            self._file = open(path, 'w+b')
+            self._file.truncate(mapped_size)
+            self._mapped = mmap.mmap(self._file.fileno(), mapped_size)
 
-        def add(self, name, flags, state):
-            if len(self) == self._max_size:
-                raise IndexError(f"Stack has reached its maximum size of {self._max_size}.")
-            self._items.append({"name": name, "flags": flags, "state": state})
+    def close(self):
+        "Releases the file of a memory-mapped tape. The tape cannot be used afterwards."
+        if self._mapped is not None:
+            self._mapped.close()
+            self._file.close()
+            self._mapped = self._file = None
+        self._pages = {}
 
-        def pop(self):
-            self._items.pop()
+    def _page(self, index):
+        "Returns the page with the given index and the offset of its first cell in it."
+        page = self._pages.get(index, self._new_cell_value)
+        return page, (index * self._page_size if page is self._mapped else 0)
 
-        @property
-        def name(self):
-            return self._items[-1]["name"]
+    def _writable_page(self, index):
+        "Like _page(), but allocates the page if it is only stored as a value."
+        page, base = self._page(index)
+        if page.__class__ is int:
+            size = self._page_size
+            if self._mapped is None:
+                page = bytearray([page]) * size
+            else:
+                base = index * size
+                self._mapped[base:base + size] = bytes([page]) * size
+                page = self._mapped
+            self._pages[index] = page
+        return page, base
 
-        @property
-        def state(self):
-            return self._items[-1]["state"]
+    def _read(self, start, end):
+        "Returns the values from position start up to (but not including) end as bytes."
+        parts = []
+        size = self._page_size
+        while start < end:
+            index, offset = divmod(start, size)
+            stop = min(end, (index + 1) * size)
+            page, base = self._page(index)
+            if page.__class__ is int:
+                parts.append(bytes([page]) * (stop - start))
+            else:
+                parts.append(bytes(page[base + offset:base + offset + stop - start]))
+            start = stop
+        return b''.join(parts)
 
-        @state.setter
-        def state(self, new_state):
-            self._items[-1]["state"] = new_state
+    def _fill(self, start, end, value):
+        "Sets the values from position start up to (but not including) end to value."
+        size = self._page_size
+        while start < end:
+            index, offset = divmod(start, size)
+            stop = min(end, (index + 1) * size)
+            if stop - start == size:
+                # Store whole pages as just their value
+                if value == self._new_cell_value:
+                    self._pages.pop(index, None)
+                else:
+                    self._pages[index] = value
+            elif self._pages.get(index, self._new_cell_value) != value:
+                page, base = self._writable_page(index)
+                page[base + offset:base + offset + stop - start] = bytes([value]) * (stop - start)
+            start = stop
 
-        def get_flag(self, flag):
-            return self._items[-1]["flags"][flag]
+    @property
+    def selected(self):
+        "Returns the selected value."
+        index, offset = divmod(self._position, self._page_size)
+        page, base = self._page(index)
+        return page if page.__class__ is int else page[base + offset]
 
-        def set_flag(self, flag, pos):
-            self._items[-1]["flags"][flag] = pos
+    @selected.setter
+    def selected(self, new_val):
+        "Sets the selected value."
+        index, offset = divmod(self._position, self._page_size)
+        page, base = self._page(index)
+        if page.__class__ is not int:
+            page[base + offset] = new_val
+        elif page != new_val:
+            page, base = self._writable_page(index)
+            page[base + offset] = new_val
 
-    # Get command line arguments
-    settings = {}
+    def right(self, count, fill):
+        "Moves the tape to the right and returns the selected value after the move."
+        position = self._position
+        if position + count >= self._max_size:
+            raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
 
-    if len(sys.argv) == 1:
-        input_file_name = input("Enter input file name: ")
-    else:
-        input_file_name = sys.argv[1]
-        i = 2
-        while i < len(sys.argv):
-            arg = sys.argv[i].lower()
+        if position + count >= self._length:
+            # Extend the tape
+            self._length = position + count + 1
 
-            if arg == "--max-tape":
-                # Sets the maximum tape size
-                if "max_tape_size" in settings.keys():
-                    raise ValueError("Argument --max-tape specified more than once.")
-                settings["max_tape_size"] = int(sys.argv[i+1])
-                if settings["max_tape_size"] < 1:
-                    raise ValueError("Maximum tape size must be at least 1.")
-                i += 2
+        if fill != '*':
+            # Change all cells that the tape moves over to the fill value
+            self._fill(position + 1, position + count + 1, fill)
 
-            elif arg == "--max-stack":
-                # Sets the maximum stack size
-                if "max_stack_size" in settings.keys():
-                    raise ValueError("Argument --max-stack specified more than once.")
-                settings["max_stack_size"] = int(sys.argv[i+1])
-                if settings["max_stack_size"] < 1:
-                    raise ValueError("Maximum stack size must be at least 1.")
-                i += 2
+        # Move the cursor
+        self._position = position + count
 
-            elif arg == "--print-tape":
-                # Print the tape after every step
-                if "print_tape" in settings.keys():
-                    raise ValueError("Argument --print-tape specified more than once.")
-                settings["print_tape"] = True
-                i += 1
+    def left(self, count, fill):
+        "Moves the tape to the left and returns the selected value after the move."
+        position = self._position
+        if position - count < 0:
+            raise IndexError("TuringTape cannot extend below position 0.")
 
-            elif arg == "--print-state":
-                # Print the state after every step
-                if "print_state" in settings.keys():
-                    raise ValueError("Argument --print-state specified more than once.")
-                settings["print_state"] = True
-                i += 1
+        if fill != '*':
+            # Change all cells that the tape moves over to the fill value
+            self._fill(position - count, position, fill)
+
+        # Move the cursor
+        self._position = position - count
+
+    def write(self, bits):
+        "Sets the cells from the selected one onwards to a string of bits and moves to the cell after them."
+        position = self._position
+        cells = bits.encode().translate(_CELL_CHARACTERS)
+        end = position + len(cells)
+        overflow = end >= self._max_size
+        if overflow:
+            # Only set the cells up to the last one, like right() would
+            cells = cells[:self._max_size - position]
+            end = self._max_size - 1
+
+        if end >= self._length:
+            # Extend the tape
+            self._length = end + 1
+        self._write(position, cells)
+        self._position = end
+
+        if overflow:
+            raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
 
+    def _find_right(self, position, count, value):
+        """Returns the first of position, position + count, position + 2 * count, ... before the length of the tape
+        whose value is not value, or -1 if there is none."""
+        size = self._page_size
+        mismatch = bytes([1 - value])
+        while position < self._length:
+            index, offset = divmod(position, size)
+            end = min(size, self._length - index * size)
+            page, base = self._page(index)
+            if page.__class__ is int:
+                if page != value:
+                    return position
+            elif count == 1:
+                found = page.find(mismatch, base + offset, base + end)
+                if found != -1:
+                    return position + found - base - offset
             else:
-                # Invalid command line argument
-                raise KeyError(f"Invalid argument: {arg}.")
+                found = page[base + offset:base + end][::count].find(mismatch)
+                if found != -1:
+                    return position + found * count
+            # Skip to the first position on the path in the next page
+            position += -(-(end - offset) // count) * count
+        return -1
 
-    # Set defaults if not specified in comand line
-    if "max_stack_size" not in settings.keys():
-        settings["max_stack_size"] = 1000
-    if "max_tape_size" not in settings.keys():
-        settings["max_tape_size"] = 10000
-    if "print_tape" not in settings.keys():
-        settings["print_tape"] = False
-    if "print_state" not in settings.keys():
-        settings["print_state"] = False
+    def _find_left(self, position, count, value):
+        """Returns the first of position, position - count, position - 2 * count, ... down to 0 whose value is not
+        value, or -1 if there is none."""
+        size = self._page_size
+        mismatch = bytes([1 - value])
+        while position >= 0:
+            index, offset = divmod(position, size)
+            page, base = self._page(index)
+            if page.__class__ is int:
+                if page != value:
+                    return position
+            elif count == 1:
+                found = page.rfind(mismatch, base, base + offset + 1)
+                if found != -1:
+                    return position - (base + offset - found)
+            else:
+                found = page[base:base + offset + 1][::-count].find(mismatch)
+                if found != -1:
+                    return position - found * count
+            # Skip to the last position on the path in the previous page
+            position -= (offset // count + 1) * count
+        return -1
 
-    file_name_pattern = re.compile(r"^.+\.ftm$")
+    def scan_right(self, count, value, limit=None):
+        """Moves the tape to the right by count cells for as long as the selected value is value (or forever if value
+        is None), but at most limit times, and returns the number of moves made. Raises the same IndexError as right()
+        at the maximum size."""
+        position = self._position
 
-    # Validate file name
-    if file_name_pattern.match(input_file_name) is None:
-        raise NameError('Invalid file name. Functional Turing Machine files must end with ".ftm"')
+        # Find the first cell on the path of the scan that does not match value
+        stop = None
+        if value is not None:
+            index = self._find_right(position, count, value)
+            if index != -1:
+                stop = index
+            elif self._new_cell_value != value:
+                # The scan stops at the first new cell
+                stop = position + -(-(self._length - position) // count) * count
+        if limit is not None:
+            end = position + limit * count
+            if (stop is None or stop > end) and end < self._max_size:
+                stop = end
 
-    # Read file
-    with open(input_file_name) as input_file:
-        script = input_file.readlines()
+        if stop is None or stop >= self._max_size:
+            # Move as far as possible, then fail on the next move like right() does
+            moves = (self._max_size - 1 - position) // count
+            self.right(moves * count, '*')
+            raise IndexError(f"TuringTape has reached its maximum size of {self._max_size}.")
 
-    # Initialize variables
-    BUILTIN_FUNCTIONS = {"flag", "goto", "if", "input", "print_str", "print_val"}
-    functions = {}
-    curr_function = None
-
-    # Compile regexes
-    empty_line_pattern = re.compile(r"^\s*(?:#.*)?$")
-    new_func_pattern = re.compile(r"^\s*@(?P<name>\d*[a-zA-Z_]\w*)\s*\((?P<parameters>(?:\s*\d*[a-zA-Z_]\w*\s*(?:,\s*\d*[a-zA-Z_]\w*\s*)*)|(?:\s*))\)\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s*(?:#.*)?$")
-    exec_func_pattern = re.compile(r"^\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s+(?P<initial_value>[01\*])\s+!(?P<function>\d*[a-zA-Z_]\w*)\s*\((?P<parameters>(?:\s*\d*[a-zA-Z_]\w*\s*(?:,\s*\d*[a-zA-Z_]\w*\s*)*)|(?:\s*))\)\s+(?P<next_state>\d*[a-zA-Z_]\w*|\*)\s*(?:#.*)?$")
-    move_pattern = re.compile(r"^\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s+(?P<initial_value>[01\*])\s+(?P<next_value>[01\*])\s+(?P<operation>[<>\*])(?:(?<!\*)(?P<count>[1-9][0-9]*)?(?::(?P<fill>[01\*]))?)?\s+(?P<next_state>\d*[a-zA-Z_]\w*|\*)\s*(?:#.*)?$")
-    if_pattern = re.compile(r"^\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s+(?P<initial_value>[01\*])\s+!if\s*\(\s*(?P<condition>\d*[a-zA-Z_]\w*)\s*\)\s*(?P<true_state>\d*[a-zA-Z_]\w*)\s*:\s*(?P<false_state>\d*[a-zA-Z_]\w*)\s*(?:#.*)?$")
-    input_pattern = re.compile(r'^\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s+(?P<initial_value>[01\*])\s+!input\s*\(\s*(?P<min_count>[1-9]\d*|0)\s*,\s*(?:(?P<max_count>[1-9]\d*),\s*)?"(?P<prompt>.*)"\s*\)\s*(?P<next_state>\d*[a-zA-Z_]\w*|\*)\s*(?:#.*)?$')
-    print_str_pattern = re.compile(r'^\s*(?P<initial_state>\d*[a-zA-Z_]\w*)\s+(?P<initial_value>[01\*])\s+!print_str\s*\(\s*"(?P<text>.*)"\s*\)\s*(?P<next_state>\d*[a-zA-Z_]\w*)\s*(?:#.*)?$')
-
-    # Compile the script
-    for line_num, line in enumerate(script):
-        # Use a 1-indexed line number
-        line_num += 1
-
-        empty_line_match = empty_line_pattern.match(line)
-        if empty_line_match is not None:
-            # Empty line
-            continue
+        if stop >= self._length:
+            # Extend the tape
+            self._length = stop + 1
+
+        self._position = stop
+        return (stop - position) // count
+
+    def scan_left(self, count, value, limit=None):
+        """Moves the tape to the left by count cells for as long as the selected value is value (or forever if value
+        is None), but at most limit times, and returns the number of moves made. Raises the same IndexError as left()
+        at position 0."""
+        position = self._position
 
-        new_func_match = new_func_pattern.match(line)
-        if new_func_match is not None:
-            # Start of new function
+        # Find the first cell on the path of the scan that does not match value
+        stop = -1
+        if value is not None:
+            stop = self._find_left(position, count, value)
+        if limit is not None:
+            end = position - limit * count
+            if (stop == -1 or stop < end) and end >= 0:
+                stop = end
 
-            # Get expression information
-            name = new_func_match.group("name")
+        if stop == -1:
+            # Move as far as possible, then fail on the next move like left() does
+            self._position = position % count
+            raise IndexError("TuringTape cannot extend below position 0.")
 
-            if name in BUILTIN_FUNCTIONS:
-                # User tried to re-define builtin function
-                raise ValueError(f'Unable to re-define builtin function "!{name}" on line {line_num}.')
+        self._position = stop
+        return (position - stop) // count
 
-            if name in functions.keys():
-                # Duplicate function name
-                raise ValueError(f"Repeated function name on line {line_num}.")
+    def __len__(self):
+        "Returns the number of cells that the tape has extended to."
+        return self._length
 
-            curr_function = name
-            initial_state = new_func_match.group("initial_state")
+    def get_position(self):
+        "Returns the position of the tape."
+        return self._position
 
-            # Create new function
-            functions[name] = {"parameters": [], "initial_state": initial_state, "expressions": {}}
+    def set_position(self, new_pos):
+        "Sets the position of the tape."
+        if not isinstance(new_pos, int):
+            raise TypeError("new_pos must be an integer")
+        if 0 <= new_pos < self._length:
+            self._position = new_pos
+        else:
+            raise IndexError("Index out of range of tape.")
 
-            # Get parameters
-            parameter_string = new_func_match.group("parameters")
-            for p in parameter_string.split(','):
-                p = p.strip()
-                if p in functions[name]["parameters"]:
-                    raise ValueError(f"Repeated parameter on line {line_num}.")
-                if p != '':
-                    functions[name]["parameters"].append(p)
+    def get_value_at(self, pos):
+        if 0 <= pos < self._length:
+            page, base = self._page(pos // self._page_size)
+            return page if page.__class__ is int else page[base + pos % self._page_size]
+        else:
+            raise IndexError("Index out of range of tape")
 
-            # Main function cannot take any parameters
-            if name == "main" and len(functions[name]["parameters"]) != 0:
-                raise ValueError(f"Main function on line {line_num} must not take any parameters.")
+    def get_bits(self, start, end):
+        "Returns the values from position start up to (but not including) end as a string of bits."
+        if 0 <= start <= end <= self._length:
+            return self._read(start, end).translate(_BIT_CHARACTERS).decode()
+        else:
+            raise IndexError("Index out of range of tape")
 
-            continue
+    def set_bits(self, start, bits):
+        "Sets the values from position start onwards to a string of bits, extending the tape to them if needed."
+        end = start + len(bits)
+        if not 0 <= start <= end <= self._max_size:
+            raise IndexError("Index out of range of tape")
+        if end > self._length:
+            # Extend the tape
+            self._length = end
+        self._write(start, bits.encode().translate(_CELL_CHARACTERS))
 
-        if curr_function is None:
-            # Expression is not inside of a function
-            raise ValueError(f"Expression on line {line_num} is not inside a function.")
+    def pack(self):
+        "Returns the cells, position and new cell value of the tape as bytes, which restore() reads back."
+        parts = [_TAPE_HEADER.pack(self._position, self._length, self._new_cell_value, self._page_size,
+                                   len(self._pages))]
+        size = self._page_size
+        for index in sorted(self._pages):
+            page, base = self._page(index)
+            if page.__class__ is int:
+                parts.append(_TAPE_PAGE.pack(index, page))
+            else:
+                parts.append(_TAPE_PAGE.pack(index, PAGE_DATA))
+                parts.append(bytes(page[base:base + min(size, self._length - index * size)]))
+        return b''.join(parts)
 
-        exec_func_match = exec_func_pattern.match(line)
-        if exec_func_match is not None:
-            # Expression calls a non-special function
-            initial_state = exec_func_match.group("initial_state")
-            initial_value = exec_func_match.group("initial_value")
-            initial_value = '*' if initial_value == '*' else int(initial_value)
+    def restore(self, data, offset=0):
+        """Replaces the tape with one packed by the pack() method of any kind of tape at offset in data, and returns the
+        offset after it."""
+        position, length, new_cell_value, pages, offset = _unpack_tape(self._max_size, data, offset)
+        self._pages = {}
+        self._new_cell_value = new_cell_value
+        self._length = length
+        for start, size, value in pages:
+            if isinstance(value, int):
+                self._fill(start, start + size, value)
+            else:
+                self._write(start, value)
+        self._position = position
+        return offset
 
-            if (initial_state, initial_value) in functions[curr_function]["expressions"].keys():
-                # Repeated expression
-                raise ValueError(f"Repeated expression on line {line_num}.")
+    def _write(self, start, cells):
+        "Sets the values from position start onwards to cells."
+        size = self._page_size
+        written = 0
+        while written < len(cells):
+            index, offset = divmod(start + written, size)
+            count = min(size - offset, len(cells) - written)
+            page, base = self._writable_page(index)
+            page[base + offset:base + offset + count] = cells[written:written + count]
+            written += count
 
-            function = exec_func_match.group("function")
-            if function in ("if", "input", "print_str"):
-                # Special function called with normal syntax
-                raise ValueError(f'Incorrect syntax for executing builtin function "!{function}" on line {line_num}.')
+    def window(self, size):
+        "Like repr(), but only shows the cells within size cells of the cursor. Hidden cells are shown as '...'."
+        position = self._position
+        start = max(0, position - size)
+        end = min(self._length, position + size + 1)
+        return (('[' if position == 0 else '[ ' if start == 0 else '[... ') +
+                ' '.join(map(str, self._read(start, position))) +
+                f">{self.selected}<" +
+                ' '.join(map(str, self._read(position + 1, end))) +
+                (']' if position + 1 == self._length else ' ]' if end == self._length else ' ...]'))
 
-            parameters = []
-            for p in map(str.strip, exec_func_match.group("parameters").split(',')):
-                if p != '':
-                    parameters.append(p)
+    def __repr__(self):
+        "A list-like representation of the tape, where the cursor looks like: '>X<'"
+        return self.window(self._length)
 
-            next_state = exec_func_match.group("next_state")
 
-            if function in ("flag", "print_val") and next_state in (initial_state, '*'):
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
-            elif function == "goto" and next_state in (initial_state, '*') and initial_state == '*':
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
+# Prime that tape hashes are taken modulo. As 2**61 is 1 modulo it, the weight of cell p is just 2**(p % 61)
+_TAPE_HASH_MODULUS = (1 << 61) - 1
 
-            if (function in ("goto, flag") and len(parameters) != 1) or (function == "print_val" and not 0 <= len(parameters) <= 2):
-                # Invalid builtin function call
-                raise ValueError(f'Incorrect number of parameters for function "!{function}" on line {line_num}.')
+class HashedTape:
+    """Wraps a TuringTape or PagedTuringTape and keeps a hash of its cells up to date as it changes, for loop detection.
 
+    The hash is the cells read as a binary number (the first cell is the lowest bit) modulo _TAPE_HASH_MODULUS, so a
+    change to a range of cells only needs the old and new bits of that range. Everything that does not change the
+    cells is passed straight to the wrapped tape.
+    """
+    def __init__(self, tape):
+        self.tape = tape
+        self.hash = self._range_hash(0, len(tape))
 
-            # Add expression
-            functions[curr_function]["expressions"][(initial_state, initial_value)] = \
-                {"is_function": True, "function": function, "parameters": parameters, "next_state": next_state}
+    def __getattr__(self, name):
+        return getattr(self.tape, name)
 
-            continue
+    def _range_hash(self, start, end):
+        "Returns the part of the hash from the cells from position start up to (but not including) end."
+        if start >= end:
+            return 0
+        return int(self.tape.get_bits(start, end)[::-1], 2) * (1 << start % 61) % _TAPE_HASH_MODULUS
 
-        move_match = move_pattern.match(line)
-        if move_match is not None:
-            # Expression does not call a function
-            initial_state = move_match.group("initial_state")
-            initial_value = move_match.group("initial_value")
-            initial_value = '*' if initial_value == '*' else int(initial_value)
+    @property
+    def selected(self):
+        "Returns the selected value."
+        return self.tape.selected
 
-            if (initial_state, initial_value) in functions[curr_function]["expressions"].keys():
-                # Repeated expression
-                raise ValueError(f"Repeated expression on line {line_num}.")
+    @selected.setter
+    def selected(self, new_val):
+        "Sets the selected value."
+        tape = self.tape
+        change = new_val - tape.selected
+        tape.selected = new_val
+        if change:
+            self.hash = (self.hash + change * (1 << tape.get_position() % 61)) % _TAPE_HASH_MODULUS
 
-            next_value = move_match.group("next_value")
-            next_value = '*' if next_value == '*' else int(next_value)
-            operation = move_match.group("operation")
-            count = int(move_match.group("count") or 1)
-            fill = move_match.group("fill") or '*'
-            fill = '*' if fill == '*' else int(fill)
-            next_state = move_match.group("next_state")
+    def right(self, count, fill):
+        "Moves the tape to the right, like the wrapped tape, and updates the hash of the cells that it fills or adds."
+        tape = self.tape
+        position, length = tape.get_position(), len(tape)
+        start = length if fill == '*' else position + 1
+        old_hash = self._range_hash(start, min(length, position + count + 1))
+        tape.right(count, fill)
+        new_hash = self._range_hash(start, min(len(tape), position + count + 1))
+        self.hash = (self.hash - old_hash + new_hash) % _TAPE_HASH_MODULUS
 
-            if operation == '*' and next_state in ('*', initial_state) and ('*' in (initial_value, next_value) or next_value == initial_value):
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
+    def left(self, count, fill):
+        "Moves the tape to the left, like the wrapped tape, and updates the hash of the cells that it fills."
+        tape = self.tape
+        position = tape.get_position()
+        if fill == '*' or position - count < 0:
+            tape.left(count, fill)
+            return
+        old_hash = self._range_hash(position - count, position)
+        tape.left(count, fill)
+        self.hash = (self.hash - old_hash + self._range_hash(position - count, position)) % _TAPE_HASH_MODULUS
 
-            # Add expression
-            functions[curr_function]["expressions"][(initial_state, initial_value)] = \
-                {"is_function": False, "next_value": next_value, "operation": operation, "count": count, "fill": fill, "next_state": next_state}
+    def write(self, bits):
+        "Writes bits to the tape, like the wrapped tape, and updates the hash of the cells that it sets or adds."
+        tape = self.tape
+        position = tape.get_position()
+        end = position + len(bits) + 1
+        old_hash = self._range_hash(position, min(len(tape), end))
+        try:
+            tape.write(bits)
+        finally:
+            self.hash = (self.hash - old_hash + self._range_hash(position, min(len(tape), end))) % _TAPE_HASH_MODULUS
 
-            continue
+    def scan_right(self, count, value, limit=None):
+        "Scans the tape to the right, like the wrapped tape, and updates the hash of the cells that it adds."
+        length = len(self.tape)
+        try:
+            return self.tape.scan_right(count, value, limit)
+        finally:
+            self.hash = (self.hash + self._range_hash(length, len(self.tape))) % _TAPE_HASH_MODULUS
 
-        if_match = if_pattern.match(line)
-        if if_match is not None:
-            initial_state = if_match.group("initial_state")
-            initial_value = if_match.group("initial_value")
-            initial_value = '*' if initial_value == '*' else int(initial_value)
-            condition = if_match.group("condition")
-            true_state = if_match.group("true_state")
-            false_state = if_match.group("false_state")
-
-            if initial_state in (true_state, false_state):
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
-
-            functions[curr_function]["expressions"][(initial_state, initial_value)] = \
-                {"is_function": True, "function": "if", "condition": condition, "true_state": true_state, "false_state": false_state}
-            continue
+    def scan_left(self, count, value, limit=None):
+        return self.tape.scan_left(count, value, limit)
 
-        input_match = input_pattern.match(line)
-        if input_match is not None:
-            initial_state = input_match.group("initial_state")
-            initial_value = input_match.group("initial_value")
-            initial_value = '*' if initial_value == '*' else int(initial_value)
-            # Note: Leave min and max count as strings because they will need to be added to a regex string later
-            min_count = input_match.group("min_count")
-            max_count = input_match.group("max_count")
-            prompt = input_match.group("prompt")
-            next_state = input_match.group("next_state")
-
-            if max_count is None:
-                if min_count == '0':
-                    raise ValueError(f"The minimum input count was 0 and the maximum input count was not specified on line {line_num}.")
-                else:
-                    max_count = min_count
-            elif int(max_count) < int(min_count):
-                raise ValueError(f"The maximum input count is less than the minimum input count on line {line_num}.")
+    def restore(self, data, offset=0):
+        "Restores the wrapped tape and hashes all of its cells again."
+        offset = self.tape.restore(data, offset)
+        self.hash = self._range_hash(0, len(self.tape))
+        return offset
 
-            if next_state in ('*', initial_state) and initial_value == '*':
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
+    def __len__(self):
+        return len(self.tape)
 
-            functions[curr_function]["expressions"][(initial_state, initial_value)] = \
-                {"is_function": True, "function": "input", "min_count": min_count, "max_count": max_count, "prompt": prompt, "next_state": next_state}
+    def __repr__(self):
+        return repr(self.tape)
 
-            continue
 
-        print_str_match = print_str_pattern.match(line)
-        if print_str_match is not None:
-            initial_state = print_str_match.group("initial_state")
-            initial_value = print_str_match.group("initial_value")
-            initial_value = '*' if initial_value == '*' else int(initial_value)
-            text = print_str_match.group("text")
-            next_state = print_str_match.group("next_state")
+class Frame:
+    "A layer of the stack: the id of the function, the positions of its flags (indexed by flag slot) and its state."
+    __slots__ = ("function", "flags", "state")
 
-            if next_state == initial_state:
-                # Infinite loop
-                raise ValueError(f"Infinite loop detected on line {line_num}.")
+    def __init__(self, function, flags, state):
+        self.function = function
+        self.flags = flags
+        self.state = state
 
-            functions[curr_function]["expressions"][(initial_state, initial_value)] = \
-                {"is_function": True, "function": "print_str", "text": text, "next_state": next_state}
-            continue
 
-        # Invalid expression
-        raise ValueError(f"Invalid expression on line {line_num}.")
+class Stack:
+    def __init__(self, max_size):
+        self._items = []
+        self._max_size = max_size
 
-    if "main" not in functions.keys():
-        raise ValueError("No main function specified.")
+    def is_empty(self):
+        return len(self._items) == 0
 
-    # Initialize the tape
-    tape = TuringTape(settings["max_tape_size"])
-    stack = Stack(settings["max_stack_size"])
-    stack.add("main", {}, functions["main"]["initial_state"])
+    def __len__(self):
+        return len(self._items)
 
-    # Run the program
-    while True:
-        # Get the current command
+    def __iter__(self):
+        "Iterates over the frames from the bottom of the stack to the top as (function, flags, state) tuples."
+        for item in self._items:
+            yield item.function, item.flags, item.state
+
+    def add(self, function, flags, state):
+        if len(self._items) == self._max_size:
+            raise IndexError(f"Stack has reached its maximum size of {self._max_size}.")
+        self._items.append(Frame(function, flags, state))
+
+    def replace(self, function, flags, state):
+        "Replaces the top frame, for a tail call."
+        top = self._items[-1]
+        top.function = function
+        top.flags = flags
+        top.state = state
+
+    def pop(self):
+        self._items.pop()
+
+    @property
+    def function(self):
+        return self._items[-1].function
+
+    @property
+    def flags(self):
+        return self._items[-1].flags
+
+    @property
+    def state(self):
+        return self._items[-1].state
+
+    @state.setter
+    def state(self, new_state):
+        self._items[-1].state = new_state
+
+    def get_flag(self, slot):
+        return self._items[-1].flags[slot]
+
+    def set_flag(self, slot, pos):
+        self._items[-1].flags[slot] = pos
+
+
+BUILTIN_FUNCTIONS = {"flag", "goto", "if", "input", "print_str", "print_val"}
+
+# Compile regexes
+file_name_pattern = re.compile(r"^.+\.ftm$")
+empty_line_pattern = re.compile(r"^\s*(?:#.*)?$")
+# Tokens of a piece of a line between whitespace: a comment, a name, a number or any other single character
+token_pattern = re.compile(r"#.*|\d*[a-zA-Z_]\w*|\d+|.")
+piece_pattern = re.compile(r"\S+")
+# The most common expressions, moves and calls, when written on one line with nothing but whitespace and a comment
+# around them. Each line is matched against this once, and only parsed token by token if it does not match.
+simple_expression_pattern = re.compile(r"\s*(\d*[a-zA-Z_]\w*)\s+([01*])\s+(?:([01*])\s+([<>*])(?:(?<!\*)([1-9][0-9]*)?(?::([01*]))?)?|!(\d*[a-zA-Z_]\w*)\s*\(((?:\s*\d*[a-zA-Z_]\w*\s*(?:,\s*\d*[a-zA-Z_]\w*\s*)*)|(?:\s*))\))\s+(\d*[a-zA-Z_]\w*|\*)\s*(?:#.*)?$")
+# Counts of moves and !input calls
+count_pattern = re.compile(r"[1-9][0-9]*")
+min_count_pattern = re.compile(r"[1-9]\d*|0")
+max_count_pattern = re.compile(r"[1-9]\d*")
+# Rest of an !input or !print_str expression after its text: the closing quote and bracket, next state and comment
+string_end_pattern = re.compile(r'"\s*\)\s*(?P<next_state>\d*[a-zA-Z_]\w*|\*)\s*(?:#.*)?$')
+
+# Names that are a single character. Longer name tokens are all of the tokens of word characters that aren't numbers.
+_NAME_CHARACTERS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_")
+_CELL_VALUES = {'0': 0, '1': 1, '*': '*'}
+
+# Version of the compiled program format, used to invalidate cached programs. Bump it whenever compilation changes.
+COMPILED_FORMAT_VERSION = 6
+
+# Opcodes of compiled expressions
+OP_MOVE, OP_FLAG, OP_GOTO, OP_IF, OP_INPUT, OP_PRINT_STR, OP_PRINT_VAL, OP_CALL, OP_SCAN = range(9)
+
+
+def tokenize(line, cache=None):
+    """Splits a line of a script into a list of tokens and a list of whether each token follows whitespace (or the start
+    of the line). Comments are left out, and the tokens stop after a quote, as strings are read from the line itself.
+
+    Lines are split at whitespace first, and the pieces are split into tokens by token_pattern. If cache is a dict,
+    the tokens of each piece are kept in it, so that pieces that come up again (which is most of them) are not split
+    again.
+    """
+    texts = []
+    spaced = []
+    for piece in line.split():
+        tokens = cache.get(piece) if cache is not None else None
+        if tokens is None:
+            piece_texts = []
+            for text in token_pattern.findall(piece):
+                piece_texts.append(text[0] if text[0] == '#' else text)
+                if text[0] in '#"':
+                    break
+            tokens = (piece_texts, [True] + [False] * (len(piece_texts) - 1), piece_texts[-1] in ('#', '"'))
+            if cache is not None:
+                cache[piece] = tokens
+        texts += tokens[0]
+        spaced += tokens[1]
+        if tokens[2]:
+            if texts[-1] == '#':
+                texts.pop()
+                spaced.pop()
+            break
+    return texts, spaced
+
+
+class LineParser:
+    """Parses the tokens of one line of a script.
+
+    Every method raises a ValueError with the line and column of the first token that does not fit. Where spaced is
+    True or False, the token must or must not follow whitespace. cache is passed on to tokenize().
+    """
+    def __init__(self, line, line_num, cache=None):
+        self.line = line
+        self.line_num = line_num
+        self.texts, self.spaced = tokenize(line, cache)
+        self.index = 0
+        # Column of the next state of an !input or !print_str, which is not a token
+        self.string_end_column = None
+
+    def columns(self):
+        "Returns the 1-indexed column of every token, followed by the column after the last token."
+        columns = []
+        for piece in piece_pattern.finditer(self.line):
+            column = piece.start() + 1
+            for text in token_pattern.findall(piece.group()):
+                if len(columns) == len(self.texts):
+                    break
+                columns.append(column)
+                column += len(text)
+        columns.append(columns[-1] + len(self.texts[-1]))
+        return columns
+
+    def error(self, message="Invalid expression", index=None, column=None):
+        """Returns a ValueError for the line, pointing at the token at index (by default the next token, or the end of
+        the line if there are none left) or at column."""
+        if column is None:
+            column = self.columns()[self.index if index is None else index]
+        return ValueError(f"{message} on line {self.line_num}, column {column}.")
+
+    def peek(self, spaced=None):
+        "Returns the text of the next token without reading it, or None if there is none or it is spaced differently."
+        if self.index < len(self.texts) and (spaced is None or spaced == self.spaced[self.index]):
+            return self.texts[self.index]
+        return None
+
+    def take(self, expected=None, spaced=None):
+        "Reads the next token and returns its text. If expected is given, the text must be one of its items."
+        index = self.index
+        if index == len(self.texts) or (expected is not None and self.texts[index] not in expected) or \
+                (spaced is not None and spaced != self.spaced[index]):
+            raise self.error()
+        self.index = index + 1
+        return self.texts[index]
+
+    def name(self, spaced=None, star=False):
+        "Reads a function, state, flag or parameter name, or also '*' if star is True."
+        text = self.take(spaced=spaced)
+        if not ((len(text) > 1 and not text.isdecimal()) or text in _NAME_CHARACTERS or (star and text == '*')):
+            self.index -= 1
+            raise self.error()
+        return text
+
+    def value(self, spaced=None):
+        "Reads a cell value, which is 0, 1 or '*'."
+        return _CELL_VALUES[self.take(_CELL_VALUES, spaced)]
+
+    def number(self, pattern, spaced=None):
+        "Reads a number that matches pattern, and returns it as a string."
+        text = self.take(spaced=spaced)
+        if pattern.fullmatch(text) is None:
+            self.index -= 1
+            raise self.error()
+        return text
+
+    def names(self):
+        "Reads a bracketed list of names separated by commas, and returns the names."
+        self.take('(')
+        names = []
+        if self.peek() != ')':
+            names.append(self.name())
+            while self.peek() == ',':
+                self.take()
+                names.append(self.name())
+        self.take(')')
+        return names
+
+    def string_end(self, star):
+        """Reads a quoted string and the rest of the line, and returns the string and the next state after it.
+
+        The string ends at the last quote on the line that is followed by a closing bracket, a next state (which can
+        only be '*' if star is True) and nothing else but a comment, so it can contain quotes and brackets itself.
+        """
+        self.take('"')
+        # Nothing before the string can contain a quote, so the first one on the line starts it
+        start = self.line.index('"') + 1
+        end = len(self.line)
+        while True:
+            end = self.line.rfind('"', start, end)
+            if end == -1:
+                raise self.error(index=self.index - 1)
+            end_match = string_end_pattern.match(self.line, end)
+            if end_match is not None and (star or end_match.group("next_state") != '*'):
+                self.string_end_column = end_match.start("next_state") + 1
+                return self.line[start:end], end_match.group("next_state")
+
+    def end(self):
+        "Checks that the whole line has been read."
+        if self.index < len(self.texts):
+            raise self.error()
+
+    def function_header(self):
+        "Reads the start of a function, like \"@name(a, b) state\", and returns the name, parameters and initial state."
+        self.take('@')
+        name = self.name(spaced=False)
+        parameters = self.names()
+        initial_state = self.name()
+        self.end()
+        return name, parameters, initial_state
+
+    def operation(self):
+        "Reads the operation of a move, like \">2:0\", and returns the operation, count and fill."
+        operation = self.take(('<', '>', '*'), spaced=True)
+        count = 1
+        fill = '*'
+        if operation != '*':
+            if self.peek(spaced=False) not in (None, ':'):
+                count = int(self.number(count_pattern))
+            if self.peek(spaced=False) == ':':
+                self.take()
+                fill = self.value(spaced=False)
+        return operation, count, fill
+
+    def call(self):
+        "Reads the arguments and next state of a call, like \"(a, b) state\", and returns them."
+        parameters = self.names()
+        next_state = self.name(spaced=True, star=True)
+        self.end()
+        return parameters, next_state
+
+    def expression(self):
+        """Reads an expression and returns its initial state, its initial value and a dict describing it.
+
+        Builtin functions with their own syntax that are called with the syntax of other functions are returned like
+        other calls, so that the error can be reported once the expression has been checked.
+        """
+        line_num = self.line_num
+        initial_state = self.name()
+        initial_value = self.value(spaced=True)
+
+        if self.peek(spaced=True) != '!':
+            # Expression does not call a function
+            next_value = self.value(spaced=True)
+            operation, count, fill = self.operation()
+            next_state = self.name(spaced=True, star=True)
+            self.end()
+            return initial_state, initial_value, \
+                {"is_function": False, "next_value": next_value, "operation": operation, "count": count, "fill": fill, "next_state": next_state, "line": line_num}
+
+        self.take()
+        function = self.name(spaced=False)
+        arguments_index = self.index
         try:
-            cmd = functions[stack.name]["expressions"][(stack.state, '*')]
-        except KeyError:
+            if function == "if":
+                self.take('(')
+                condition = self.name()
+                self.take(')')
+                true_state = self.name()
+                self.take(':')
+                false_state = self.name()
+                self.end()
+                return initial_state, initial_value, \
+                    {"is_function": True, "function": "if", "condition": condition, "true_state": true_state, "false_state": false_state, "line": line_num}
+
+            if function == "input":
+                # Note: Leave min and max count as strings because they will need to be added to a regex string later
+                self.take('(')
+                min_count = self.number(min_count_pattern)
+                self.take(',')
+                max_count = None
+                if self.peek() != '"':
+                    max_count = self.number(max_count_pattern)
+                    self.take(',', spaced=False)
+                prompt, next_state = self.string_end(star=True)
+                return initial_state, initial_value, \
+                    {"is_function": True, "function": "input", "min_count": min_count, "max_count": max_count, "prompt": prompt, "next_state": next_state, "line": line_num}
+
+            if function == "print_str":
+                self.take('(')
+                text, next_state = self.string_end(star=False)
+                return initial_state, initial_value, \
+                    {"is_function": True, "function": "print_str", "text": text, "next_state": next_state, "line": line_num}
+
+        except ValueError as error:
+            # Report the error of the builtin's own syntax, unless it was called like other functions
+            self.index = arguments_index
             try:
-                cmd = functions[stack.name]["expressions"][(stack.state, tape.selected)]
-            except KeyError:
-                # Remove top layer from the stack
-                stack.pop()
-                if stack.is_empty():
-                    break
-                else:
-                    continue
+                self.call()
+            except ValueError:
+                raise error
+            self.index = arguments_index
 
-        # Print the tape/state to the screen as specified in the command line arguments
-        if settings["print_state"]:
-            print(tape, f"Next state: {stack.state}")
-        elif settings["print_tape"]:
-            print(tape)
-
-        if cmd["is_function"]:
-            # Execute function
-            if cmd["function"] == "flag":
-                if len(cmd["parameters"]) != 1:
-                    raise IndexError("Incorrect number of parameters for function !flag.")
-                stack.set_flag(cmd["parameters"][0], tape.get_position())
-                stack.state = cmd["next_state"]
-
-            elif cmd["function"] == "goto":
-                if len(cmd["parameters"]) != 1:
-                    raise IndexError("Incorrect number of parameters for function !goto.")
-                try:
-                    tape.set_position(stack.get_flag(cmd["parameters"][0]))
-                except KeyError:
-                    raise KeyError(f"Flag name {cmd['parameters'][0]} referenced before creation.")
-                stack.state = cmd["next_state"]
+        parameters, next_state = self.call()
+        if not parameters and self.spaced[arguments_index + 1] and function not in BUILTIN_FUNCTIONS:
+            # Brackets with only whitespace between them are not an empty list of arguments
+            raise self.error(f'Incorrect number of parameters for function "!{function}"', arguments_index - 2)
+        return initial_state, initial_value, \
+            {"is_function": True, "function": function, "parameters": parameters, "next_state": next_state, "line": line_num}
 
-            elif cmd["function"] == "if":
-                try:
-                    if stack.get_flag(cmd["condition"]) == tape.get_position():
-                        stack.state = cmd["true_state"]
-                    else:
-                        stack.state = cmd["false_state"]
-                except KeyError:
-                    raise KeyError(f"Flag name {cmd['condition']} referenced before creation.")
-
-            elif cmd["function"] == "input":
-                # Get user input
-                user_input = input(cmd["prompt"] + ' ')
-                user_input_pattern = re.compile("^[01]{" + cmd["min_count"] + ',' + cmd["max_count"] + "}$")
-                user_input_match = user_input_pattern.match(user_input)
-
-                while not user_input_match:
-                    # Get valid user input
-                    if min_count == max_count:
-                        if min_count == '1':
-                            user_input = input(f"ERROR: Enter a single bit: ")
-                        else:
-                            user_input = input(f"ERROR: Enter exactly {cmd['min_count']} bits: ")
-                    else:
-                        user_input = input(f"ERROR: Enter between {cmd['min_count']} and {cmd['max_count']} bits: ")
 
-                    user_input_match = user_input_pattern.match(user_input)
+def parse_script(script):
+    """Parses the lines of a script into a dict of functions, each with its parameters, initial state and expressions.
+
+    script can be any iterable of lines, like an open file, and is read one line at a time. Each line is tokenized once
+    and parsed according to its first tokens. Every error in the script is collected, and they are raised together as
+    one ValueError with a line for each error, giving its line and column. Calls of custom functions are checked once
+    every function has been read, so they can call functions defined after them.
+
+    The most common lines, moves and calls of functions, are matched by simple_expression_pattern instead, which is
+    faster than reading them token by token in Python. Every other line goes through a LineParser.
+    """
+    functions = {}
+    # Line number and message of every error
+    errors = []
+    # Expressions of the current function, or None before the first function
+    expressions = None
+    # Line number, column, function and number of arguments of every call of a custom function
+    calls = []
 
-                # Add user input to the tape
-                for bit in user_input_match.group():
-                    tape.selected = int(bit)
-                    tape.right(1, '*')
+    # Tokens of the pieces of lines seen so far, for tokenize()
+    cache = {}
 
-                if cmd["next_state"] != '*':
-                    stack.state = cmd["next_state"]
+    for line_num, line in enumerate(script, 1):
+        if line_num % 4096 == 0 and len(cache) > 65536:
+            # Keep the memory use bounded for scripts with very many names
+            cache.clear()
 
-            elif cmd["function"] == "print_str":
-                print(cmd["text"])
-                stack.state = cmd["next_state"]
+        try:
+            parser = None
+            expression = None
+            simple_match = simple_expression_pattern.match(line)
+            if simple_match is not None and expressions is not None:
+                initial_state, initial_value, next_value, operation, count, fill, function, parameters, next_state = \
+                    simple_match.groups()
+                initial_value = _CELL_VALUES[initial_value]
+                if function is None:
+                    # Expression does not call a function
+                    expression = {"is_function": False, "next_value": _CELL_VALUES[next_value], "operation": operation, "count": int(count or 1), "fill": _CELL_VALUES[fill or '*'], "next_state": next_state, "line": line_num}
+                elif function not in ("if", "input", "print_str") and (parameters == '' or not parameters.isspace()):
+                    # Calls with only whitespace between their brackets are left to the LineParser to report
+                    parameters = [p for p in map(str.strip, parameters.split(',')) if p != '']
+                    expression = {"is_function": True, "function": function, "parameters": parameters, "next_state": next_state, "line": line_num}
 
-            elif cmd["function"] == "print_val":
-                if len(cmd["parameters"]) == 0:
-                    print(tape.selected)
-                    stack.state = cmd["next_state"]
+            if expression is None:
+                parser = LineParser(line, line_num, cache)
+                if not parser.texts:
+                    # Empty line
                     continue
 
-                try:
-                    first_pos = stack.get_flag(cmd["parameters"][0])
-                except KeyError:
-                    raise KeyError(f"Flag name {cmd['parameters'][0]} referenced before creation.")
+                if parser.peek() == '@':
+                    # Start of new function. If the function is invalid, its expressions are still checked but not kept.
+                    expressions = {}
+                    name, parameters, initial_state = parser.function_header()
+
+                    if name in BUILTIN_FUNCTIONS:
+                        # User tried to re-define builtin function
+                        raise parser.error(f'Unable to re-define builtin function "!{name}"', 1)
 
-                if len(cmd["parameters"]) == 1:
-                    print(tape.get_value_at(first_pos))
-                    stack.state = cmd["next_state"]
+                    if name in functions.keys():
+                        # Duplicate function name
+                        raise parser.error("Repeated function name", 1)
+
+                    for i, p in enumerate(parameters):
+                        if p in parameters[:i]:
+                            # Point at the second use of the parameter, after "@", the name, "(" and the parameters and
+                            # commas before it
+                            raise parser.error("Repeated parameter", 3 + 2 * i)
+
+                    # Main function cannot take any parameters
+                    if name == "main" and len(parameters) != 0:
+                        raise ValueError(f"Main function on line {line_num}, column {parser.columns()[1]} must not "
+                                         "take any parameters.")
+
+                    # Create new function
+                    functions[name] = {"parameters": parameters, "initial_state": initial_state,
+                                       "expressions": expressions, "line": line_num}
                     continue
 
-                try:
-                    second_pos = stack.get_flag(cmd["parameters"][1])
-                except KeyError:
-                    raise KeyError(f"Flag name {cmd['parameters'][1]} referenced before creation.")
+                if expressions is None:
+                    # Expression is not inside of a function
+                    raise ValueError(f"Expression on line {line_num}, column {parser.columns()[0]} is not inside a "
+                                     "function.")
 
-                if first_pos >= second_pos:
-                    raise IndexError(f"Flag {cmd['parameters'][0]} was not found before flag {cmd['parameters'][1]}")
+                initial_state, initial_value, expression = parser.expression()
+
+            # Check the expression, and find the message and the index of the token to point at for any error. An
+            # index of None points at the next state after the text of an !input or !print_str.
+            error = None
+            function = expression.get("function")
+            next_state = expression.get("next_state")
+            if (initial_state, initial_value) in expressions:
+                # Repeated expression
+                error = "Repeated expression", 0
+
+            elif function is None:
+                next_value = expression["next_value"]
+                if expression["operation"] == '*' and next_state in ('*', initial_state) and ('*' in (initial_value, next_value) or next_value == initial_value):
+                    # Infinite loop
+                    error = "Infinite loop detected", -1
 
-                print(''.join(str(tape.get_value_at(pos)) for pos in range(first_pos, second_pos)))
-                stack.state = cmd["next_state"]
+            elif function in ("if", "input", "print_str") and "parameters" in expression:
+                # Special function called with normal syntax
+                error = f'Incorrect syntax for executing builtin function "!{function}"', 2
+
+            elif function == "if":
+                if initial_state in (expression["true_state"], expression["false_state"]):
+                    # Infinite loop
+                    error = "Infinite loop detected", -1
+
+            elif function == "input":
+                min_count, max_count = expression["min_count"], expression["max_count"]
+                if max_count is None:
+                    if min_count == '0':
+                        error = "The minimum input count was 0 and the maximum input count was not specified", 2
+                    else:
+                        expression["max_count"] = min_count
+                elif int(max_count) < int(min_count):
+                    error = "The maximum input count is less than the minimum input count", 2
+
+                if error is None and next_state in ('*', initial_state) and initial_value == '*':
+                    # Infinite loop
+                    error = "Infinite loop detected", None
+
+            elif function == "print_str":
+                if next_state == initial_state:
+                    # Infinite loop
+                    error = "Infinite loop detected", None
 
             else:
-                # Custom function
-                if cmd["function"] not in functions.keys():
-                    raise ValueError(f"Invalid function {cmd['function']}.")
-                if len(cmd["parameters"]) != len(functions[cmd["function"]]["parameters"]):
-                    raise IndexError(f"Incorrect number of parameters for function !{cmd['function']}.")
+                parameters = expression["parameters"]
+                if function in ("flag", "print_val") and next_state in (initial_state, '*'):
+                    # Infinite loop
+                    error = "Infinite loop detected", -1
+                elif function == "goto" and next_state in (initial_state, '*') and initial_state == '*':
+                    # Infinite loop
+                    error = "Infinite loop detected", -1
+                elif (function in ("goto", "flag") and len(parameters) != 1) or (function == "print_val" and not 0 <= len(parameters) <= 2):
+                    # Invalid builtin function call
+                    error = f'Incorrect number of parameters for function "!{function}"', 2
 
-                if cmd["next_state"] != '*':
-                    stack.state = cmd["next_state"]
+            if error is not None:
+                # Lines that took the fast path are only tokenized if they have an error
+                parser = parser or LineParser(line, line_num)
+                message, index = error
+                if index is None:
+                    raise parser.error(message, column=parser.string_end_column)
+                raise parser.error(message, len(parser.texts) - 1 if index == -1 else index)
 
-                # Add new layer to stack
-                flags = {}
-                for i in range(len(cmd["parameters"])):
-                    try:
-                        flags[functions[cmd["function"]]["parameters"][i]] = stack.get_flag(cmd["parameters"][i])
-                    except KeyError:
-                        raise KeyError(f"Flag name {cmd['parameters'][i]} referenced before creation.")
+            # Add expression
+            expressions[(initial_state, initial_value)] = expression
+            if function is not None and function not in BUILTIN_FUNCTIONS:
+                # The "!" of a call is the first one on its line
+                calls.append((line_num, line.index('!') + 1, function, len(expression["parameters"])))
 
-                stack.add(cmd["function"], flags, functions[cmd["function"]]["initial_state"])
+        except ValueError as e:
+            errors.append((line_num, str(e)))
 
-        else:
-            # Move expression
-            # Set the selected value
-            if cmd["next_value"] != '*':
-                tape.selected = cmd["next_value"]
-
-            if cmd["operation"] == '<':
-                tape.left(cmd["count"], cmd["fill"])
-            elif cmd["operation"] == '>':
-                tape.right(cmd["count"], cmd["fill"])
-
-            if cmd["next_state"] != '*':
-                stack.state = cmd["next_state"]
+    for line_num, column, function, argument_count in calls:
+        if function not in functions.keys():
+            errors.append((line_num, f'Invalid function "!{function}" on line {line_num}, column {column}.'))
+        elif argument_count != len(functions[function]["parameters"]):
+            errors.append((line_num, f'Incorrect number of parameters for function "!{function}" on line {line_num}, '
+                                     f'column {column}.'))
+
+    # Report the errors in the order of their lines
+    errors = [message for _, message in sorted(errors, key=lambda error: error[0])]
+    if "main" not in functions.keys():
+        errors.append("No main function specified.")
+
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+    return functions
+
+
+def compile_functions(functions):
+    """Interns function and state names to ints and builds a transition table for every function.
+
+    Each compiled function has a "table" indexed by [state][cell value]. Entries are opcode tuples, or None if no
+    expression matches (which returns from the function). Expressions matching '*' fill both cells of their state.
+
+    Moves that loop back to their own state without changing the tape (e.g. "s 1 * > *") compile to OP_SCAN, which
+    runs the whole loop at once. OP_SCAN has the layout of OP_MOVE, except that the last item is the scanned value
+    instead of the number of steps that the move counts as.
+
+    Flags are interned to slots, which index the function's "flag_names" (parameters first) and the flags list of its
+    stack frames. Calls whose next state returns straight away are marked as tail calls, which reuse the caller's frame.
+
+    Calls of undefined functions and calls with the wrong number of parameters are reported by parse_script, and are
+    checked again here for functions that were not parsed from a script. Every function also gets a "fast_table" from
+    optimize_function.
+    """
+    function_ids = {name: i for i, name in enumerate(functions.keys())}
+    compiled = []
+
+    for name, function in functions.items():
+        state_ids = {}
+        table = []
+
+        def state_id(state):
+            if state not in state_ids:
+                state_ids[state] = len(table)
+                table.append([None, None])
+            return state_ids[state]
+
+        initial_state = state_id(function["initial_state"])
+
+        # Every flag the function uses, starting with its parameters
+        flag_slots = {flag: slot for slot, flag in enumerate(function["parameters"])}
+
+        def flag_slot(flag):
+            if flag not in flag_slots:
+                flag_slots[flag] = len(flag_slots)
+            return flag_slots[flag]
+
+        for (initial_state_name, initial_value), expr in function["expressions"].items():
+            state = state_id(initial_state_name)
+
+            # A next state of '*' stays in the initial state
+            next_state = state
+            if expr.get("next_state", '*') != '*':
+                next_state = state_id(expr["next_state"])
+
+            if not expr["is_function"]:
+                offset = {'<': -expr["count"], '>': expr["count"], '*': 0}[expr["operation"]]
+                next_value = None if expr["next_value"] == '*' else expr["next_value"]
+                cmd = (OP_MOVE, next_value, offset, expr["fill"], next_state, 1)
+
+                if offset != 0 and next_state == state and expr["fill"] == '*' and next_value in (None, initial_value):
+                    # Self-looping scan: keep moving while the cell matches initial_value (any cell for '*')
+                    cmd = (OP_SCAN, next_value, offset, expr["fill"], next_state,
+                           None if initial_value == '*' else initial_value)
+            elif expr["function"] == "flag":
+                cmd = (OP_FLAG, flag_slot(expr["parameters"][0]), next_state)
+            elif expr["function"] == "goto":
+                cmd = (OP_GOTO, flag_slot(expr["parameters"][0]), next_state)
+            elif expr["function"] == "if":
+                cmd = (OP_IF, flag_slot(expr["condition"]), state_id(expr["true_state"]), state_id(expr["false_state"]))
+            elif expr["function"] == "input":
+                cmd = (OP_INPUT, expr["min_count"], expr["max_count"], expr["prompt"], next_state,
+                       input_validator(expr["min_count"], expr["max_count"]))
+            elif expr["function"] == "print_str":
+                cmd = (OP_PRINT_STR, expr["text"], next_state)
+            elif expr["function"] == "print_val":
+                cmd = (OP_PRINT_VAL, tuple(map(flag_slot, expr["parameters"])), next_state)
+            else:
+                if expr["function"] not in function_ids:
+                    raise ValueError(f'Invalid function "!{expr["function"]}" on line {expr["line"]}.')
+                if len(expr["parameters"]) != len(functions[expr["function"]]["parameters"]):
+                    raise ValueError(f'Incorrect number of parameters for function "!{expr["function"]}" on line '
+                                     f'{expr["line"]}.')
+                cmd = (OP_CALL, function_ids[expr["function"]], expr["function"],
+                       tuple(map(flag_slot, expr["parameters"])), next_state, False)
+
+            if initial_value == '*':
+                table[state][0] = table[state][1] = cmd
+            elif table[state][initial_value] is None:
+                # Expressions matching '*' take priority over expressions matching the cell value
+                table[state][initial_value] = cmd
+
+        for row in table:
+            tail_row = [cmd[:5] + (True,) if cmd is not None and cmd[0] == OP_CALL and table[cmd[4]] == [None, None]
+                        else cmd for cmd in row]
+            row[:] = [tail_row[0]] * 2 if row[0] is row[1] else tail_row
+
+        compiled.append({
+            "name": name,
+            "line": function["line"],
+            "parameters": function["parameters"],
+            "flag_names": list(flag_slots),
+            "initial_state": initial_state,
+            "state_names": list(state_ids.keys()),
+            "table": table,
+        })
+        optimize_function(compiled[-1])
+
+    return function_ids, compiled
+
+
+# Largest number of steps that the optimizer merges into one move, so that merged moves never run far past a check
+MAX_MERGED_STEPS = 64
+
+
+def _merge_moves(first, second):
+    "Returns one move that does the same as the move first followed by the move second, or None if there is none."
+    if second is None or second[0] != OP_MOVE:
+        return None
+    _, value, offset, fill, _, steps = first
+    _, second_value, second_offset, second_fill, next_state, second_steps = second
+    if offset == 0:
+        # The cursor has not moved, so the second move starts on the cell that the first one wrote
+        return (OP_MOVE, value if second_value is None else second_value, second_offset, second_fill, next_state,
+                steps + second_steps)
+    if second_value is not None:
+        return None
+    if second_offset == 0:
+        return (OP_MOVE, value, offset, fill, next_state, steps + second_steps)
+    if (offset > 0) != (second_offset > 0) or fill != second_fill:
+        return None
+    return (OP_MOVE, value, offset + second_offset, fill, next_state, steps + second_steps)
+
+
+# Markers for entries of a table that the optimizer has not merged yet, or is merging
+_UNMERGED = object()
+_MERGING = object()
+
+
+def _merge_entry(table, merged, cmd, cell):
+    """Returns the move cmd (the entry of table for cell) merged with the merged entry that follows it, or with the
+    entry of table that follows it if that merge is not possible, or cmd itself if neither merge is."""
+    next_state = cmd[4]
+    if cmd[2] == 0:
+        # The cursor is still on the cell of this entry, so its value is known
+        next_cell = cell if cmd[1] is None else cmd[1]
+        candidates = (merged[next_state][next_cell], table[next_state][next_cell])
+    else:
+        # The value of the next cell is not known, so the next state must do the same thing for both values
+        next_row = merged[next_state]
+        candidates = (next_row[0] if next_row[0] == next_row[1] else None,
+                      table[next_state][0] if table[next_state][0] == table[next_state][1] else None)
+    for second in candidates:
+        if second is _MERGING:
+            # The entries loop back to this one, which has not been merged yet
+            continue
+        merged_cmd = _merge_moves(cmd, second)
+        if merged_cmd is not None and merged_cmd[5] <= MAX_MERGED_STEPS:
+            return merged_cmd
+    return cmd
+
+
+def _next_states(cmd):
+    "Returns the states that cmd can go to."
+    if cmd is None:
+        return ()
+    if cmd[0] in (OP_MOVE, OP_SCAN, OP_INPUT, OP_CALL):
+        return (cmd[4],)
+    if cmd[0] == OP_IF:
+        return (cmd[2], cmd[3])
+    return (cmd[2],)
+
+
+def optimize_function(function):
+    """Adds a "fast_table" to a compiled function, which takes the same steps as its "table" but fewer at a time, and
+    a sorted list of the "live_states" that can be reached in the fast table.
+
+    Chains of moves are merged into one move that counts as all of their steps. This threads jumps through states
+    that only move on to another state (e.g. "a * * * b"), and coalesces moves in the same direction with the same
+    fill (e.g. "a * * > b" followed by "b * * > c"). Moves can only be merged with a state that does the same thing for
+    both cell values, unless the first move stays on its cell, in which case the cell value is known. Each entry is
+    merged once, with the already merged entry that follows it, so the pass takes time linear in the size of the
+    table.
+
+    States of the fast table agree with states of the table, so a run can switch between the two between any steps.
+    """
+    table = function["table"]
+
+    # Merge every entry once, after the entries it can be merged with, so that each one reuses the merged command of
+    # the entry that follows it. merged[state][cell] is _MERGING while the entries that follow it are being merged.
+    merged = [[_UNMERGED, _UNMERGED] for _ in table]
+    for start_state in reversed(range(len(table))):
+        for start_cell in (0, 1):
+            if merged[start_state][start_cell] is not _UNMERGED:
+                continue
+            merged[start_state][start_cell] = _MERGING
+            pending = [(start_state, start_cell)]
+            while pending:
+                state, cell = pending[-1]
+                merged_row = merged[state]
+                if merged_row[cell] is not _MERGING:
+                    # Merged together with the other cell of a '*' expression
+                    pending.pop()
+                    continue
+                row = table[state]
+                cmd = row[cell]
+                if cmd is None or cmd[0] != OP_MOVE:
+                    merged_cmd = cmd
+                else:
+                    next_state = cmd[4]
+                    next_row = merged[next_state]
+                    next_cells = (cell if cmd[1] is None else cmd[1],) if cmd[2] == 0 else (0, 1)
+                    waiting = False
+                    for next_cell in next_cells:
+                        if next_row[next_cell] is _UNMERGED:
+                            next_row[next_cell] = _MERGING
+                            pending.append((next_state, next_cell))
+                            waiting = True
+                    if waiting:
+                        continue
+                    merged_cmd = _merge_entry(table, merged, cmd, cell)
+                pending.pop()
+                merged_row[cell] = merged_cmd
+                if row[0] is row[1] and (cmd is None or cmd[0] != OP_MOVE or cmd[2] != 0 or cmd[1] is not None):
+                    # A '*' expression merges the same way for both cells, unless it stays on a cell it keeps
+                    merged_row[1 - cell] = merged_cmd
+
+    fast_table = []
+    for fast_row in merged:
+        # Keep '*' expressions as one shared entry
+        fast_table.append([fast_row[0]] * 2 if fast_row[0] == fast_row[1] else fast_row)
+
+    # Find the states that can be reached from the initial state
+    live_states = {function["initial_state"]}
+    pending = [function["initial_state"]]
+    while pending:
+        for cmd in fast_table[pending.pop()]:
+            for next_state in _next_states(cmd):
+                if next_state not in live_states:
+                    live_states.add(next_state)
+                    pending.append(next_state)
+
+    function["fast_table"] = fast_table
+    function["live_states"] = sorted(live_states)
+
+
+class Program:
+    "A parsed and compiled Functional Turing Machine program that can be run by any number of machines."
+    def __init__(self, functions):
+        "Compiles the functions returned by parse_script."
+        self.function_ids, self.functions = compile_functions(functions)
+        self.main = self.function_ids["main"]
+        # Path of the script, if it was compiled from a file
+        self.path = None
+        # SHA-256 hex digest of the script, if it was compiled with Program.compile
+        self.source_hash = None
+
+    @classmethod
+    def compile(cls, source, use_cache=True):
+        """Compiles a program from the path of a .ftm file or from the text of a script.
+
+        Strings are treated as a path if they are a single line ending in ".ftm", and as script text otherwise.
+        Programs compiled from a file are cached in a __ftmcache__ directory next to it unless use_cache is False.
+        """
+        if isinstance(source, os.PathLike) or ('\n' not in source and file_name_pattern.match(source)):
+            # Hash and parse the file in pieces, so that very large scripts are never all in memory at once
+            source_hash = cls.hash_file(source)
+            program = None
+            if use_cache:
+                cache_path = cls.cache_path(source)
+                program = cls._load_cache(cache_path, source_hash)
+            if program is None:
+                with open(source, encoding="utf-8") as input_file:
+                    program = cls(parse_script(input_file))
+                if use_cache:
+                    program._save_cache(cache_path, source_hash)
+            program.path = os.fspath(source)
+            program.source_hash = source_hash
+            return program
+
+        program = cls(parse_script(io.StringIO(source, newline=None)))
+        program.source_hash = hashlib.sha256(source.encode()).hexdigest()
+        return program
+
+    @staticmethod
+    def hash_file(source_path):
+        "Returns the SHA-256 hex digest of the script at source_path, reading it in pieces."
+        source_hash = hashlib.sha256()
+        with open(source_path, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b''):
+                source_hash.update(chunk)
+        return source_hash.hexdigest()
+
+    @staticmethod
+    def cache_path(source_path):
+        "Returns the path of the cache file for the script at source_path."
+        directory, file_name = os.path.split(os.fspath(source_path))
+        return os.path.join(directory, "__ftmcache__", f"{file_name}.{COMPILED_FORMAT_VERSION}.pickle")
+
+    @classmethod
+    def _load_cache(cls, cache_path, source_hash):
+        "Returns the cached program, or None if there is no cache or it is stale."
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                version, cached_hash, program = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None
+        if version != COMPILED_FORMAT_VERSION or cached_hash != source_hash or not isinstance(program, cls):
+            return None
+        return program
+
+    def _save_cache(self, cache_path, source_hash):
+        "Writes the program to its cache file. Failing to write the cache is not an error."
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Write to a temporary file first so that other processes never read a partial cache
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as cache_file:
+                pickle.dump((COMPILED_FORMAT_VERSION, source_hash, self), cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+
+
+def generate_python(program):
+    """Returns the source of a Python module that runs program without the interpreter loop.
+
+    Every FTM function becomes a Python function, with its states dispatched through a binary tree of int
+    comparisons, its flags kept in local variables and its calls made as real Python calls. Tail calls of a function to
+    itself restart its loop instead. Other tail calls return the callee and its arguments to the caller, which calls it
+    in place of the function that returned, so that like in the interpreter they do not count towards max_stack. The
+    module's run(tape, output, read_input, max_stack) function runs the program on a TuringTape and returns the step
+    count.
+    """
+    lines = [
+        '"Generated by functional_turing_machine.py. Run it with functional_turing_machine.py on the Python path."',
+        '',
+        '# Set by run()',
+        '_tape = _write = _read_input = _max_stack = None',
+        '_BITS = bytes.maketrans(b"\\x00\\x01", b"01")',
+    ]
+    emit = lines.append
+
+    def flag_check(function, flags, slot, indent):
+        "Emits a check that the flag in slot has been set, unless it is a parameter."
+        if slot >= len(function["parameters"]):
+            name = function["flag_names"][slot]
+            emit(f"{indent}if {flags[slot]} is None:")
+            emit(f"{indent}    raise KeyError({f'Flag name {name} referenced before creation.'!r})")
+
+    def emit_move(cmd, indent):
+        next_value, offset, fill = cmd[1], cmd[2], cmd[3]
+        if next_value is not None:
+            emit(f"{indent}buf[pos] = {next_value}")
+        if offset == 0:
+            return
+        count = abs(offset)
+
+        if offset > 0:
+            emit(f"{indent}if pos + {count} < len(buf):")
+            if fill != '*':
+                emit(f"{indent}    buf[pos + 1:pos + {count + 1}] = {bytes([fill]) * count!r}")
+            emit(f"{indent}    pos += {count}")
+            method = "right"
+        else:
+            emit(f"{indent}if pos >= {count}:")
+            if fill != '*':
+                emit(f"{indent}    buf[pos - {count}:pos] = {bytes([fill]) * count!r}")
+            emit(f"{indent}    pos -= {count}")
+            method = "left"
+
+        # Let the tape extend itself or raise its error
+        emit(f"{indent}else:")
+        emit(f"{indent}    _tape._position = pos")
+        emit(f"{indent}    _tape.{method}({count}, {fill!r})")
+        emit(f"{indent}    pos = _tape._position")
+
+    def emit_cmd(function_id, function, flags, state, cmd, indent):
+        "Emits the code for one table entry."
+        if cmd is None:
+            emit(f"{indent}return pos, steps, None, None")
+            return
+
+        op = cmd[0]
+        emit(f"{indent}steps += {cmd[5] if op == OP_MOVE else 1}")
+        next_state = None
+
+        if op == OP_MOVE:
+            emit_move(cmd, indent)
+            next_state = cmd[4]
+
+        elif op == OP_SCAN:
+            method = "scan_right" if cmd[2] > 0 else "scan_left"
+            emit(f"{indent}_tape._position = pos")
+            emit(f"{indent}steps += _tape.{method}({abs(cmd[2])}, {cmd[5]!r}) - 1")
+            emit(f"{indent}pos = _tape._position")
+
+        elif op in (OP_FLAG, OP_GOTO):
+            if op == OP_FLAG:
+                emit(f"{indent}{flags[cmd[1]]} = pos")
+            else:
+                flag_check(function, flags, cmd[1], indent)
+                emit(f"{indent}pos = {flags[cmd[1]]}")
+            next_state = cmd[2]
+
+        elif op == OP_IF:
+            flag_check(function, flags, cmd[1], indent)
+            emit(f"{indent}state = {cmd[2]} if {flags[cmd[1]]} == pos else {cmd[3]}")
+
+        elif op == OP_INPUT:
+            emit(f"{indent}_tape._position = pos")
+            emit(f"{indent}_tape.write(_read_input({cmd[1]!r}, {cmd[2]!r}, {cmd[3]!r}))")
+            emit(f"{indent}pos = _tape._position")
+            next_state = cmd[4]
+
+        elif op == OP_PRINT_STR:
+            emit(f"{indent}_write({cmd[1] + chr(10)!r})")
+            next_state = cmd[2]
+
+        elif op == OP_PRINT_VAL:
+            slots = cmd[1]
+            for slot in slots:
+                flag_check(function, flags, slot, indent)
+            if len(slots) == 0:
+                emit(f"{indent}_write(f'{{buf[pos]}}\\n')")
+            elif len(slots) == 1:
+                emit(f"{indent}_write(f'{{buf[{flags[slots[0]]}]}}\\n')")
+            else:
+                first, second = flags[slots[0]], flags[slots[1]]
+                names = [function["flag_names"][slot] for slot in slots]
+                emit(f"{indent}if {first} >= {second}:")
+                emit(f"{indent}    raise IndexError({f'Flag {names[0]} was not found before flag {names[1]}'!r})")
+                emit(f"{indent}_write(buf[{first}:{second}].translate(_BITS).decode() + '\\n')")
+            next_state = cmd[2]
+
+        else:
+            callee_id, arguments = cmd[1], cmd[3]
+            for slot in arguments:
+                flag_check(function, flags, slot, indent)
+            if cmd[5] and callee_id == function_id:
+                # Tail call to itself: rebind the parameters, clear the other flags and start again
+                values = [flags[slot] for slot in arguments] + ["None"] * (len(flags) - len(arguments))
+                if flags:
+                    emit(f"{indent}{', '.join(flags)} = {', '.join(values)}")
+                emit(f"{indent}state = {function['initial_state']}")
+                return
+            if cmd[5]:
+                # Tail call of another function: the caller calls it at the same depth once this function returns
+                values = [flags[slot] for slot in arguments]
+                emit(f"{indent}return pos, steps, _f{callee_id}, ({', '.join(values)}{',' if len(values) == 1 else ''})")
+                return
+            emit(f"{indent}if depth == _max_stack:")
+            emit(f"{indent}    raise IndexError(f'Stack has reached its maximum size of {{_max_stack}}.')")
+            emit(f"{indent}pos, callee_steps, tail, arguments = _f{callee_id}(buf, pos, depth + 1{''.join(', ' + flags[slot] for slot in arguments)})")
+            emit(f"{indent}while tail is not None:")
+            emit(f"{indent}    steps += callee_steps")
+            emit(f"{indent}    pos, callee_steps, tail, arguments = tail(buf, pos, depth + 1, *arguments)")
+            emit(f"{indent}steps += callee_steps")
+            next_state = cmd[4]
+
+        if next_state is not None and next_state != state:
+            emit(f"{indent}state = {next_state}")
+
+    def emit_states(function_id, function, flags, states, indent):
+        "Emits a binary tree of comparisons that selects between the given states."
+        if len(states) == 1:
+            state = states[0]
+            cmd_0, cmd_1 = function["fast_table"][state]
+            if cmd_0 is cmd_1:
+                emit_cmd(function_id, function, flags, state, cmd_0, indent)
+            else:
+                emit(f"{indent}if buf[pos]:")
+                emit_cmd(function_id, function, flags, state, cmd_1, indent + "    ")
+                emit(f"{indent}else:")
+                emit_cmd(function_id, function, flags, state, cmd_0, indent + "    ")
+            return
+
+        middle = len(states) // 2
+        emit(f"{indent}if state < {states[middle]}:")
+        emit_states(function_id, function, flags, states[:middle], indent + "    ")
+        emit(f"{indent}else:")
+        emit_states(function_id, function, flags, states[middle:], indent + "    ")
+
+    for function_id, function in enumerate(program.functions):
+        # Give every flag used by the function a local variable
+        flags = [f"flag_{name}" for name in function["flag_names"]]
+        parameter_count = len(function["parameters"])
+
+        emit('')
+        emit('')
+        emit(f"def _f{function_id}(buf, pos, depth{''.join(', ' + flag for flag in flags[:parameter_count])}):")
+        emit(f"    {'@' + function['name']!r}")
+        local_flags = flags[parameter_count:]
+        if local_flags:
+            emit(f"    {' = '.join(local_flags)} = None")
+        emit("    steps = 0")
+        emit(f"    state = {function['initial_state']}")
+        emit("    while True:")
+        emit_states(function_id, function, flags, function["live_states"], "        ")
+
+    lines += [
+        '',
+        '',
+        'def run(tape, output, read_input, max_stack):',
+        '    "Runs the program on tape and returns the number of steps taken."',
+        '    global _tape, _write, _read_input, _max_stack',
+        '    _tape, _write, _read_input, _max_stack = tape, output.write, read_input, max_stack',
+        f'    pos, steps, tail, arguments = _f{program.main}(tape._tape, tape._position, 1)',
+        '    while tail is not None:',
+        '        pos, callee_steps, tail, arguments = tail(tape._tape, pos, 1, *arguments)',
+        '        steps += callee_steps',
+        '    tape._position = pos',
+        '    return steps',
+        '',
+        '',
+        'if __name__ == "__main__":',
+        '    import sys',
+        '    from functional_turing_machine import TuringTape, read_input',
+        '    sys.setrecursionlimit(10000)',
+        '    run(TuringTape(10000), sys.stdout, read_input, 1000)',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+# Compiled patterns of the valid inputs of !input calls, by their minimum and maximum counts
+_input_validators = {}
+
+def input_validator(min_count, max_count):
+    "Returns a compiled pattern that fully matches the valid inputs of an !input call, compiling it the first time."
+    validator = _input_validators.get((min_count, max_count))
+    if validator is None:
+        validator = _input_validators[(min_count, max_count)] = re.compile("[01]{" + min_count + ',' + max_count + "}")
+    return validator
+
+def read_input(min_count, max_count, prompt, inputs=None, validator=None):
+    """Returns the bits for an !input call as a string.
+
+    If inputs is None, the user is prompted until they enter valid input, and a ValueError is raised if standard input
+    is closed first. Otherwise the next string is taken from the inputs iterator without prompting, and a ValueError is
+    raised if there are no inputs left or the input is invalid. validator is the call's pattern from input_validator(),
+    which is looked up if it is not given.
+    """
+    if validator is None:
+        validator = input_validator(min_count, max_count)
+
+    if inputs is not None:
+        # Take the next input without prompting
+        user_input = next(inputs, None)
+        if user_input is None:
+            raise ValueError(f'No input left for "{prompt}".')
+        if validator.fullmatch(user_input) is None:
+            raise ValueError(f'Invalid input "{user_input}" for "{prompt}": expected between {min_count} and {max_count} bits.')
+        return user_input
+
+    try:
+        # Get user input
+        user_input = input(prompt + ' ')
+
+        while validator.fullmatch(user_input) is None:
+            # Get valid user input
+            if min_count == max_count:
+                if min_count == '1':
+                    user_input = input(f"ERROR: Enter a single bit: ")
+                else:
+                    user_input = input(f"ERROR: Enter exactly {min_count} bits: ")
+            else:
+                user_input = input(f"ERROR: Enter between {min_count} and {max_count} bits: ")
+    except EOFError:
+        raise ValueError(f'No input left for "{prompt}".') from None
+
+    return user_input
+
+
+def read_inputs(input_file):
+    """Yields the inputs in an open file for the !input calls of a run, one per line, reading one line at a time.
+    An empty line is an empty input."""
+    for line in input_file:
+        yield line.rstrip('\r\n')
+
+
+class BufferedOutput:
+    "Collects text in memory and writes it to a file in large chunks."
+    def __init__(self, file, max_items=4096):
+        self._file = file
+        self._items = []
+        self._max_items = max_items
+
+    def write(self, text):
+        self._items.append(text)
+        if len(self._items) >= self._max_items:
+            self.flush()
+
+    def flush(self):
+        "Writes all collected text to the file and flushes the file."
+        if self._items:
+            self._file.write(''.join(self._items))
+            self._items.clear()
+        self._file.flush()
+
+
+class Profile:
+    "Step counts and timings collected while a Machine runs a program with profiling enabled."
+    def __init__(self, program):
+        self.program = program
+        functions = program.functions
+        # state_counts[function][state][cell] is the number of steps taken in that state on that cell value
+        self.state_counts = [[[0, 0] for _ in function["table"]] for function in functions]
+        self.calls = [0] * len(functions)
+        self.callers = [{} for _ in functions]
+        self.inclusive_steps = [0] * len(functions)
+        self.self_time = [0.0] * len(functions)
+        self.inclusive_time = [0.0] * len(functions)
+        self.steps = 0
+        self.time = 0.0
+        self.max_tape = 0
+        self.max_stack = 0
+
+        # Frames of the running program: [function, steps on entry, time on entry, time spent in callees]
+        self._frames = []
+        self._active = [0] * len(functions)
+
+    def enter(self, function_id, caller_id, steps):
+        "Records a call of function_id from caller_id (None for main) after the given number of steps."
+        self.calls[function_id] += 1
+        if caller_id is not None:
+            self.callers[function_id][caller_id] = self.callers[function_id].get(caller_id, 0) + 1
+        self._active[function_id] += 1
+        self._frames.append([function_id, steps, time.perf_counter(), 0.0])
+        self.max_stack = max(self.max_stack, len(self._frames))
+
+    def exit(self, steps):
+        "Records the return of the function on top of the stack after the given number of steps."
+        function_id, entry_steps, entry_time, callee_time = self._frames.pop()
+        elapsed = time.perf_counter() - entry_time
+        self.self_time[function_id] += elapsed - callee_time
+        if self._frames:
+            self._frames[-1][3] += elapsed
+
+        # Only count the outermost call of recursive functions towards inclusive totals
+        self._active[function_id] -= 1
+        if self._active[function_id] == 0:
+            self.inclusive_steps[function_id] += steps - entry_steps
+            self.inclusive_time[function_id] += elapsed
+
+    def finish(self, steps, tape):
+        "Records the totals of a run, closing any frames left open by an error."
+        while self._frames:
+            self.exit(steps)
+        self.steps = steps
+        self.max_tape = max(self.max_tape, len(tape))
+
+    def self_steps(self, function_id):
+        "Returns the number of steps taken in the function itself, excluding its callees."
+        return sum(map(sum, self.state_counts[function_id]))
+
+    def hot_states(self):
+        "Returns (steps, function name, state name, cell value) for every state that ran, most steps first."
+        hot = []
+        for function, counts in zip(self.program.functions, self.state_counts):
+            for state, cells in enumerate(counts):
+                for cell, count in enumerate(cells):
+                    if count:
+                        hot.append((count, function["name"], function["state_names"][state], cell))
+        hot.sort(key=lambda entry: -entry[0])
+        return hot
+
+    def report(self, file, limit=20):
+        "Writes a human-readable report to file, listing at most limit of the hottest states."
+        print(f"Profile: {self.steps} steps, max tape length {self.max_tape}, max stack depth {self.max_stack}",
+              file=file)
+        print(file=file)
+        print(f"{'Function':<24}{'Calls':>10}{'Self steps':>14}{'Incl. steps':>14}{'Self time':>12}{'Incl. time':>12}",
+              file=file)
+        order = sorted(range(len(self.calls)), key=lambda f: -self.self_steps(f))
+        for f in order:
+            if self.calls[f]:
+                print(f"{self.program.functions[f]['name']:<24}{self.calls[f]:>10}{self.self_steps(f):>14}"
+                      f"{self.inclusive_steps[f]:>14}{self.self_time[f]:>12.4f}{self.inclusive_time[f]:>12.4f}",
+                      file=file)
+        print(file=file)
+        print(f"{'Steps':>12}  {'Share':>6}  {'Function':<24}{'State':<32}Cell", file=file)
+        for count, function_name, state_name, cell in self.hot_states()[:limit]:
+            print(f"{count:>12}  {100 * count / max(self.steps, 1):>5.1f}%  {function_name:<24}{state_name:<32}{cell}",
+                  file=file)
+
+    def to_json(self):
+        "Returns the profile as a JSON-serializable dict."
+        functions = self.program.functions
+        return {
+            "steps": self.steps,
+            "max_tape": self.max_tape,
+            "max_stack": self.max_stack,
+            "functions": [
+                {
+                    "name": function["name"],
+                    "calls": self.calls[f],
+                    "callers": {functions[caller]["name"]: count for caller, count in self.callers[f].items()},
+                    "self_steps": self.self_steps(f),
+                    "inclusive_steps": self.inclusive_steps[f],
+                    "self_time": self.self_time[f],
+                    "inclusive_time": self.inclusive_time[f],
+                    "states": {
+                        function["state_names"][state]: cells
+                        for state, cells in enumerate(self.state_counts[f]) if any(cells)
+                    },
+                }
+                for f, function in enumerate(functions)
+            ],
+        }
+
+    def save(self, path):
+        """Writes the profile to path, as JSON if path ends with ".json" and in the format of the pstats module
+        otherwise. In the pstats format, times are in seconds and each FTM function is listed by its definition line."""
+        if path.endswith(".json"):
+            with open(path, 'w') as profile_file:
+                json.dump(self.to_json(), profile_file, indent=2)
+            return
+
+        file_name = self.program.path or "<string>"
+        keys = [(file_name, function["line"], function["name"]) for function in self.program.functions]
+        stats = {}
+        for f, key in enumerate(keys):
+            if self.calls[f]:
+                callers = {keys[caller]: count for caller, count in self.callers[f].items()}
+                stats[key] = (self.calls[f], self.calls[f], self.self_time[f], self.inclusive_time[f], callers)
+        with open(path, 'wb') as profile_file:
+            marshal.dump(stats, profile_file)
+
+
+# Step count and stack size of a packed machine state, followed by the tape and the frames of the stack
+_STATE_HEADER = struct.Struct('<QI')
+# Function id, state and number of set flags of a packed stack frame, followed by the flags
+_FRAME_HEADER = struct.Struct('<IIH')
+# Slot and position of a packed flag
+_FRAME_FLAG = struct.Struct('<Hq')
+
+
+def pack_state(program, tape, stack, steps):
+    "Packs the tape and stack of a machine that has taken steps steps into bytes, which unpack_state() reads back."
+    parts = [_STATE_HEADER.pack(steps, len(stack)), tape.pack()]
+    for function_id, flags, state in stack:
+        set_flags = [(slot, pos) for slot, pos in enumerate(flags) if pos is not None]
+        parts.append(_FRAME_HEADER.pack(function_id, state, len(set_flags)))
+        for slot, pos in set_flags:
+            parts.append(_FRAME_FLAG.pack(slot, pos))
+    return b''.join(parts)
+
+
+def unpack_state(program, data, tape, max_stack, offset=0):
+    """Reads a state packed by pack_state() from offset in data into tape, which may be any kind of tape, and returns
+    (tape, stack, steps)."""
+    steps, frame_count = _STATE_HEADER.unpack_from(data, offset)
+    offset = tape.restore(data, offset + _STATE_HEADER.size)
+    stack = Stack(max_stack)
+    for _ in range(frame_count):
+        function_id, state, flag_count = _FRAME_HEADER.unpack_from(data, offset)
+        offset += _FRAME_HEADER.size
+        if function_id >= len(program.functions) or state >= len(program.functions[function_id]["state_names"]):
+            raise ValueError("Saved state does not match the program.")
+        flags = [None] * len(program.functions[function_id]["flag_names"])
+        for _ in range(flag_count):
+            slot, pos = _FRAME_FLAG.unpack_from(data, offset)
+            offset += _FRAME_FLAG.size
+            if slot >= len(flags):
+                raise ValueError("Saved state does not match the program.")
+            flags[slot] = pos
+        stack.add(function_id, flags, state)
+    return tape, stack, steps
+
+
+# Magic bytes at the start of a checkpoint file
+CHECKPOINT_MAGIC = b"FTMCHECK"
+CHECKPOINT_FORMAT_VERSION = 2
+
+# Magic, format version and source hash, followed by a state packed by pack_state()
+_CHECKPOINT_HEADER = struct.Struct('<8sH32s')
+
+
+def save_checkpoint(path, program, tape, stack, steps):
+    """Saves the state of a machine that has taken steps steps to path, so that Machine.run can resume from it. The
+    file is replaced atomically, so an interrupted save leaves the previous checkpoint intact."""
+    source_hash = bytes.fromhex(program.source_hash) if program.source_hash else bytes(32)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as checkpoint_file:
+        checkpoint_file.write(_CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_FORMAT_VERSION, source_hash))
+        checkpoint_file.write(pack_state(program, tape, stack, steps))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path, program, tape, max_stack):
+    "Loads a checkpoint saved by save_checkpoint() for program into tape, and returns (tape, stack, steps)."
+    with open(path, 'rb') as checkpoint_file:
+        data = checkpoint_file.read()
+    if len(data) < _CHECKPOINT_HEADER.size:
+        raise ValueError("Checkpoint file is truncated.")
+    magic, version, source_hash = _CHECKPOINT_HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC:
+        raise ValueError("File is not a checkpoint.")
+    if version != CHECKPOINT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported checkpoint format version {version}.")
+    if source_hash != bytes(32) and program.source_hash and source_hash.hex() != program.source_hash:
+        raise ValueError("Checkpoint was saved from a different program.")
+    try:
+        tape, stack, steps = unpack_state(program, data, tape, max_stack, _CHECKPOINT_HEADER.size)
+    except struct.error:
+        raise ValueError("Checkpoint file is truncated.")
+    if stack.is_empty():
+        raise ValueError("Checkpoint does not contain any stack frames.")
+    return tape, stack, steps
+
+
+# Magic bytes at the start of a trace file and at the end of its snapshot index
+TRACE_MAGIC = b"FTMTRACE"
+TRACE_INDEX_MAGIC = b"FTMINDEX"
+TRACE_FORMAT_VERSION = 3
+
+# Kinds of trace records
+TRACE_MOVE, TRACE_SCAN, TRACE_GOTO, TRACE_FLAG, TRACE_CALL, TRACE_RETURN, TRACE_INPUT, TRACE_SNAPSHOT, TRACE_TAIL_CALL = \
+    range(9)
+
+# Magic, format version, source hash, maximum tape size, maximum stack size and snapshot interval
+_TRACE_HEADER = struct.Struct('<8sH32sQQQ')
+# Kind, next state, head delta, written value and fill value (-1 for '*')
+_TRACE_MOVE = struct.Struct('<BIibb')
+# Kind, head delta of each move and number of moves
+_TRACE_SCAN = struct.Struct('<BiQ')
+# Kind, next state and new position
+_TRACE_GOTO = struct.Struct('<BIq')
+# Kind, next state and flag slot
+_TRACE_FLAG = struct.Struct('<BIH')
+# Kind, next state of the caller (unused for tail calls), callee id and number of parameters, followed by the position
+# of each parameter
+_TRACE_CALL = struct.Struct('<BIIH')
+_TRACE_POSITION = struct.Struct('<q')
+# Kind, next state and number of bits, followed by one byte per bit
+_TRACE_INPUT = struct.Struct('<BIQ')
+# Kind and length, followed by a state packed by pack_state()
+_TRACE_SNAPSHOT = struct.Struct('<BQ')
+# Step and file offset of a snapshot
+_TRACE_INDEX_ENTRY = struct.Struct('<QQ')
+# Offset of the index, number of index entries and magic
+_TRACE_FOOTER = struct.Struct('<QQ8s')
+
+
+class TraceWriter:
+    """Records every step of a run to a trace file in a compact binary format, which TraceReader can seek through.
+
+    Every step is a small record of how it changed the machine, and a snapshot of the whole tape and stack is written
+    every snapshot_every steps. The file ends with an index of the snapshots.
+    """
+    def __init__(self, path, program, max_tape, max_stack, snapshot_every=100000):
+        if snapshot_every < 1:
+            raise ValueError("Snapshot interval must be at least 1.")
+        self.program = program
+        self.snapshot_every = snapshot_every
+        self.next_snapshot = 0
+        self._index = []
+        self._file = open(path, 'wb')
+        self._write = self._file.write
+        source_hash = bytes.fromhex(program.source_hash) if program.source_hash else bytes(32)
+        self._write(_TRACE_HEADER.pack(TRACE_MAGIC, TRACE_FORMAT_VERSION, source_hash, max_tape, max_stack,
+                                       snapshot_every))
+
+    def snapshot(self, steps, tape, stack):
+        "Writes a snapshot of the tape and stack after steps steps."
+        state = pack_state(self.program, tape, stack, steps)
+        self._index.append((steps, self._file.tell()))
+        self._write(_TRACE_SNAPSHOT.pack(TRACE_SNAPSHOT, len(state)))
+        self._write(state)
+        self.next_snapshot = steps + self.snapshot_every
+
+    def move(self, state, delta, value, fill):
+        "Records a step that wrote value (None to keep the cell), moved delta cells filling with fill, and went to state."
+        self._write(_TRACE_MOVE.pack(TRACE_MOVE, state, delta, -1 if value is None else value,
+                                     -1 if fill == '*' else fill))
+
+    def scan(self, delta, moves):
+        "Records moves steps that each moved delta cells without changing the state."
+        self._write(_TRACE_SCAN.pack(TRACE_SCAN, delta, moves))
+
+    def goto(self, state, position):
+        "Records a step that moved to position and went to state."
+        self._write(_TRACE_GOTO.pack(TRACE_GOTO, state, position))
+
+    def flag(self, state, slot):
+        "Records a step that set the flag in slot to the position and went to state."
+        self._write(_TRACE_FLAG.pack(TRACE_FLAG, state, slot))
+
+    def call(self, state, callee_id, positions):
+        "Records a step that called callee_id with flags at positions, returning to state afterwards."
+        self._write(_TRACE_CALL.pack(TRACE_CALL, state, callee_id, len(positions)))
+        for position in positions:
+            self._write(_TRACE_POSITION.pack(position))
+
+    def tail_call(self, callee_id, positions):
+        "Records a step that replaced the function at the top of the stack with callee_id, with flags at positions."
+        self._write(_TRACE_CALL.pack(TRACE_TAIL_CALL, 0, callee_id, len(positions)))
+        for position in positions:
+            self._write(_TRACE_POSITION.pack(position))
+
+    def ret(self):
+        "Records a return from the function at the top of the stack."
+        self._write(bytes([TRACE_RETURN]))
+
+    def input(self, state, bits):
+        "Records a step that wrote the input bits to the tape and went to state."
+        self._write(_TRACE_INPUT.pack(TRACE_INPUT, state, len(bits)))
+        self._write(bits.encode().translate(_CELL_CHARACTERS))
+
+    def close(self):
+        "Writes the snapshot index and closes the file."
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._write(_TRACE_INDEX_ENTRY.pack(*entry))
+        self._write(_TRACE_FOOTER.pack(index_offset, len(self._index), TRACE_INDEX_MAGIC))
+        self._file.close()
+
+
+class TraceReader:
+    """Reads a trace file written by TraceWriter. The file is memory-mapped, so traces do not need to fit in memory.
+
+    If the run that wrote the trace was killed before the index was written, the index is rebuilt by scanning the file.
+    """
+    def __init__(self, path, program):
+        self.program = program
+        with open(path, 'rb') as trace_file:
+            self._data = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._data
+        if len(data) < _TRACE_HEADER.size:
+            raise ValueError("Trace file is truncated.")
+        magic, version, source_hash, self.max_tape, self.max_stack, self.snapshot_every = \
+            _TRACE_HEADER.unpack_from(data)
+        if magic != TRACE_MAGIC:
+            raise ValueError("File is not a trace.")
+        if version != TRACE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported trace format version {version}.")
+        if source_hash != bytes(32) and program.source_hash and source_hash.hex() != program.source_hash:
+            raise ValueError("Trace was recorded from a different program.")
+
+        self._end = len(data)
+        if self._end >= _TRACE_HEADER.size + _TRACE_FOOTER.size:
+            index_offset, count, magic = _TRACE_FOOTER.unpack_from(data, self._end - _TRACE_FOOTER.size)
+            if magic == TRACE_INDEX_MAGIC:
+                self._end = index_offset
+                self._index = [_TRACE_INDEX_ENTRY.unpack_from(data, index_offset + i * _TRACE_INDEX_ENTRY.size)
+                               for i in range(count)]
+            else:
+                self._index = self._scan_index()
+        else:
+            self._index = self._scan_index()
+        if not self._index:
+            raise ValueError("Trace does not contain any snapshots.")
+        self._index_steps = [step for step, _ in self._index]
+
+    def _scan_index(self):
+        "Finds the snapshots by reading every record, and returns their (step, offset) pairs."
+        index = []
+        for kind, offset, step in self._records(_TRACE_HEADER.size, 0):
+            if kind == TRACE_SNAPSHOT:
+                index.append((step, offset))
+        return index
+
+    def _records(self, offset, step):
+        """Yields (kind, offset, step) for each complete record from offset onwards, where step is the step count
+        before the record. A truncated record at the end of the file is ignored."""
+        data = self._data
+        end = self._end
+        while offset < end:
+            kind = data[offset]
+            if kind == TRACE_MOVE:
+                size = _TRACE_MOVE.size
+                new_step = step + 1
+            elif kind == TRACE_SCAN:
+                size = _TRACE_SCAN.size
+                new_step = step + _TRACE_SCAN.unpack_from(data, offset)[2] if offset + size <= end else step
+            elif kind == TRACE_GOTO:
+                size = _TRACE_GOTO.size
+                new_step = step + 1
+            elif kind == TRACE_FLAG:
+                size = _TRACE_FLAG.size
+                new_step = step + 1
+            elif kind in (TRACE_CALL, TRACE_TAIL_CALL):
+                size = _TRACE_CALL.size
+                if offset + size <= end:
+                    size += _TRACE_CALL.unpack_from(data, offset)[3] * _TRACE_POSITION.size
+                new_step = step + 1
+            elif kind == TRACE_RETURN:
+                size = 1
+                new_step = step
+            elif kind == TRACE_INPUT:
+                size = _TRACE_INPUT.size
+                if offset + size <= end:
+                    size += _TRACE_INPUT.unpack_from(data, offset)[2]
+                new_step = step + 1
+            elif kind == TRACE_SNAPSHOT:
+                size = _TRACE_SNAPSHOT.size
+                if offset + size <= end:
+                    size += _TRACE_SNAPSHOT.unpack_from(data, offset)[1]
+                    step = _STATE_HEADER.unpack_from(data, offset + _TRACE_SNAPSHOT.size)[0]
+                new_step = step
+            else:
+                raise ValueError(f"Invalid trace record at offset {offset}.")
+            if offset + size > end:
+                return
+            yield kind, offset, step
+            offset += size
+            step = new_step
+
+    def seek(self, step):
+        """Returns (tape, stack, steps) for the machine after step steps, where steps is the number of steps actually
+        taken, which is less than step if the trace ends first. If step is None, the end of the trace is used.
+
+        Starts from the nearest snapshot before step, so the work done is proportional to the snapshot interval.
+        """
+        data = self._data
+        functions = self.program.functions
+        i = len(self._index) - 1 if step is None else max(bisect.bisect_right(self._index_steps, step) - 1, 0)
+        offset = self._index[i][1]
+        tape, stack, steps = unpack_state(self.program, data, PagedTuringTape(self.max_tape), self.max_stack,
+                                          offset + _TRACE_SNAPSHOT.size)
+
+        for kind, offset, _ in self._records(offset, steps):
+            if kind == TRACE_SNAPSHOT:
+                continue
+            if kind != TRACE_RETURN and step is not None and steps >= step:
+                # Returns taken before the next step still belong to this step
+                break
+
+            if kind == TRACE_MOVE:
+                _, state, delta, value, fill = _TRACE_MOVE.unpack_from(data, offset)
+                if value != -1:
+                    tape.selected = value
+                if delta < 0:
+                    tape.left(-delta, '*' if fill == -1 else fill)
+                elif delta > 0:
+                    tape.right(delta, '*' if fill == -1 else fill)
+                stack.state = state
+                steps += 1
+            elif kind == TRACE_SCAN:
+                _, delta, moves = _TRACE_SCAN.unpack_from(data, offset)
+                if step is not None:
+                    moves = min(moves, step - steps)
+                if delta < 0:
+                    tape.left(-delta * moves, '*')
+                else:
+                    tape.right(delta * moves, '*')
+                steps += moves
+            elif kind == TRACE_GOTO:
+                _, state, position = _TRACE_GOTO.unpack_from(data, offset)
+                tape.set_position(position)
+                stack.state = state
+                steps += 1
+            elif kind == TRACE_FLAG:
+                _, state, index = _TRACE_FLAG.unpack_from(data, offset)
+                stack.set_flag(index, tape.get_position())
+                stack.state = state
+                steps += 1
+            elif kind in (TRACE_CALL, TRACE_TAIL_CALL):
+                _, state, callee_id, count = _TRACE_CALL.unpack_from(data, offset)
+                callee = functions[callee_id]
+                flags = list(struct.unpack_from(f'<{count}q', data, offset + _TRACE_CALL.size))
+                flags += [None] * (len(callee["flag_names"]) - count)
+                if kind == TRACE_TAIL_CALL:
+                    stack.replace(callee_id, flags, callee["initial_state"])
+                else:
+                    stack.state = state
+                    stack.add(callee_id, flags, callee["initial_state"])
+                steps += 1
+            elif kind == TRACE_RETURN:
+                stack.pop()
+            elif kind == TRACE_INPUT:
+                _, state, count = _TRACE_INPUT.unpack_from(data, offset)
+                start = offset + _TRACE_INPUT.size
+                tape.write(bytes(data[start:start + count]).translate(_BIT_CHARACTERS).decode())
+                stack.state = state
+                steps += 1
+
+        return tape, stack, steps
+
+    def close(self):
+        self._data.close()
+
+
+class CallMemo:
+    """Summaries of calls of custom functions, which a Machine that memoizes calls applies instead of running a call
+    again.
+
+    A call only reads the cells that the cursor visits, so what it does depends only on the function, the offsets of
+    its arguments from the cursor and the cells in the window from the lowest to the highest position it visits. Each
+    function and its argument offsets have one window, which grows to cover every call of it. The first call only
+    finds the window. Later calls read the cells of the window before they start, and either find a summary of a call
+    with the same cells or are run and summarized: the cells they visited afterwards, the displacement of the cursor,
+    the number of steps and the depth of the stack they needed. Calls that take input or print are never summarized.
+
+    Looking a call up costs about as much as running a few steps, so functions are added to skipped, and no longer
+    looked up, once one of their windows grows past max_window cells, or once the summaries found for their last
+    CHECK_LOOKUPS calls saved fewer than MIN_SAVED_STEPS steps per call. This is the case for functions whose calls are
+    rarely repeated or take only a few steps.
+
+    At most max_size summaries are kept, dropping the least recently used first. hits and misses count the calls that
+    were and were not found.
+    """
+    # Number of calls of a function after which the steps saved by its summaries are checked
+    CHECK_LOOKUPS = 256
+    # Steps per call that summaries must save for a function to keep being looked up
+    MIN_SAVED_STEPS = 8
+
+    def __init__(self, max_size=4096, max_window=4096):
+        if max_size < 1:
+            raise ValueError("Memo size must be at least 1.")
+        self.max_size = max_size
+        self.max_window = max_window
+        # Maps (function, offsets, low, high, cells) to (low, cells, displacement, steps, depth), where the key's low
+        # and high are the window and its cells are the cells before the call, and the value's low and cells are the
+        # cells that the call visited afterwards
+        self._summaries = collections.OrderedDict()
+        # Maps (function, offsets) to the (low, high) window that calls are summarized with
+        self._windows = collections.OrderedDict()
+        # Maps functions to the number of their calls looked up since the last check and the steps that the summaries
+        # found for them saved
+        self._lookups = {}
+        self.skipped = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        "Returns the number of summaries."
+        return len(self._summaries)
+
+    @staticmethod
+    def _read(tape, start, end):
+        "Returns the values from position start up to (but not including) end as bits, with 0 for cells past the end."
+        length = len(tape)
+        if start >= length:
+            return '0' * (end - start)
+        if end <= length:
+            return tape.get_bits(start, end)
+        return tape.get_bits(start, length) + '0' * (end - length)
+
+    def lookup(self, function_id, offsets, tape, position):
+        """Returns (summary, window) for a call of function_id with the cursor at position and its arguments at offsets
+        from it, or None if such calls are no longer looked up. summary is None if no summary matches the cells around
+        position. In that case, window is the (low, high, cells) to pass to store() once the call returns, or None if
+        the call's window is not known yet."""
+        if function_id in self.skipped:
+            return None
+        lookups = self._lookups.get(function_id)
+        if lookups is None:
+            lookups = self._lookups[function_id] = [0, 0]
+        elif lookups[0] == self.CHECK_LOOKUPS:
+            if lookups[1] < self.CHECK_LOOKUPS * self.MIN_SAVED_STEPS:
+                self.skipped.add(function_id)
+                return None
+            lookups[0] = lookups[1] = 0
+        lookups[0] += 1
+
+        window = self._windows.get((function_id, offsets))
+        if window is None or position + window[0] < 0:
+            return None, None
+        low, high = window
+        cells = self._read(tape, position + low, position + high + 1)
+        key = (function_id, offsets, low, high, cells)
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+            lookups[1] += summary[3]
+            return summary, None
+        return None, (low, high, cells)
+
+    def store(self, function_id, offsets, window, tape, position, low, high, displacement, steps, depth):
+        """Summarizes a call that started at position and visited the cells from position + low to position + high,
+        given the window that lookup() returned for it. If the call visited cells outside of the window, the window
+        grows to cover them for later calls instead."""
+        if window is not None and window[0] <= low and high <= window[1]:
+            cells = self._read(tape, position + low, position + high + 1)
+            self._summaries[(function_id, offsets) + window] = (low, cells, displacement, steps, depth)
+            if len(self._summaries) > self.max_size:
+                self._summaries.popitem(last=False)
+            return
+
+        key = (function_id, offsets)
+        window = self._windows.get(key)
+        if window is not None:
+            low, high = min(window[0], low), max(window[1], high)
+        if high - low >= self.max_window:
+            self.skipped.add(function_id)
+            return
+        self._windows[key] = (low, high)
+        if len(self._windows) > self.max_size:
+            self._windows.popitem(last=False)
+
+
+class _CallRecord:
+    "A call that a Machine is running and will summarize in its CallMemo once it returns."
+    __slots__ = ("function", "offsets", "window", "start", "steps", "depth", "low", "high", "max_depth", "impure")
+
+    def __init__(self, function, offsets, window, start, steps, depth):
+        self.function = function
+        self.offsets = offsets
+        self.window = window
+        # Position and step count when the call started, and the size of the stack below the callee
+        self.start = start
+        self.steps = steps
+        self.depth = depth
+        # Lowest and highest positions that the cursor has visited and the largest size that the stack has reached
+        self.low = self.high = start
+        self.max_depth = depth + 1
+        # Whether the call has taken input or printed
+        self.impure = False
+
+
+class Machine:
+    """Runs a compiled Program. Each call to run() starts with a fresh tape and stack.
+
+    The "interpreter" backend runs the program's transition tables. The "python" backend runs the module returned by
+    generate_python instead, which is faster but cannot print the tape or state after every step or profile the run.
+
+    If profile is True, every run collects a Profile of the run, which is available as self.profile afterwards. If
+    record is the path of a file, every run is recorded to it by a TraceWriter, with a snapshot every snapshot_every
+    steps. If checkpoint is the path of a file, the state of the machine is saved to it every checkpoint_every steps.
+
+    If paged_tape is True or tape_file is set, runs use a PagedTuringTape instead of a TuringTape, stored in tape_file
+    if it is set. The python backend only supports TuringTape.
+
+    print_tape and print_state print the whole tape before every step. If trace_window is set, only the cells within
+    trace_window cells of the cursor are printed instead. If trace_changes is True, only the position of the cursor
+    and the value of the cell it was on are printed after every step.
+
+    If max_steps is set, runs that take more than max_steps steps raise an IndexError. If detect_loops is True, runs
+    that get back to a configuration (stack, states, flags, position and tape) they have been in before raise a
+    ValueError naming the states of the loop, as they would never finish. Loops are found with Brent's cycle detection
+    on a hash of the configuration, with the tape's hash kept up to date by a HashedTape, and each match is checked
+    against a packed copy of the configuration. The python backend supports neither.
+
+    If memoize is True, calls of custom functions are summarized in a CallMemo of memo_size summaries, which is kept
+    as self.memo and shared by every run of the machine. A call that matches a summary has its effect applied to the
+    tape in one go instead of being run. Tail calls are not summarized on their own, as they are part of their caller's
+    call. Memoizing cannot be combined with tracing, profiling, recording, loop detection or the python backend.
+    """
+    def __init__(self, program, max_tape=10000, max_stack=1000, print_tape=False, print_state=False,
+                 backend="interpreter", profile=False, trace_window=None, trace_changes=False, record=None,
+                 snapshot_every=100000, checkpoint=None, checkpoint_every=1000000, paged_tape=False, tape_file=None,
+                 max_steps=None, detect_loops=False, memoize=False, memo_size=4096):
+        if max_tape < 1:
+            raise ValueError("Maximum tape size must be at least 1.")
+        if max_stack < 1:
+            raise ValueError("Maximum stack size must be at least 1.")
+        if backend not in ("interpreter", "python"):
+            raise ValueError(f"Invalid backend: {backend}.")
+        if trace_window is not None and trace_window < 0:
+            raise ValueError("Trace window must not be negative.")
+        if backend == "python" and (print_tape or print_state or profile or trace_window is not None or trace_changes):
+            raise ValueError("The python backend cannot trace or profile the program.")
+        if backend == "python" and record is not None:
+            raise ValueError("The python backend cannot record the program.")
+        if backend == "python" and checkpoint is not None:
+            raise ValueError("The python backend cannot checkpoint the program.")
+        if backend == "python" and (paged_tape or tape_file is not None):
+            raise ValueError("The python backend cannot use a paged tape.")
+        if snapshot_every < 1:
+            raise ValueError("Snapshot interval must be at least 1.")
+        if checkpoint_every < 1:
+            raise ValueError("Checkpoint interval must be at least 1.")
+        if max_steps is not None and max_steps < 1:
+            raise ValueError("Maximum number of steps must be at least 1.")
+        if backend == "python" and (max_steps is not None or detect_loops):
+            raise ValueError("The python backend cannot limit the steps or detect loops.")
+        if backend == "python" and memoize:
+            raise ValueError("The python backend cannot memoize calls.")
+        if memoize and (print_tape or print_state or trace_window is not None or trace_changes or profile or
+                        record is not None or detect_loops):
+            raise ValueError("Memoizing calls cannot be combined with tracing, profiling, recording or loop detection.")
+        self.program = program
+        self.max_tape = max_tape
+        self.max_stack = max_stack
+        self.print_tape = print_tape
+        self.print_state = print_state
+        self.trace_window = trace_window
+        self.trace_changes = trace_changes
+        self.profiling = profile
+        self.record = record
+        self.snapshot_every = snapshot_every
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.paged_tape = paged_tape or tape_file is not None
+        self.tape_file = tape_file
+        self.max_steps = max_steps
+        self.detect_loops = detect_loops
+        self.memo = CallMemo(memo_size) if memoize else None
+        self.profile = None
+        self.tape = None
+        self.steps = 0
+
+        self._generated = None
+        if backend == "python":
+            self._generated = {"__name__": "ftm_generated"}
+            exec(compile(generate_python(program), "<ftm_generated>", "exec"), self._generated)
+
+    def _new_tape(self):
+        "Returns an empty tape of the kind that the machine was created with."
+        if self.tape_file is not None and self.tape is not None:
+            # The new tape reuses the file, so the previous run's tape cannot be kept
+            self.tape.close()
+        if self.paged_tape:
+            tape = PagedTuringTape(self.max_tape, path=self.tape_file)
+        else:
+            tape = TuringTape(self.max_tape)
+        return HashedTape(tape) if self.detect_loops else tape
+
+    def run(self, tape_contents=None, output=None, inputs=None, resume=None):
+        """Runs the program and returns the number of steps taken.
+
+        tape_contents is an optional string or iterable of bits that the tape starts with (the position still starts
+        at 0), and output is the file that the program prints to (sys.stdout by default). Output is buffered, and is
+        flushed before every !input and at the end of the run. If inputs is given, each !input takes the next bit
+        string from it instead of prompting the user, and a missing or invalid input raises a ValueError. After the
+        run, the final tape is available as self.tape.
+
+        If resume is the path of a checkpoint, the run continues from the saved state instead of starting at main,
+        and the returned number of steps includes the steps taken before the checkpoint. Output printed before the
+        checkpoint was saved is not printed again.
+        """
+        if resume is not None and tape_contents:
+            raise ValueError("Cannot set the tape contents of a resumed run.")
+        if resume is not None and self._generated is not None:
+            raise ValueError("The python backend cannot resume from a checkpoint.")
+
+        output = BufferedOutput(sys.stdout if output is None else output)
+        write = output.write
+        if inputs is not None:
+            inputs = iter(inputs)
+
+        def get_input(min_count, max_count, prompt, validator=None):
+            output.flush()
+            return read_input(min_count, max_count, prompt, inputs, validator)
+
+        functions = self.program.functions
+        tape = self.tape = self._new_tape()
+        if resume is not None:
+            tape, stack, steps = load_checkpoint(resume, self.program, tape, self.max_stack)
+        else:
+            stack = Stack(self.max_stack)
+            main = functions[self.program.main]
+            stack.add(self.program.main, [None] * len(main["flag_names"]), main["initial_state"])
+            steps = 0
+        if tape_contents:
+            tape.write(''.join(map(str, tape_contents)))
+            tape.set_position(0)
+
+        if self._generated is not None:
+            # Each FTM call is a Python call, so allow at least max_stack nested calls
+            recursion_limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(recursion_limit, 2 * self.max_stack + 100))
+            try:
+                self.steps = self._generated["run"](tape, output, get_input, self.max_stack)
+            finally:
+                sys.setrecursionlimit(recursion_limit)
+                output.flush()
+            return self.steps
+
+        # Keep the top frame in local variables, and only sync it with the stack on calls and returns
+        print_state = self.print_state
+        print_tape = self.print_tape
+        trace_window = self.trace_window
+        trace_changes = self.trace_changes
+        tracing = print_state or print_tape or trace_changes
+        # Tracing, profiling, recording and loop detection need to see every step, so they use the unoptimized tables
+        table_name = "table" if tracing or self.profiling or self.record is not None or self.detect_loops \
+            else "fast_table"
+        function = functions[stack.function]
+        table = function[table_name]
+        state = stack.state
+        flags = stack.flags
+
+        profile = None
+        if self.profiling:
+            profile = self.profile = Profile(self.program)
+            caller_id = None
+            for function_id, _, _ in stack:
+                profile.enter(function_id, caller_id, steps)
+                caller_id = function_id
+            counts = profile.state_counts[stack.function]
+
+        checkpoint = self.checkpoint
+        next_checkpoint = steps + self.checkpoint_every if checkpoint is not None else float('inf')
+
+        recorder = None
+        if self.record is not None:
+            recorder = TraceWriter(self.record, self.program, self.max_tape, self.max_stack, self.snapshot_every)
+            recorder.snapshot(steps, tape, stack)
+        max_steps = self.max_steps if self.max_steps is not None else float('inf')
+
+        detect_loops = self.detect_loops
+        if detect_loops:
+            # Hashes of the frames below the top one, which do not change until it returns
+            frame_hashes = [0]
+            for function_id, frame_flags, frame_state in list(stack)[:-1]:
+                frame_hashes.append(hash((frame_hashes[-1], function_id, frame_state, tuple(frame_flags))))
+            # Brent's cycle detection: compare every configuration with the one saved at the last power of two
+            saved_hash = saved_state = None
+            saved_steps = 0
+            power = 1
+            distance = 0
+            loop_states = {}
+
+        memo = self.memo
+        if memo is not None:
+            memo.hits = memo.misses = 0
+        # Calls being summarized for the memo, from the outermost to the innermost one, which is also call_record
+        call_records = []
+        call_record = None
+
+        # Step at which the next snapshot, checkpoint or check is due, so that the loop only needs to check one number
+        next_save = min(next_checkpoint, recorder.next_snapshot if recorder is not None else float('inf'), max_steps)
+        if detect_loops:
+            next_save = 0
+
+        try:
+            while True:
+                # Get the current command
+                cell = tape.selected
+                cmd = table[state][cell]
+                if cmd is None:
+                    # Remove top layer from the stack
+                    stack.pop()
+                    if profile is not None:
+                        profile.exit(steps)
+                    if recorder is not None:
+                        recorder.ret()
+                    if stack.is_empty():
+                        break
+                    if detect_loops:
+                        frame_hashes.pop()
+                    while call_record is not None and len(stack) <= call_record.depth:
+                        # The call has returned, so summarize it and add what it did to the call that made it
+                        start = call_record.start
+                        if not call_record.impure:
+                            memo.store(call_record.function, call_record.offsets, call_record.window, tape, start,
+                                       call_record.low - start, call_record.high - start, tape.get_position() - start,
+                                       steps - call_record.steps, call_record.max_depth - call_record.depth)
+                        call_records.pop()
+                        if call_records:
+                            caller_record = call_records[-1]
+                            caller_record.low = min(caller_record.low, call_record.low)
+                            caller_record.high = max(caller_record.high, call_record.high)
+                            caller_record.max_depth = max(caller_record.max_depth, call_record.max_depth)
+                            caller_record.impure = caller_record.impure or call_record.impure
+                            call_record = caller_record
+                        else:
+                            call_record = None
+                    function = functions[stack.function]
+                    table = function[table_name]
+                    state = stack.state
+                    flags = stack.flags
+                    if profile is not None:
+                        counts = profile.state_counts[stack.function]
+                    continue
+
+                if steps >= next_save:
+                    stack.state = state
+                    if recorder is not None and steps >= recorder.next_snapshot:
+                        recorder.snapshot(steps, tape, stack)
+                    if steps >= next_checkpoint:
+                        # Flush the output first, so that a resumed run neither repeats nor loses any of it
+                        output.flush()
+                        save_checkpoint(checkpoint, self.program, tape, stack, steps)
+                        next_checkpoint = steps + self.checkpoint_every
+                    if steps >= max_steps:
+                        raise IndexError(f"Program has reached its maximum of {self.max_steps} steps.")
+                    next_save = min(next_checkpoint, recorder.next_snapshot if recorder is not None else float('inf'),
+                                    max_steps)
+
+                    if detect_loops:
+                        next_save = 0
+                        config_hash = hash((frame_hashes[-1], stack.function, state, tape.get_position(),
+                                            tuple(flags), tape.hash))
+                        if config_hash == saved_hash and pack_state(self.program, tape, stack, 0) == saved_state:
+                            names = ', '.join(f"@{functions[function_id]['name']} "
+                                              f"{functions[function_id]['state_names'][loop_state]}"
+                                              for function_id, loop_state in loop_states)
+                            raise ValueError(f"Infinite loop detected: the program repeats every {steps - saved_steps} "
+                                             f"steps in states {names}.")
+                        if distance == power:
+                            # Save the configuration, and look twice as far for it to come back
+                            saved_hash = config_hash
+                            saved_state = pack_state(self.program, tape, stack, 0)
+                            saved_steps = steps
+                            power *= 2
+                            distance = 0
+                            loop_states = {}
+                        distance += 1
+                        loop_states[stack.function, state] = None
+
+                steps += 1
+                if profile is not None:
+                    counts[state][cell] += 1
+
+                # Print the tape/state as specified by the settings
+                if tracing:
+                    if trace_changes:
+                        trace_position = tape.get_position()
+                        trace_state = function['state_names'][state]
+                    else:
+                        tape_text = repr(tape) if trace_window is None else \
+                            f"{tape.window(trace_window)} Position: {tape.get_position()}"
+                        if print_state:
+                            write(f"{tape_text} Next state: {function['state_names'][state]}\n")
+                        else:
+                            write(f"{tape_text}\n")
+
+                op = cmd[0]
+
+                if op == OP_MOVE:
+                    # Set the selected value
+                    if cmd[1] is not None:
+                        tape.selected = cmd[1]
+
+                    if cmd[2] < 0:
+                        tape.left(-cmd[2], cmd[3])
+                    elif cmd[2] > 0:
+                        tape.right(cmd[2], cmd[3])
+
+                    state = cmd[4]
+                    if cmd[5] != 1:
+                        # Merged moves count as every step they replace
+                        steps += cmd[5] - 1
+                    if recorder is not None:
+                        recorder.move(state, cmd[2], cmd[1], cmd[3])
+                    if call_record is not None and cmd[2]:
+                        position = tape.get_position()
+                        if position < call_record.low:
+                            call_record.low = position
+                        elif position > call_record.high:
+                            call_record.high = position
+
+                elif op == OP_SCAN:
+                    if tracing:
+                        # Run the scan one move at a time so that every step is printed
+                        if cmd[2] < 0:
+                            tape.left(-cmd[2], '*')
+                        else:
+                            tape.right(cmd[2], '*')
+                        if recorder is not None:
+                            recorder.move(state, cmd[2], None, '*')
+                    else:
+                        # Each move of the scan counts as a step, so stop the scan at the next check, where the step
+                        # limit is raised or the snapshot or checkpoint is saved like it would be between moves
+                        limit = max(1, next_save - steps + 1)
+                        if cmd[2] > 0:
+                            moves = tape.scan_right(cmd[2], cmd[5], limit)
+                        else:
+                            moves = tape.scan_left(-cmd[2], cmd[5], limit)
+                        steps += moves - 1
+                        if profile is not None:
+                            counts[state][cell] += moves - 1
+                        if recorder is not None:
+                            recorder.scan(cmd[2], moves)
+                        if call_record is not None:
+                            position = tape.get_position()
+                            if position < call_record.low:
+                                call_record.low = position
+                            elif position > call_record.high:
+                                call_record.high = position
+
+                elif op == OP_FLAG:
+                    flags[cmd[1]] = tape.get_position()
+                    state = cmd[2]
+                    if recorder is not None:
+                        recorder.flag(state, cmd[1])
+
+                elif op == OP_GOTO:
+                    position = flags[cmd[1]]
+                    if position is None:
+                        raise KeyError(f"Flag name {function['flag_names'][cmd[1]]} referenced before creation.")
+                    tape.set_position(position)
+                    state = cmd[2]
+                    if recorder is not None:
+                        recorder.goto(state, tape.get_position())
+                    if call_record is not None:
+                        if position < call_record.low:
+                            call_record.low = position
+                        elif position > call_record.high:
+                            call_record.high = position
+
+                elif op == OP_IF:
+                    position = flags[cmd[1]]
+                    if position == tape.get_position():
+                        state = cmd[2]
+                    elif position is None:
+                        raise KeyError(f"Flag name {function['flag_names'][cmd[1]]} referenced before creation.")
+                    else:
+                        state = cmd[3]
+                    if recorder is not None:
+                        recorder.move(state, 0, None, '*')
+
+                elif op == OP_INPUT:
+                    # Add the input to the tape
+                    bits = get_input(cmd[1], cmd[2], cmd[3], cmd[5])
+                    tape.write(bits)
+                    if call_record is not None:
+                        call_record.impure = True
+                    if detect_loops:
+                        # The input can differ every time, so getting back to an earlier configuration is not a loop
+                        saved_hash = saved_state = None
+                        power = 1
+                        distance = 0
+                        loop_states = {}
+
+                    state = cmd[4]
+                    if recorder is not None:
+                        recorder.input(state, bits)
+
+                elif op == OP_PRINT_STR:
+                    write(f"{cmd[1]}\n")
+                    state = cmd[2]
+                    if recorder is not None:
+                        recorder.move(state, 0, None, '*')
+                    if call_record is not None:
+                        call_record.impure = True
+
+                elif op == OP_PRINT_VAL:
+                    parameters = cmd[1]
+                    flag_names = function["flag_names"]
+                    if call_record is not None:
+                        call_record.impure = True
+
+                    if len(parameters) == 0:
+                        write(f"{tape.selected}\n")
+                    else:
+                        first_pos = flags[parameters[0]]
+                        if first_pos is None:
+                            raise KeyError(f"Flag name {flag_names[parameters[0]]} referenced before creation.")
+
+                        if len(parameters) == 1:
+                            write(f"{tape.get_value_at(first_pos)}\n")
+                        else:
+                            second_pos = flags[parameters[1]]
+                            if second_pos is None:
+                                raise KeyError(f"Flag name {flag_names[parameters[1]]} referenced before creation.")
+
+                            if first_pos >= second_pos:
+                                raise IndexError(f"Flag {flag_names[parameters[0]]} was not found before flag "
+                                                 f"{flag_names[parameters[1]]}")
+
+                            write(f"{tape.get_bits(first_pos, second_pos)}\n")
+
+                    state = cmd[2]
+                    if recorder is not None:
+                        recorder.move(state, 0, None, '*')
+
+                else:
+                    # Custom function
+                    callee_id, parameters = cmd[1], cmd[3]
+                    callee = functions[callee_id]
+
+                    # Pass the positions of the arguments, and leave the callee's other flags unset
+                    callee_flags = [flags[slot] for slot in parameters]
+                    if None in callee_flags:
+                        slot = parameters[callee_flags.index(None)]
+                        raise KeyError(f"Flag name {function['flag_names'][slot]} referenced before creation.")
+                    if recorder is not None:
+                        positions = tuple(callee_flags)
+
+                    if memo is not None and not cmd[5]:
+                        found = None
+                        if callee_id not in memo.skipped:
+                            position = tape.get_position()
+                            offsets = tuple(flag - position for flag in callee_flags)
+                            found = memo.lookup(callee_id, offsets, tape, position)
+                        if found is None:
+                            # The call is not summarized, so it counts towards the call that made it like its moves do
+                            if call_record is not None:
+                                call_record.max_depth = max(call_record.max_depth, len(stack) + 1)
+                        else:
+                            summary, window = found
+                            if summary is not None:
+                                low, cells, displacement, call_steps, depth = summary
+                                # Only skip the call if running it could not have stopped at a limit or a checkpoint
+                                if steps + call_steps < next_save and len(stack) + depth <= self.max_stack and \
+                                        position + low + len(cells) <= self.max_tape:
+                                    memo.hits += 1
+                                    tape.set_bits(position + low, cells)
+                                    tape.set_position(position + displacement)
+                                    steps += call_steps
+                                    state = cmd[4]
+                                    if call_record is not None:
+                                        call_record.low = min(call_record.low, position + low)
+                                        call_record.high = max(call_record.high, position + low + len(cells) - 1)
+                                        call_record.max_depth = max(call_record.max_depth, len(stack) + depth)
+                                    continue
+                            memo.misses += 1
+                            call_record = _CallRecord(callee_id, offsets, window, position, steps, len(stack))
+                            call_records.append(call_record)
+
+                    callee_flags += [None] * (len(callee["flag_names"]) - len(parameters))
+
+                    caller_id = stack.function
+                    if cmd[5]:
+                        # Tail call: the caller would return as soon as the callee does, so reuse its frame
+                        stack.replace(callee_id, callee_flags, callee["initial_state"])
+                        if profile is not None:
+                            profile.exit(steps)
+                        if recorder is not None:
+                            recorder.tail_call(callee_id, positions)
+                    else:
+                        stack.state = cmd[4]
+                        stack.add(callee_id, callee_flags, callee["initial_state"])
+                        if recorder is not None:
+                            recorder.call(cmd[4], callee_id, positions)
+                        if detect_loops:
+                            frame_hashes.append(hash((frame_hashes[-1], caller_id, cmd[4], tuple(flags))))
+
+                    function = callee
+                    table = function[table_name]
+                    state = stack.state
+                    flags = callee_flags
+                    if profile is not None:
+                        profile.enter(callee_id, caller_id, steps)
+                        counts = profile.state_counts[callee_id]
+
+                if trace_changes:
+                    # Print the cell that the step started on if it changed, and where the cursor moved to
+                    new_cell = tape.get_value_at(trace_position)
+                    change = f"{trace_position}: {cell} -> {new_cell}, " if new_cell != cell else ""
+                    if print_state:
+                        write(f"{change}Position: {tape.get_position()} State: {trace_state}\n")
+                    else:
+                        write(f"{change}Position: {tape.get_position()}\n")
+        finally:
+            if profile is not None:
+                profile.finish(steps, tape)
+            if recorder is not None:
+                recorder.close()
+            output.flush()
+
+        if steps > max_steps:
+            # The last moves of the run were merged past the limit
+            raise IndexError(f"Program has reached its maximum of {self.max_steps} steps.")
+        self.steps = steps
+        return steps
+
+
+def read_batch(path):
+    """Reads a batch file and returns a list of runs, where each run is a list of inputs.
+
+    Every non-empty line that isn't a comment is one run. Its inputs are separated by whitespace and are fed to the
+    program's !input calls in order. A "-" stands for an empty input.
+    """
+    runs = []
+    with open(path) as batch_file:
+        for line in batch_file:
+            if empty_line_pattern.match(line):
+                continue
+            runs.append(['' if token == '-' else token for token in line.split('#')[0].split()])
+    return runs
+
+
+# Machine of the current batch worker process
+_batch_machine = None
+
+def _init_batch_worker(program, max_tape, max_stack, backend, max_steps, detect_loops, memoize, memo_size):
+    global _batch_machine
+    _batch_machine = Machine(program, max_tape, max_stack, backend=backend, max_steps=max_steps,
+                             detect_loops=detect_loops, memoize=memoize, memo_size=memo_size)
+
+def _run_batch_job(inputs):
+    "Runs the worker's machine with the given inputs and returns a dict describing the result."
+    output = io.StringIO()
+    try:
+        steps = _batch_machine.run(output=output, inputs=inputs)
+        error = None
+    except (ValueError, KeyError, IndexError) as e:
+        steps = None
+        error = f"{type(e).__name__}: {e}"
+    return {"inputs": inputs, "steps": steps, "output": output.getvalue(), "error": error}
+
+def run_batch(program, runs, jobs=None, max_tape=10000, max_stack=1000, backend="interpreter", max_steps=None,
+              detect_loops=False, memoize=False, memo_size=4096):
+    """Runs program once for every list of inputs in runs, spread across jobs processes (all cores by default).
+
+    The program is sent to each worker process once. Returns a list of result dicts in the same order as runs. If
+    memoize is True, each worker keeps one memo of calls for all of the runs it does.
+    """
+    if jobs == 1:
+        _init_batch_worker(program, max_tape, max_stack, backend, max_steps, detect_loops, memoize, memo_size)
+        return [_run_batch_job(inputs) for inputs in runs]
+
+    # Only imported for parallel runs, since it takes longer to import than most runs take
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_batch_worker,
+                                                initargs=(program, max_tape, max_stack, backend, max_steps,
+                                                          detect_loops, memoize, memo_size)) as executor:
+        chunksize = max(1, len(runs) // (4 * (jobs or os.cpu_count() or 1)))
+        return list(executor.map(_run_batch_job, runs, chunksize=chunksize))
+
+
+# Kinds of commands that the lockstep engine runs for every run on them at once, and the kind of the other commands
+(_LOCKSTEP_RETURN, _LOCKSTEP_MOVE, _LOCKSTEP_SCAN, _LOCKSTEP_FLAG, _LOCKSTEP_GOTO, _LOCKSTEP_IF, _LOCKSTEP_CALL,
+ _LOCKSTEP_OTHER) = range(8)
+# Largest number of cells that a scan of the lockstep engine compares at once, which bounds its memory use
+_LOCKSTEP_SCAN_CELLS = 1 << 20
+
+
+def run_lockstep(program, runs, max_tape=10000, max_stack=1000, max_steps=None):
+    """Runs program once for every list of inputs in runs, advancing all of the runs together with NumPy, and returns
+    the same result dicts as run_batch.
+
+    The tapes are rows of one 2D array, and the state, position, step count, flags and call stack of every run are
+    arrays. Each iteration looks up the next command of every running run in arrays built from the fast tables, and
+    runs every command of the same kind at once: moves, scans (which search their row of the tape for where they
+    stop), flags, gotos, ifs, calls and returns. Only input, output and moves that fill more than one cell are run one
+    run at a time. Runs are retired as they finish or fail. max_steps limits the steps of every run like it does for a
+    Machine.
+    """
+    # NumPy is only imported here, so that it is optional and does not slow down starting the interpreter
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The lockstep engine requires NumPy.") from None
+    functions = program.functions
+
+    # Number every state of every function, and build arrays of the commands, so that one lookup finds the command of
+    # every run
+    bases = [0]
+    for function in functions:
+        bases.append(bases[-1] + len(function["fast_table"]))
+    state_count = bases[-1]
+    flag_count = max(1, max(len(function["flag_names"]) for function in functions))
+    argument_count = max([1] + [len(cmd[3]) for function in functions for row in function["fast_table"] for cmd in row
+                                if cmd is not None and cmd[0] == OP_CALL])
+    kinds = numpy.full((state_count, 2), _LOCKSTEP_RETURN, dtype=numpy.int8)
+    # The value that a move writes or that a scan keeps moving over, or -1 for neither
+    values = numpy.full((state_count, 2), -1, dtype=numpy.int16)
+    offsets = numpy.zeros((state_count, 2), dtype=numpy.int64)
+    fills = numpy.full((state_count, 2), -1, dtype=numpy.int16)
+    weights = numpy.zeros((state_count, 2), dtype=numpy.int64)
+    # The next state, the initial state of a callee, or the state of an !if when the flag is at the cursor
+    next_states = numpy.zeros((state_count, 2), dtype=numpy.int64)
+    # The state of an !if when the flag is elsewhere, or the state that a call returns to
+    other_states = numpy.zeros((state_count, 2), dtype=numpy.int64)
+    slots = numpy.zeros((state_count, 2), dtype=numpy.int64)
+    tails = numpy.zeros((state_count, 2), dtype=bool)
+    # The slots of the flags passed to a call, followed by -1s
+    arguments = numpy.full((state_count, 2, argument_count), -1, dtype=numpy.int64)
+    for function_id, function in enumerate(functions):
+        base = bases[function_id]
+        for state, row in enumerate(function["fast_table"]):
+            g = base + state
+            for cell, cmd in enumerate(row):
+                if cmd is None:
+                    continue
+                op = cmd[0]
+                if op == OP_MOVE and (cmd[3] == '*' or abs(cmd[2]) <= 1):
+                    kinds[g, cell] = _LOCKSTEP_MOVE
+                    values[g, cell] = -1 if cmd[1] is None else cmd[1]
+                    offsets[g, cell] = cmd[2]
+                    fills[g, cell] = -1 if cmd[3] == '*' or cmd[2] == 0 else cmd[3]
+                    next_states[g, cell] = base + cmd[4]
+                    weights[g, cell] = cmd[5]
+                elif op == OP_SCAN:
+                    kinds[g, cell] = _LOCKSTEP_SCAN
+                    values[g, cell] = -1 if cmd[5] is None else cmd[5]
+                    offsets[g, cell] = cmd[2]
+                elif op in (OP_FLAG, OP_GOTO):
+                    kinds[g, cell] = _LOCKSTEP_FLAG if op == OP_FLAG else _LOCKSTEP_GOTO
+                    slots[g, cell] = cmd[1]
+                    next_states[g, cell] = base + cmd[2]
+                elif op == OP_IF:
+                    kinds[g, cell] = _LOCKSTEP_IF
+                    slots[g, cell] = cmd[1]
+                    next_states[g, cell] = base + cmd[2]
+                    other_states[g, cell] = base + cmd[3]
+                elif op == OP_CALL:
+                    kinds[g, cell] = _LOCKSTEP_CALL
+                    next_states[g, cell] = bases[cmd[1]] + functions[cmd[1]]["initial_state"]
+                    other_states[g, cell] = base + cmd[4]
+                    tails[g, cell] = cmd[5]
+                    arguments[g, cell, :len(cmd[3])] = cmd[3]
+                else:
+                    kinds[g, cell] = _LOCKSTEP_OTHER
+
+    count = len(runs)
+    width = min(max_tape, 64)
+    tapes = numpy.zeros((count, width), dtype=numpy.uint8)
+    positions = numpy.zeros(count, dtype=numpy.int64)
+    # Global state numbers, so that one lookup finds the command of every run
+    states = numpy.full(count, bases[program.main] + functions[program.main]["initial_state"], dtype=numpy.int64)
+    steps = numpy.zeros(count, dtype=numpy.int64)
+    running = numpy.ones(count, dtype=bool)
+
+    # The flags of the top frame of every run, with -1 for flags that are not set
+    flags = numpy.full((count, flag_count), -1, dtype=numpy.int64)
+    # The frames below the top one of every run: the state that each returns to and its flags
+    depths = numpy.zeros(count, dtype=numpy.int64)
+    capacity = min(max_stack, 4)
+    return_states = numpy.zeros((count, capacity), dtype=numpy.int64)
+    saved_flags = numpy.full((count, capacity, flag_count), -1, dtype=numpy.int64)
+
+    inputs = [iter(run) for run in runs]
+    outputs = [[] for _ in range(count)]
+    results = [{"inputs": run, "steps": None, "output": None, "error": None} for run in runs]
+
+    def fail(rows, error):
+        "Retires the runs in rows with error."
+        for i in rows.tolist():
+            results[i]["error"] = f"{type(error).__name__}: {error}"
+            running[i] = False
+
+    def flag_error(g, slot):
+        "Returns the error for a flag in slot that is used in the global state g before it is set."
+        function = functions[bisect.bisect_right(bases, g) - 1]
+        return KeyError(f"Flag name {function['flag_names'][slot]} referenced before creation.")
+
+    def widen(position):
+        "Widens the tapes so that position fits."
+        nonlocal tapes, width
+        new_width = min(max_tape, max(2 * width, position + 1))
+        tapes = numpy.concatenate((tapes, numpy.zeros((count, new_width - width), dtype=numpy.uint8)), axis=1)
+        width = new_width
+
+    def move(i, position, offset, fill):
+        "Moves the cursor of run i like TuringTape.right() and left(), and returns the new position."
+        new_position = position + offset
+        if new_position >= max_tape:
+            raise IndexError(f"TuringTape has reached its maximum size of {max_tape}.")
+        if new_position < 0:
+            raise IndexError("TuringTape cannot extend below position 0.")
+        if new_position >= width:
+            widen(new_position)
+        if fill != '*':
+            if offset > 0:
+                tapes[i, position + 1:new_position + 1] = fill
+            else:
+                tapes[i, new_position:position] = fill
+        return new_position
+
+    def step(i, g, cell):
+        "Runs the command of run i in global state g on cell, one run at a time."
+        function_id = bisect.bisect_right(bases, g) - 1
+        function = functions[function_id]
+        cmd = function["fast_table"][g - bases[function_id]][cell]
+        position = int(positions[i])
+        op = cmd[0]
+        steps[i] += cmd[5] if op == OP_MOVE else 1
+
+        def flag(slot):
+            if flags[i, slot] < 0:
+                raise flag_error(g, slot)
+            return int(flags[i, slot])
+
+        if op == OP_MOVE:
+            if cmd[1] is not None:
+                tapes[i, position] = cmd[1]
+            positions[i] = move(i, position, cmd[2], cmd[3])
+            state = cmd[4]
+        elif op == OP_INPUT:
+            bits = read_input(cmd[1], cmd[2], cmd[3], inputs[i], cmd[5])
+            new_position = move(i, position, len(bits), '*')
+            tapes[i, position:new_position] = numpy.frombuffer(bits.encode().translate(_CELL_CHARACTERS), numpy.uint8)
+            positions[i] = new_position
+            state = cmd[4]
+        elif op == OP_PRINT_STR:
+            outputs[i].append(f"{cmd[1]}\n")
+            state = cmd[2]
+        else:
+            parameters = cmd[1]
+            if len(parameters) == 0:
+                outputs[i].append(f"{tapes[i, position]}\n")
+            elif len(parameters) == 1:
+                outputs[i].append(f"{tapes[i, flag(parameters[0])]}\n")
+            else:
+                first_pos, second_pos = flag(parameters[0]), flag(parameters[1])
+                if first_pos >= second_pos:
+                    raise IndexError(f"Flag {function['flag_names'][parameters[0]]} was not found before flag "
+                                     f"{function['flag_names'][parameters[1]]}")
+                outputs[i].append(tapes[i, first_pos:second_pos].tobytes().translate(_BIT_CHARACTERS).decode() + "\n")
+            state = cmd[2]
+        states[i] = bases[function_id] + state
+
+    active = numpy.arange(count)
+    while active.size:
+        cells = tapes[active, positions[active]]
+        g = states[active]
+        kind = kinds[g, cells]
+
+        if max_steps is not None:
+            # Every command but a return is a step
+            over = (steps[active] >= max_steps) & (kind != _LOCKSTEP_RETURN)
+            if over.any():
+                fail(active[over], IndexError(f"Program has reached its maximum of {max_steps} steps."))
+                under = ~over
+                active, cells, g, kind = active[under], cells[under], g[under], kind[under]
+        kind_counts = numpy.bincount(kind, minlength=_LOCKSTEP_OTHER + 1)
+
+        if kind_counts[_LOCKSTEP_MOVE]:
+            selected = kind == _LOCKSTEP_MOVE
+            rows, g_rows, cell_rows = active[selected], g[selected], cells[selected]
+            old_positions = positions[rows]
+            written_values = values[g_rows, cell_rows]
+            written = written_values >= 0
+            tapes[rows[written], old_positions[written]] = written_values[written]
+
+            new_positions = old_positions + offsets[g_rows, cell_rows]
+            out_of_range = (new_positions < 0) | (new_positions >= max_tape)
+            if out_of_range.any():
+                fail(rows[out_of_range & (new_positions >= 0)],
+                     IndexError(f"TuringTape has reached its maximum size of {max_tape}."))
+                fail(rows[new_positions < 0], IndexError("TuringTape cannot extend below position 0."))
+                in_range = ~out_of_range
+                rows, g_rows, cell_rows, new_positions = \
+                    rows[in_range], g_rows[in_range], cell_rows[in_range], new_positions[in_range]
+            if new_positions.size and new_positions.max() >= width:
+                widen(int(new_positions.max()))
+
+            fill_values = fills[g_rows, cell_rows]
+            filled = fill_values >= 0
+            tapes[rows[filled], new_positions[filled]] = fill_values[filled]
+            positions[rows] = new_positions
+            states[rows] = next_states[g_rows, cell_rows]
+            steps[rows] += weights[g_rows, cell_rows]
+
+        if kind_counts[_LOCKSTEP_SCAN]:
+            selected = kind == _LOCKSTEP_SCAN
+            rows, g_rows, cell_rows = active[selected], g[selected], cells[selected]
+            strides = offsets[g_rows, cell_rows]
+            scanned = values[g_rows, cell_rows]
+            old_positions = positions[rows]
+            # Moves until the first cell on the path of each scan that does not match its value, like
+            # TuringTape.scan_right() and scan_left(), or more moves than any tape allows if there is none
+            never = max_tape + 1
+            moves = numpy.full(rows.size, never, dtype=numpy.int64)
+            columns = numpy.arange(width)
+            chunk = max(1, _LOCKSTEP_SCAN_CELLS // width)
+            for start in range(0, rows.size, chunk):
+                part = slice(start, start + chunk)
+                relative = columns - old_positions[part, None]
+                part_strides = strides[part, None]
+                stops = (relative * part_strides > 0) & (relative % part_strides == 0) & \
+                    (tapes[rows[part]] != scanned[part, None]) & (scanned[part, None] >= 0)
+                moves[part] = numpy.where(stops, relative // part_strides, never).min(axis=1)
+            # Cells past the end of the tapes are 0, so scans to the right over 1s stop at the first of them
+            past_end = (moves == never) & (scanned == 1) & (strides > 0)
+            moves[past_end] = -((old_positions[past_end] - width) // strides[past_end])
+            if max_steps is not None:
+                # Stop at the step limit, which the next iteration raises
+                moves = numpy.minimum(moves, max_steps - steps[rows])
+            room = numpy.where(strides > 0, (max_tape - 1 - old_positions) // strides, old_positions // -strides)
+            out_of_range = moves > room
+            if out_of_range.any():
+                fail(rows[out_of_range & (strides > 0)],
+                     IndexError(f"TuringTape has reached its maximum size of {max_tape}."))
+                fail(rows[out_of_range & (strides < 0)], IndexError("TuringTape cannot extend below position 0."))
+                in_range = ~out_of_range
+                rows, strides, moves, old_positions = \
+                    rows[in_range], strides[in_range], moves[in_range], old_positions[in_range]
+            new_positions = old_positions + moves * strides
+            if new_positions.size and new_positions.max() >= width:
+                widen(int(new_positions.max()))
+            positions[rows] = new_positions
+            steps[rows] += moves
+
+        if kind_counts[_LOCKSTEP_FLAG]:
+            selected = kind == _LOCKSTEP_FLAG
+            rows, g_rows, cell_rows = active[selected], g[selected], cells[selected]
+            flags[rows, slots[g_rows, cell_rows]] = positions[rows]
+            states[rows] = next_states[g_rows, cell_rows]
+            steps[rows] += 1
+
+        if kind_counts[_LOCKSTEP_GOTO] or kind_counts[_LOCKSTEP_IF]:
+            selected = (kind == _LOCKSTEP_GOTO) | (kind == _LOCKSTEP_IF)
+            rows, g_rows, cell_rows = active[selected], g[selected], cells[selected]
+            is_goto = kind[selected] == _LOCKSTEP_GOTO
+            flag_slots = slots[g_rows, cell_rows]
+            targets = flags[rows, flag_slots]
+            at_cursor = targets == positions[rows]
+            # An !if whose flag is at the cursor does not need the flag to be set
+            unset = (targets < 0) & ~(at_cursor & ~is_goto)
+            if unset.any():
+                for i, g_row, slot in zip(rows[unset].tolist(), g_rows[unset].tolist(), flag_slots[unset].tolist()):
+                    fail(numpy.array([i]), flag_error(g_row, slot))
+                is_set = ~unset
+                rows, g_rows, cell_rows, is_goto, targets, at_cursor = rows[is_set], g_rows[is_set], \
+                    cell_rows[is_set], is_goto[is_set], targets[is_set], at_cursor[is_set]
+            positions[rows[is_goto]] = targets[is_goto]
+            states[rows] = numpy.where(is_goto | at_cursor, next_states[g_rows, cell_rows],
+                                       other_states[g_rows, cell_rows])
+            steps[rows] += 1
+
+        if kind_counts[_LOCKSTEP_CALL]:
+            selected = kind == _LOCKSTEP_CALL
+            rows, g_rows, cell_rows = active[selected], g[selected], cells[selected]
+            argument_slots = arguments[g_rows, cell_rows]
+            passed = argument_slots >= 0
+            argument_flags = numpy.where(passed, flags[rows[:, None], numpy.maximum(argument_slots, 0)], -1)
+            unset = passed & (argument_flags < 0)
+            failed = unset.any(axis=1)
+            if failed.any():
+                # Report the first flag passed that is not set, like Machine.run()
+                first_unset = unset.argmax(axis=1)
+                for index in failed.nonzero()[0].tolist():
+                    fail(rows[index:index + 1], flag_error(int(g_rows[index]),
+                                                           int(argument_slots[index, first_unset[index]])))
+            pushed = ~tails[g_rows, cell_rows]
+            overflow = pushed & ~failed & (depths[rows] + 1 == max_stack)
+            if overflow.any():
+                fail(rows[overflow], IndexError(f"Stack has reached its maximum size of {max_stack}."))
+                failed |= overflow
+            if failed.any():
+                called = ~failed
+                rows, g_rows, cell_rows, argument_flags, pushed = \
+                    rows[called], g_rows[called], cell_rows[called], argument_flags[called], pushed[called]
+
+            # Save the caller's frame below the callee's, unless it is a tail call
+            pushed_rows = rows[pushed]
+            if pushed_rows.size:
+                frame_depths = depths[pushed_rows]
+                if frame_depths.max() >= capacity:
+                    new_capacity = min(max_stack, 2 * capacity)
+                    return_states = numpy.concatenate(
+                        (return_states, numpy.zeros((count, new_capacity - capacity), dtype=numpy.int64)), axis=1)
+                    saved_flags = numpy.concatenate(
+                        (saved_flags, numpy.full((count, new_capacity - capacity, flag_count), -1, dtype=numpy.int64)),
+                        axis=1)
+                    capacity = new_capacity
+                return_states[pushed_rows, frame_depths] = other_states[g_rows[pushed], cell_rows[pushed]]
+                saved_flags[pushed_rows, frame_depths] = flags[pushed_rows]
+                depths[pushed_rows] += 1
+
+            callee_flags = numpy.full((rows.size, flag_count), -1, dtype=numpy.int64)
+            callee_flags[:, :argument_count] = argument_flags
+            flags[rows] = callee_flags
+            states[rows] = next_states[g_rows, cell_rows]
+            steps[rows] += 1
+
+        if kind_counts[_LOCKSTEP_RETURN]:
+            selected = kind == _LOCKSTEP_RETURN
+            rows = active[selected]
+            finished = depths[rows] == 0
+            for i in rows[finished].tolist():
+                if max_steps is not None and steps[i] > max_steps:
+                    # The last moves of the run were merged past the limit
+                    fail(numpy.array([i]), IndexError(f"Program has reached its maximum of {max_steps} steps."))
+                else:
+                    results[i]["steps"] = int(steps[i])
+                    running[i] = False
+            rows = rows[~finished]
+            frame_depths = depths[rows] - 1
+            states[rows] = return_states[rows, frame_depths]
+            flags[rows] = saved_flags[rows, frame_depths]
+            depths[rows] = frame_depths
+
+        # Run everything else one run at a time
+        if kind_counts[_LOCKSTEP_OTHER]:
+            selected = kind == _LOCKSTEP_OTHER
+            for i, g_row, cell in zip(active[selected].tolist(), g[selected].tolist(), cells[selected].tolist()):
+                try:
+                    step(i, g_row, cell)
+                except (ValueError, KeyError, IndexError) as e:
+                    fail(numpy.array([i]), e)
+
+        if not running[active].all():
+            active = active[running[active]]
+
+    for i, result in enumerate(results):
+        result["output"] = ''.join(outputs[i])
+    return results
+
+
+# Length of each pickled message between a Server and its worker processes
+_SERVE_FRAME = struct.Struct('<I')
+
+def _send_frame(file, message):
+    "Writes message to file as a length-prefixed pickle."
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    file.write(_SERVE_FRAME.pack(len(data)) + data)
+
+class _StreamedOutput:
+    "A file that sends everything written to it back to the Server as it is printed."
+    def __init__(self, send):
+        self._send = send
+
+    def write(self, text):
+        self._send(("output", text))
+
+    def flush(self):
+        pass
+
+def _serve_worker():
+    """Runs the jobs that a Server sends to standard input, writing their output and results to standard output.
+
+    The first message holds the settings of the worker's machines. Every later message is a job, which is answered with
+    ("missing",) if the worker has no machine for the job's program and the job did not include it. Otherwise it is
+    answered with an ("output", text) message for every piece of output as the run prints it, and then with
+    ("result", steps, error). Machines are kept for the cache_size most recently run programs.
+    """
+    # The server stops its workers itself, so pressing Ctrl-C in its terminal shouldn't interrupt them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+
+    def receive():
+        header = stdin.read(_SERVE_FRAME.size)
+        if len(header) < _SERVE_FRAME.size:
+            return None
+        return pickle.loads(stdin.read(_SERVE_FRAME.unpack(header)[0]))
+
+    def send(message):
+        _send_frame(stdout, message)
+        stdout.flush()
+
+    max_tape, max_stack, backend, detect_loops, cache_size = receive()
+    machines = collections.OrderedDict()
+    output = _StreamedOutput(send)
+    while True:
+        job = receive()
+        if job is None:
+            # The server closed the pipe
+            return
+        source_hash, program, inputs, max_steps = job
+
+        machine = None
+        try:
+            if program is not None:
+                machines[source_hash] = Machine(program, max_tape, max_stack, backend=backend,
+                                                detect_loops=detect_loops)
+                if len(machines) > cache_size:
+                    machines.popitem(last=False)
+            machine = machines.get(source_hash)
+            if machine is None:
+                send(("missing",))
+                continue
+            machines.move_to_end(source_hash)
+
+            machine.max_steps = max_steps
+            steps = machine.run(output=output, inputs=inputs)
+            error = None
+        except (ValueError, KeyError, IndexError) as e:
+            steps = None
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            if machine is not None:
+                # Don't keep the tape of every cached program in memory between jobs
+                machine.tape = None
+        send(("result", steps, error))
+
+
+class Server:
+    """Runs programs for clients that connect to a Unix socket, keeping the compiled programs in memory between jobs.
+
+    Clients send one job per line as a JSON object. The program to run is given by exactly one of "path" (the path of
+    a .ftm file), "source" (the text of a script) or "hash" (the hash of a program that the server has already
+    compiled). "inputs" is the list of bit strings for the program's !input calls, like a line of a batch file.
+    "max_steps" and "time_limit" (in seconds) limit the run, but can only lower the limits the server was started with.
+
+    The server replies with a JSON object {"output": text} for every piece of output as the run prints it, and then
+    with {"hash": source_hash, "steps": steps, "error": error}. A client can send any number of jobs over one
+    connection, and they are run one after the other. Clients that want to run jobs at the same time should open more
+    connections.
+
+    The cache_size most recently run programs are kept compiled, keyed by the SHA-256 hash of their script, so a
+    script is only parsed again once it changes. Runs are done by a pool of jobs worker processes (one per CPU core by
+    default), which each keep a Machine for the programs they have run. A run that takes longer than its time limit
+    has its worker killed and replaced.
+    """
+    def __init__(self, socket_path, jobs=None, cache_size=64, max_tape=10000, max_stack=1000, backend="interpreter",
+                 max_steps=None, time_limit=None, detect_loops=False, use_cache=True):
+        if jobs is not None and jobs < 1:
+            raise ValueError("Number of jobs must be at least 1.")
+        if cache_size < 1:
+            raise ValueError("Cache size must be at least 1.")
+        if max_tape < 1:
+            raise ValueError("Maximum tape size must be at least 1.")
+        if max_stack < 1:
+            raise ValueError("Maximum stack size must be at least 1.")
+        if backend not in ("interpreter", "python"):
+            raise ValueError(f"Invalid backend: {backend}.")
+        if max_steps is not None and max_steps < 1:
+            raise ValueError("Maximum number of steps must be at least 1.")
+        if time_limit is not None and time_limit <= 0:
+            raise ValueError("Time limit must be positive.")
+        if backend == "python" and (max_steps is not None or detect_loops):
+            raise ValueError("The python backend cannot limit the steps or detect loops.")
+        self.socket_path = socket_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.max_tape = max_tape
+        self.max_stack = max_stack
+        self.backend = backend
+        self.max_steps = max_steps
+        self.time_limit = time_limit
+        self.detect_loops = detect_loops
+        self.use_cache = use_cache
+        # Compiled programs by the hash of their script, from least to most recently run
+        self.programs = collections.OrderedDict()
+        self._workers = set()
+        self._idle_workers = None
+
+    async def serve(self):
+        "Starts the worker processes and serves clients until the task is cancelled or the process is terminated."
+        # asyncio is only imported by the server, so that it does not slow down starting the interpreter
+        import asyncio
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        self._idle_workers = asyncio.Queue()
+        try:
+            for _ in range(self.jobs):
+                self._idle_workers.put_nowait(await self._start_worker())
+            # Allow whole scripts to be sent as the source of a job
+            server = await asyncio.start_unix_server(self._handle_client, self.socket_path, limit=1 << 26)
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                os.unlink(self.socket_path)
+        finally:
+            for worker in list(self._workers):
+                await self._stop_worker(worker)
+
+    async def _start_worker(self):
+        "Starts a worker process running _serve_worker and returns it."
+        import asyncio
+        worker = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), "--serve-worker",
+                                                      stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        self._workers.add(worker)
+        _send_frame(worker.stdin, (self.max_tape, self.max_stack, self.backend, self.detect_loops, self.cache_size))
+        await worker.stdin.drain()
+        return worker
+
+    async def _stop_worker(self, worker):
+        "Kills a worker process and waits for it to exit."
+        self._workers.discard(worker)
+        if worker.returncode is None:
+            worker.kill()
+        await worker.wait()
+
+    async def _program(self, request):
+        "Returns the hash and the compiled program of the script that a job refers to, compiling it if it isn't cached."
+        if sum(key in request for key in ("path", "source", "hash")) != 1:
+            raise ValueError('Job must have exactly one of "path", "source" and "hash".')
+
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if "hash" in request:
+            source = None
+            source_hash = request["hash"]
+        elif "path" in request:
+            source = request["path"]
+            if not isinstance(source, str) or file_name_pattern.match(source) is None:
+                raise ValueError('Invalid file name. Functional Turing Machine files must end with ".ftm"')
+            source_hash = await loop.run_in_executor(None, Program.hash_file, source)
+        else:
+            source = request["source"]
+            if not isinstance(source, str):
+                raise ValueError("Source must be a string.")
+            source_hash = hashlib.sha256(source.encode()).hexdigest()
+
+        program = self.programs.get(source_hash)
+        if program is not None:
+            self.programs.move_to_end(source_hash)
+            return source_hash, program
+        if source is None:
+            raise KeyError(f"No program with hash {source_hash} is cached.")
+
+        # Parse the script without blocking other clients. The file may have changed since it was hashed, so the
+        # program is cached under the hash of the script that was actually parsed.
+        program = await loop.run_in_executor(None, Program.compile, source, self.use_cache)
+        self.programs[program.source_hash] = program
+        if len(self.programs) > self.cache_size:
+            self.programs.popitem(last=False)
+        return program.source_hash, program
+
+    def _limit(self, request, key, limit):
+        "Returns the lower of the job's limit called key and the server's limit."
+        value = request.get(key)
+        if value is None:
+            return limit
+        if key == "max_steps":
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError("Maximum number of steps must be at least 1.")
+            if self.backend == "python":
+                raise ValueError("The python backend cannot limit the steps or detect loops.")
+        elif not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+            raise ValueError("Time limit must be positive.")
+        return value if limit is None else min(value, limit)
+
+    async def _run(self, worker, source_hash, program, inputs, max_steps, write_output):
+        "Runs a job on worker, passing its output to write_output as it arrives, and returns (steps, error)."
+        async def receive():
+            header = await worker.stdout.readexactly(_SERVE_FRAME.size)
+            return pickle.loads(await worker.stdout.readexactly(_SERVE_FRAME.unpack(header)[0]))
+
+        # Only send the program if the worker doesn't already have it
+        _send_frame(worker.stdin, (source_hash, None, inputs, max_steps))
+        await worker.stdin.drain()
+        while True:
+            message = await receive()
+            if message[0] == "output":
+                await write_output(message[1])
+            elif message[0] == "missing":
+                _send_frame(worker.stdin, (source_hash, program, inputs, max_steps))
+                await worker.stdin.drain()
+            else:
+                return message[1], message[2]
+
+    async def _handle_job(self, line, writer):
+        "Runs the job on one line from a client, streaming its output to writer, and returns the result dict."
+        import asyncio
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Job must be a JSON object.")
+            source_hash, program = await self._program(request)
+            inputs = request.get("inputs", [])
+            if not isinstance(inputs, list) or not all(isinstance(bits, str) for bits in inputs):
+                raise ValueError("Inputs must be a list of strings.")
+            max_steps = self._limit(request, "max_steps", self.max_steps)
+            time_limit = self._limit(request, "time_limit", self.time_limit)
+        except (ValueError, KeyError, OSError) as e:
+            return {"hash": None, "steps": None, "error": f"{type(e).__name__}: {e}"}
+
+        async def write_output(text):
+            # Keep reading the worker's messages even if the client has gone, so the worker can be reused
+            if not writer.is_closing():
+                writer.write((json.dumps({"output": text}) + '\n').encode())
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    writer.close()
+
+        worker = await self._idle_workers.get()
+        try:
+            steps, error = await asyncio.wait_for(
+                self._run(worker, source_hash, program, inputs, max_steps, write_output), time_limit)
+        except asyncio.TimeoutError:
+            # The only way to stop a run part way through is to kill its process
+            await self._stop_worker(worker)
+            worker = await self._start_worker()
+            steps, error = None, f"TimeoutError: Program has reached its time limit of {time_limit:g} seconds."
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self._stop_worker(worker)
+            worker = await self._start_worker()
+            steps, error = None, "RuntimeError: Worker process exited unexpectedly."
+        finally:
+            self._idle_workers.put_nowait(worker)
+        return {"hash": source_hash, "steps": steps, "error": error}
+
+    async def _handle_client(self, reader, writer):
+        "Runs every job that a client sends until it disconnects."
+        try:
+            while not writer.is_closing():
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                result = await self._handle_job(line, writer)
+                writer.write((json.dumps(result) + '\n').encode())
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # The client disconnected, or sent a line longer than the limit
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    # Get command line arguments
+    settings = {}
+
+    if len(sys.argv) == 1:
+        input_file_name = input("Enter input file name: ")
+    elif sys.argv[1] == "--serve-worker":
+        # Worker process started by a Server
+        _serve_worker()
+        sys.exit(0)
+    else:
+        input_file_name = sys.argv[1]
+        i = 2
+        if input_file_name.lower() == "--serve":
+            # Serve jobs from a socket instead of running a script
+            if len(sys.argv) < 3:
+                raise ValueError("Argument --serve requires the path of the socket to serve on.")
+            settings["serve"] = sys.argv[2]
+            input_file_name = None
+            i = 3
+        while i < len(sys.argv):
+            arg = sys.argv[i].lower()
+
+            if arg == "--max-tape":
+                # Sets the maximum tape size
+                if "max_tape_size" in settings.keys():
+                    raise ValueError("Argument --max-tape specified more than once.")
+                settings["max_tape_size"] = int(sys.argv[i+1])
+                if settings["max_tape_size"] < 1:
+                    raise ValueError("Maximum tape size must be at least 1.")
+                i += 2
+
+            elif arg == "--max-stack":
+                # Sets the maximum stack size
+                if "max_stack_size" in settings.keys():
+                    raise ValueError("Argument --max-stack specified more than once.")
+                settings["max_stack_size"] = int(sys.argv[i+1])
+                if settings["max_stack_size"] < 1:
+                    raise ValueError("Maximum stack size must be at least 1.")
+                i += 2
+
+            elif arg == "--print-tape":
+                # Print the tape after every step
+                if "print_tape" in settings.keys():
+                    raise ValueError("Argument --print-tape specified more than once.")
+                settings["print_tape"] = True
+                i += 1
+
+            elif arg == "--print-state":
+                # Print the state after every step
+                if "print_state" in settings.keys():
+                    raise ValueError("Argument --print-state specified more than once.")
+                settings["print_state"] = True
+                i += 1
+
+            elif arg == "--print-steps":
+                # Print the number of steps after the program finishes
+                if "print_steps" in settings.keys():
+                    raise ValueError("Argument --print-steps specified more than once.")
+                settings["print_steps"] = True
+                i += 1
+
+            elif arg == "--batch":
+                # Run the program once for every line of a file of inputs
+                if "batch" in settings.keys():
+                    raise ValueError("Argument --batch specified more than once.")
+                settings["batch"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--input-file":
+                # Read the inputs of the run from a file instead of prompting for them
+                if "input_file" in settings.keys():
+                    raise ValueError("Argument --input-file specified more than once.")
+                settings["input_file"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--batch-output":
+                # Write the batch results to a file instead of the screen
+                if "batch_output" in settings.keys():
+                    raise ValueError("Argument --batch-output specified more than once.")
+                settings["batch_output"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--jobs":
+                # Sets the number of processes used for batch runs
+                if "jobs" in settings.keys():
+                    raise ValueError("Argument --jobs specified more than once.")
+                settings["jobs"] = int(sys.argv[i+1])
+                if settings["jobs"] < 1:
+                    raise ValueError("Number of jobs must be at least 1.")
+                i += 2
+
+            elif arg == "--lockstep":
+                # Run all of the batch runs together with NumPy instead of one at a time
+                if "lockstep" in settings.keys():
+                    raise ValueError("Argument --lockstep specified more than once.")
+                settings["lockstep"] = True
+                i += 1
+
+            elif arg == "--no-cache":
+                # Always parse the script instead of using the compiled program cache
+                if "use_cache" in settings.keys():
+                    raise ValueError("Argument --no-cache specified more than once.")
+                settings["use_cache"] = False
+                i += 1
+
+            elif arg == "--transpile":
+                # Run the program as generated Python code instead of interpreting it
+                if "backend" in settings.keys():
+                    raise ValueError("Argument --transpile specified more than once.")
+                settings["backend"] = "python"
+                i += 1
+
+            elif arg == "--emit-python":
+                # Write the program as generated Python code instead of running it
+                if "emit_python" in settings.keys():
+                    raise ValueError("Argument --emit-python specified more than once.")
+                settings["emit_python"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--profile":
+                # Print a profile of the run once the program finishes
+                if "profile" in settings.keys():
+                    raise ValueError("Argument --profile specified more than once.")
+                settings["profile"] = True
+                i += 1
+
+            elif arg == "--profile-output":
+                # Write the profile to a file instead of the screen
+                if "profile_output" in settings.keys():
+                    raise ValueError("Argument --profile-output specified more than once.")
+                settings["profile_output"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--trace-window":
+                # Only print the cells near the cursor when printing the tape
+                if "trace_window" in settings.keys():
+                    raise ValueError("Argument --trace-window specified more than once.")
+                settings["trace_window"] = int(sys.argv[i+1])
+                if settings["trace_window"] < 0:
+                    raise ValueError("Trace window must not be negative.")
+                i += 2
+
+            elif arg == "--trace-changes":
+                # Only print the changed cell and position after every step
+                if "trace_changes" in settings.keys():
+                    raise ValueError("Argument --trace-changes specified more than once.")
+                settings["trace_changes"] = True
+                i += 1
+
+            elif arg == "--record":
+                # Record a trace of the run to a file
+                if "record" in settings.keys():
+                    raise ValueError("Argument --record specified more than once.")
+                settings["record"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--snapshot-every":
+                # Sets the number of steps between snapshots in a recorded trace
+                if "snapshot_every" in settings.keys():
+                    raise ValueError("Argument --snapshot-every specified more than once.")
+                settings["snapshot_every"] = int(sys.argv[i+1])
+                if settings["snapshot_every"] < 1:
+                    raise ValueError("Snapshot interval must be at least 1.")
+                i += 2
+
+            elif arg == "--replay":
+                # Print the state of a recorded trace instead of running the program
+                if "replay" in settings.keys():
+                    raise ValueError("Argument --replay specified more than once.")
+                settings["replay"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--seek":
+                # Sets the step of the replayed trace to print
+                if "seek" in settings.keys():
+                    raise ValueError("Argument --seek specified more than once.")
+                settings["seek"] = int(sys.argv[i+1])
+                if settings["seek"] < 0:
+                    raise ValueError("Seek step must not be negative.")
+                i += 2
+
+            elif arg == "--checkpoint-every":
+                # Save the state of the machine every N steps
+                if "checkpoint_every" in settings.keys():
+                    raise ValueError("Argument --checkpoint-every specified more than once.")
+                settings["checkpoint_every"] = int(sys.argv[i+1])
+                if settings["checkpoint_every"] < 1:
+                    raise ValueError("Checkpoint interval must be at least 1.")
+                i += 2
+
+            elif arg == "--checkpoint":
+                # Sets the file that checkpoints are saved to
+                if "checkpoint" in settings.keys():
+                    raise ValueError("Argument --checkpoint specified more than once.")
+                settings["checkpoint"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--paged-tape":
+                # Store the tape in pages that are only allocated when they are written
+                if "paged_tape" in settings.keys():
+                    raise ValueError("Argument --paged-tape specified more than once.")
+                settings["paged_tape"] = True
+                i += 1
+
+            elif arg == "--tape-file":
+                # Store the pages of the tape in a memory-mapped file
+                if "tape_file" in settings.keys():
+                    raise ValueError("Argument --tape-file specified more than once.")
+                settings["tape_file"] = sys.argv[i+1]
+                i += 2
+
+            elif arg == "--max-steps":
+                # Sets the maximum number of steps
+                if "max_steps" in settings.keys():
+                    raise ValueError("Argument --max-steps specified more than once.")
+                settings["max_steps"] = int(sys.argv[i+1])
+                if settings["max_steps"] < 1:
+                    raise ValueError("Maximum number of steps must be at least 1.")
+                i += 2
+
+            elif arg == "--detect-loops":
+                # Stop the program if it gets back to a configuration that it has been in before
+                if "detect_loops" in settings.keys():
+                    raise ValueError("Argument --detect-loops specified more than once.")
+                settings["detect_loops"] = True
+                i += 1
+
+            elif arg == "--memoize":
+                # Apply summaries of earlier calls of custom functions instead of running the calls again
+                if "memoize" in settings.keys():
+                    raise ValueError("Argument --memoize specified more than once.")
+                settings["memoize"] = True
+                i += 1
+
+            elif arg == "--memo-size":
+                # Sets the number of call summaries kept by --memoize
+                if "memo_size" in settings.keys():
+                    raise ValueError("Argument --memo-size specified more than once.")
+                settings["memo_size"] = int(sys.argv[i+1])
+                if settings["memo_size"] < 1:
+                    raise ValueError("Memo size must be at least 1.")
+                i += 2
+
+            elif arg == "--cache-size":
+                # Sets the number of compiled programs kept in memory by a server
+                if "cache_size" in settings.keys():
+                    raise ValueError("Argument --cache-size specified more than once.")
+                settings["cache_size"] = int(sys.argv[i+1])
+                if settings["cache_size"] < 1:
+                    raise ValueError("Cache size must be at least 1.")
+                i += 2
+
+            elif arg == "--time-limit":
+                # Sets the maximum number of seconds of each job run by a server
+                if "time_limit" in settings.keys():
+                    raise ValueError("Argument --time-limit specified more than once.")
+                settings["time_limit"] = float(sys.argv[i+1])
+                if settings["time_limit"] <= 0:
+                    raise ValueError("Time limit must be positive.")
+                i += 2
+
+            elif arg == "--resume":
+                # Continue the run saved in a checkpoint
+                if "resume" in settings.keys():
+                    raise ValueError("Argument --resume specified more than once.")
+                settings["resume"] = sys.argv[i+1]
+                i += 2
+
+            else:
+                # Invalid command line argument
+                raise KeyError(f"Invalid argument: {arg}.")
+
+    # Set defaults if not specified in comand line
+    if "max_stack_size" not in settings.keys():
+        settings["max_stack_size"] = 1000
+    if "max_tape_size" not in settings.keys():
+        settings["max_tape_size"] = 10000
+    if "print_tape" not in settings.keys():
+        settings["print_tape"] = False
+    if "print_state" not in settings.keys():
+        settings["print_state"] = False
+    if "print_steps" not in settings.keys():
+        settings["print_steps"] = False
+    if "jobs" not in settings.keys():
+        settings["jobs"] = None
+    if "lockstep" not in settings.keys():
+        settings["lockstep"] = False
+    if "use_cache" not in settings.keys():
+        settings["use_cache"] = True
+    if "backend" not in settings.keys():
+        settings["backend"] = "interpreter"
+    if "profile" not in settings.keys():
+        settings["profile"] = "profile_output" in settings.keys()
+    if "trace_window" not in settings.keys():
+        settings["trace_window"] = None
+    else:
+        settings["print_tape"] = True
+    if "trace_changes" not in settings.keys():
+        settings["trace_changes"] = False
+    if "record" not in settings.keys():
+        settings["record"] = None
+    if "snapshot_every" not in settings.keys():
+        settings["snapshot_every"] = 100000
+    if "seek" not in settings.keys():
+        settings["seek"] = None
+    if "resume" not in settings.keys():
+        settings["resume"] = None
+    if "checkpoint" not in settings.keys():
+        if "checkpoint_every" in settings.keys():
+            # Keep saving to the checkpoint being resumed
+            settings["checkpoint"] = settings["resume"] or f"{input_file_name}.checkpoint"
+        else:
+            settings["checkpoint"] = None
+    if "checkpoint_every" not in settings.keys():
+        settings["checkpoint_every"] = 1000000
+    if "tape_file" not in settings.keys():
+        settings["tape_file"] = None
+    if "paged_tape" not in settings.keys():
+        settings["paged_tape"] = settings["tape_file"] is not None
+    if "max_steps" not in settings.keys():
+        settings["max_steps"] = None
+    if "detect_loops" not in settings.keys():
+        settings["detect_loops"] = False
+    if "memoize" not in settings.keys():
+        settings["memoize"] = False
+    if "memo_size" not in settings.keys():
+        settings["memo_size"] = 4096
+    if "input_file" not in settings.keys():
+        # Only prompt for inputs if there is someone to answer the prompts
+        settings["input_file"] = None if sys.stdin.isatty() or "batch" in settings.keys() else "-"
+    elif "batch" in settings.keys():
+        raise ValueError("Arguments --input-file and --batch cannot be combined.")
+    if "cache_size" not in settings.keys():
+        settings["cache_size"] = 64
+    if "time_limit" not in settings.keys():
+        settings["time_limit"] = None
+
+    if "serve" in settings.keys():
+        import asyncio
+        server = Server(settings["serve"], settings["jobs"], settings["cache_size"], settings["max_tape_size"],
+                        settings["max_stack_size"], settings["backend"], settings["max_steps"],
+                        settings["time_limit"], settings["detect_loops"], settings["use_cache"])
+        try:
+            asyncio.run(server.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        sys.exit(0)
+
+    # Validate file name
+    if file_name_pattern.match(input_file_name) is None:
+        raise NameError('Invalid file name. Functional Turing Machine files must end with ".ftm"')
+
+    program = Program.compile(input_file_name, settings["use_cache"])
+
+    if "emit_python" in settings.keys():
+        with open(settings["emit_python"], 'w') as python_file:
+            python_file.write(generate_python(program))
+        sys.exit(0)
+
+    if "replay" in settings.keys():
+        reader = TraceReader(settings["replay"], program)
+        try:
+            tape, stack, steps = reader.seek(settings["seek"])
+        finally:
+            reader.close()
+
+        # Print the stack from the top frame down, then the tape
+        print(f"Step: {steps}")
+        for function_id, flags, state in reversed(list(stack)):
+            function = program.functions[function_id]
+            flag_text = ''.join(f" {name}={pos}" for name, pos in zip(function["flag_names"], flags) if pos is not None)
+            print(f"@{function['name']} State: {function['state_names'][state]}{flag_text}")
+        if stack.is_empty():
+            print("Program has finished.")
+        if settings["trace_window"] is None:
+            print(repr(tape))
+        else:
+            print(f"{tape.window(settings['trace_window'])} Position: {tape.get_position()}")
+        sys.exit(0)
+
+    if "batch" in settings.keys():
+        if settings["lockstep"]:
+            if settings["backend"] == "python":
+                raise ValueError("Arguments --lockstep and --transpile cannot be combined.")
+            if settings["detect_loops"]:
+                raise ValueError("Arguments --lockstep and --detect-loops cannot be combined.")
+            if settings["memoize"]:
+                raise ValueError("Arguments --lockstep and --memoize cannot be combined.")
+            results = run_lockstep(program, read_batch(settings["batch"]), settings["max_tape_size"],
+                                   settings["max_stack_size"], settings["max_steps"])
+        else:
+            results = run_batch(program, read_batch(settings["batch"]), settings["jobs"], settings["max_tape_size"],
+                                settings["max_stack_size"], settings["backend"], settings["max_steps"],
+                                settings["detect_loops"], settings["memoize"], settings["memo_size"])
+
+        # Write one JSON object per run, in the order of the batch file
+        batch_output = open(settings["batch_output"], 'w') if "batch_output" in settings.keys() else sys.stdout
+        try:
+            for result in results:
+                batch_output.write(json.dumps(result) + '\n')
+        finally:
+            if batch_output is not sys.stdout:
+                batch_output.close()
+        sys.exit(0)
+
+    machine = Machine(program, settings["max_tape_size"], settings["max_stack_size"], settings["print_tape"],
+                      settings["print_state"], settings["backend"], settings["profile"], settings["trace_window"],
+                      settings["trace_changes"], settings["record"], settings["snapshot_every"],
+                      settings["checkpoint"], settings["checkpoint_every"], settings["paged_tape"],
+                      settings["tape_file"], settings["max_steps"], settings["detect_loops"], settings["memoize"],
+                      settings["memo_size"])
+    if settings["input_file"] is None:
+        input_file = None
+    elif settings["input_file"] == "-":
+        input_file = sys.stdin
+    else:
+        input_file = open(settings["input_file"])
+    try:
+        steps = machine.run(inputs=None if input_file is None else read_inputs(input_file), resume=settings["resume"])
+    finally:
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+        # Write the profile even if the program failed
+        if machine.profile is not None:
+            if "profile_output" in settings.keys():
+                machine.profile.save(settings["profile_output"])
+            else:
+                machine.profile.report(sys.stderr)
+
+    if settings["print_steps"]:
+        print(f"Steps: {steps}", file=sys.stderr)
+        if machine.memo is not None:
+            print(f"Memoized calls: {machine.memo.hits} hits, {machine.memo.misses} misses.", file=sys.stderr)
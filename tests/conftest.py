@@ -0,0 +1,45 @@
+import collections
+import io
+import os
+import sys
+
+import pytest
+
+# The interpreter is a single script at the root of the repository rather than an installed package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from functional_turing_machine import Machine, Program  # noqa: E402
+
+# The outcome of run(): the number of steps of the last run or the error it raised, the final position and cells of
+# the tape, the output and the Machine
+Run = collections.namedtuple("Run", ["result", "position", "cells", "output", "machine"])
+
+
+@pytest.fixture
+def examples():
+    "Returns the path of the directory of example programs."
+    return os.path.join(ROOT, "examples")
+
+
+@pytest.fixture
+def interpreter():
+    "Returns the path of the interpreter script, to run it in a new process."
+    return os.path.join(ROOT, "functional_turing_machine.py")
+
+
+def run(program, tape_contents=None, inputs=(), runs=1, **settings):
+    """Runs program, which is a Program or the source of a script, runs times on one Machine with the given settings
+    and returns the Run of the last run. Errors are returned as "Type: message". Runs that print the tape print it to
+    the output, so compare Runs with run(...)[:3] to only compare the final result and tape."""
+    if isinstance(program, str):
+        program = Program.compile(program)
+    machine = Machine(program, **settings)
+    for _ in range(runs):
+        output = io.StringIO()
+        try:
+            result = machine.run(tape_contents, output=output, inputs=inputs)
+        except (IndexError, KeyError, ValueError) as e:
+            result = f"{type(e).__name__}: {e}"
+    tape = machine.tape
+    return Run(result, tape.get_position(), tape.get_bits(0, len(tape)), output.getvalue(), machine)
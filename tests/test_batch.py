@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+from functional_turing_machine import Program, read_batch, run_batch
+
+
+def test_read_batch(tmp_path):
+    path = tmp_path / "runs.txt"
+    path.write_text("# Comment\n101 11\n\n  1 -  # Empty second input\n-\n")
+    assert read_batch(path) == [["101", "11"], ["1", ""], [""]]
+
+
+def test_run_batch(examples):
+    program = Program.compile(os.path.join(examples, "add.ftm"), use_cache=False)
+    runs = [["101", "11"], ["1"], ["1111111", "1"], ["2", "1"]]
+    results = run_batch(program, runs, jobs=1)
+    assert results[0] == {"inputs": ["101", "11"], "steps": 47, "error": None,
+                          "output": "The sum of the two numbers you entered is:\n00001000\n"}
+    assert results[1] == {"inputs": ["1"], "steps": None, "output": "",
+                          "error": 'ValueError: No input left for "Enter second number (1-7 bits):".'}
+    assert results[2]["output"].endswith("\n10000000\n")
+    assert results[3]["error"].startswith('ValueError: Invalid input "2"')
+    # Worker processes give the same results in the same order
+    assert run_batch(program, runs, jobs=2) == results
+
+
+def test_batch_command(interpreter, examples, tmp_path):
+    batch = tmp_path / "runs.txt"
+    batch.write_text("1 1\n0 1\n")
+    results = tmp_path / "results.jsonl"
+    subprocess.run([sys.executable, interpreter, os.path.join(examples, "add_single_bit.ftm"), "--batch", str(batch),
+                    "--batch-output", str(results), "--jobs", "1", "--no-cache"], check=True)
+    lines = [json.loads(line) for line in results.read_text().splitlines()]
+    assert [result["output"] for result in lines] == ["The sum of the two bits is:\n10\n",
+                                                      "The sum of the two bits is:\n01\n"]
+
+
+def test_serial_batches_do_not_import_the_process_pool(interpreter, examples):
+    path = os.path.join(examples, "helloworld.ftm")
+    script = ("import sys\n"
+              "from functional_turing_machine import Program, run_batch\n"
+              f"run_batch(Program.compile({path!r}, use_cache=False), [[]], jobs=1)\n"
+              "print('concurrent.futures' in sys.modules)\n")
+    result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(interpreter), capture_output=True,
+                            text=True, check=True)
+    assert result.stdout == "False\n"
@@ -0,0 +1,40 @@
+import os
+
+from benchmark import compare, input_specs, run_case, scripted_inputs
+from functional_turing_machine import Program
+
+SETTINGS = {"max_tape_size": 10000, "max_stack_size": 1000, "backend": "interpreter", "min_time": 0}
+
+
+def test_scripted_inputs(examples):
+    program = Program.compile(os.path.join(examples, "add.ftm"), use_cache=False)
+    assert input_specs(program) == [(1, 7), (1, 7)]
+    cases = scripted_inputs(program, [0, 0.5, 1])
+    assert [size for size, _ in cases] == [0, 0.5, 1]
+    assert [list(map(len, inputs)) for _, inputs in cases] == [[1, 1], [4, 4], [7, 7]]
+    # The inputs are the same on every run of the benchmark
+    assert scripted_inputs(program, [0, 0.5, 1]) == cases
+
+
+def test_run_case(examples):
+    result = run_case(os.path.join(examples, "add.ftm"), ["101", "11"], SETTINGS)
+    assert result["steps"] == 47
+    assert result["runs"] == 1
+    assert result["peak_tape"] == 14
+    assert result["steps_per_sec"] > 0
+
+
+def test_compare():
+    baseline = {
+        "a": {"steps": 10, "steps_per_sec": 1000, "peak_rss_kb": 100, "peak_tape": 5},
+        "b": {"error": "IndexError: x"},
+    }
+    assert compare({"a": dict(baseline["a"], steps_per_sec=950), "b": baseline["b"], "c": {}}, baseline, 0.1) == []
+    assert compare({"a": {"steps": 11, "steps_per_sec": 800, "peak_rss_kb": 120, "peak_tape": 6},
+                    "b": {"error": "IndexError: y"}}, baseline, 0.1) == [
+        "a: step count changed from 10 to 11",
+        "a: 800 steps/sec is slower than the baseline of 1000",
+        "a: peak RSS of 120 KB is above the baseline of 100 KB",
+        "a: peak tape length changed from 5 to 6",
+        "b: error changed from IndexError: x to IndexError: y",
+    ]
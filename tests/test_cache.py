@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import functional_turing_machine
+from functional_turing_machine import Program
+
+SOURCE = "@main() s\n    s * !print_str(\"cached\") return\n"
+
+
+@pytest.fixture
+def script(tmp_path):
+    "Returns the path of a script in a new directory."
+    path = tmp_path / "cached.ftm"
+    path.write_text(SOURCE)
+    return str(path)
+
+
+def fail_to_parse(script):
+    raise AssertionError("The script was parsed.")
+
+
+def test_compile_writes_and_loads_the_cache(script, monkeypatch):
+    program = Program.compile(script)
+    assert os.path.exists(Program.cache_path(script))
+    monkeypatch.setattr(functional_turing_machine, "parse_script", fail_to_parse)
+    cached = Program.compile(script)
+    assert cached.functions[cached.main]["table"] == program.functions[program.main]["table"]
+    assert cached.source_hash == program.source_hash
+
+
+def test_changed_scripts_are_parsed_again(script):
+    Program.compile(script)
+    with open(script, 'a') as script_file:
+        script_file.write("    t * * * return\n")
+    program = Program.compile(script)
+    assert program.functions[program.main]["state_names"] == ["s", "return", "t"]
+    assert program.source_hash == Program.hash_file(script)
+
+
+def test_invalid_caches_are_ignored(script):
+    os.makedirs(os.path.dirname(Program.cache_path(script)))
+    with open(Program.cache_path(script), 'wb') as cache_file:
+        cache_file.write(b"not a pickle")
+    program = Program.compile(script)
+    assert program.functions[program.main]["state_names"] == ["s", "return"]
+    # The invalid cache is replaced
+    assert Program._load_cache(Program.cache_path(script), program.source_hash) is not None
+
+
+def test_compile_without_the_cache(script):
+    Program.compile(script, use_cache=False)
+    assert not os.path.exists(os.path.dirname(Program.cache_path(script)))
+
+
+def test_unwritable_cache_is_not_an_error(script):
+    # A file where the cache directory should be stops the cache from being written
+    with open(os.path.dirname(Program.cache_path(script)), 'w'):
+        pass
+    program = Program.compile(script)
+    assert program.path == script
+    assert program.functions[program.main]["state_names"] == ["s", "return"]
@@ -0,0 +1,106 @@
+import io
+import shutil
+
+import pytest
+
+import functional_turing_machine
+from functional_turing_machine import Machine, Program, save_checkpoint
+
+# Fills 20 cells with 1s, going back to the start with a scan in a call before every cell
+SOURCE = ("@main() p\n"
+          "    p * !print_str(\"start\") s\n"
+          "    s * !flag(a) f\n"
+          "    f * * >20 t\n"
+          "    t * !flag(b) g\n"
+          "    g * !goto(a) l\n"
+          "    l * !if(b) e : w\n"
+          "    w * 1 > c\n"
+          "    c * !back(a) l\n"
+          "    e * !print_str(\"end\") return\n"
+          "@back(a) g\n"
+          "    g * !goto(a) m\n"
+          "    m 1 * > m\n"
+          "    m 0 * * return\n")
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    "Returns the path of a checkpoint file."
+    return str(tmp_path / "run.checkpoint")
+
+
+@pytest.fixture
+def saved(tmp_path, monkeypatch):
+    """Returns a function that runs a program with a checkpoint every 10 steps and returns the step count and the path
+    of a copy of every checkpoint that the run saved, as if it had been stopped there."""
+    def run(program):
+        copies = []
+
+        def save(path, *arguments):
+            save_checkpoint(path, *arguments)
+            copies.append(str(tmp_path / f"{len(copies)}.checkpoint"))
+            shutil.copyfile(path, copies[-1])
+
+        monkeypatch.setattr(functional_turing_machine, "save_checkpoint", save)
+        try:
+            steps = Machine(program, checkpoint=str(tmp_path / "run.checkpoint"), checkpoint_every=10).run(
+                output=io.StringIO())
+        finally:
+            monkeypatch.undo()
+        return steps, copies
+
+    return run
+
+
+def test_resumed_runs_finish_like_uninterrupted_ones(saved):
+    program = Program.compile(SOURCE)
+    machine = Machine(program)
+    steps = machine.run(output=io.StringIO())
+    assert steps > 200
+    saved_steps, checkpoints = saved(program)
+    assert saved_steps == steps
+    # Checkpoints are saved every 10 steps, even when a scan crosses one
+    assert len(checkpoints) == steps // 10
+    for path in checkpoints:
+        resumed = Machine(program)
+        output = io.StringIO()
+        assert resumed.run(output=output, resume=path) == steps
+        # Output printed before the checkpoint was saved is not printed again
+        assert output.getvalue() == "end\n"
+        assert resumed.tape.get_bits(0, len(resumed.tape)) == machine.tape.get_bits(0, len(machine.tape))
+
+
+def test_resume_on_a_paged_tape(saved):
+    program = Program.compile(SOURCE)
+    steps, checkpoints = saved(program)
+    for path in checkpoints[::5]:
+        assert Machine(program, paged_tape=True).run(output=io.StringIO(), resume=path) == steps
+
+
+def test_checkpoints_of_other_programs(saved):
+    checkpoint = saved(Program.compile(SOURCE))[1][10]
+    with pytest.raises(ValueError, match="Checkpoint was saved from a different program."):
+        Machine(Program.compile(SOURCE + "\n")).run(output=io.StringIO(), resume=checkpoint)
+
+
+def test_checkpoints_must_fit_the_limits(saved):
+    program = Program.compile(SOURCE)
+    checkpoint = saved(program)[1][10]
+    with pytest.raises(ValueError, match="Saved tape does not fit within the maximum tape size."):
+        Machine(program, max_tape=10).run(output=io.StringIO(), resume=checkpoint)
+    with pytest.raises(IndexError, match="Stack has reached its maximum size of 1."):
+        Machine(program, max_stack=1).run(output=io.StringIO(), resume=checkpoint)
+
+
+def test_invalid_checkpoints(checkpoint):
+    program = Program.compile(SOURCE)
+    with open(checkpoint, 'wb') as checkpoint_file:
+        checkpoint_file.write(b"FTMCHECK")
+    with pytest.raises(ValueError, match="Checkpoint file is truncated."):
+        Machine(program).run(output=io.StringIO(), resume=checkpoint)
+    with open(checkpoint, 'wb') as checkpoint_file:
+        checkpoint_file.write(b"x" * 100)
+    with pytest.raises(ValueError, match="File is not a checkpoint."):
+        Machine(program).run(output=io.StringIO(), resume=checkpoint)
+    with pytest.raises(ValueError, match="Cannot set the tape contents of a resumed run."):
+        Machine(program).run("1", output=io.StringIO(), resume=checkpoint)
@@ -0,0 +1,91 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from functional_turing_machine import Machine, Program, read_input, read_inputs
+
+
+def test_read_inputs():
+    assert list(read_inputs(io.StringIO("101\n\n11\r\n1"))) == ["101", "", "11", "1"]
+    assert list(read_inputs(io.StringIO(""))) == []
+
+
+def test_read_inputs_is_lazy():
+    lines = iter(["1\n", "0\n"])
+    inputs = read_inputs(lines)
+    assert next(inputs) == "1"
+    # The second line is only read when the next !input needs it
+    assert next(lines) == "0\n"
+
+
+def test_read_input():
+    assert read_input('1', '3', "Bits:", iter(["101"])) == "101"
+    assert read_input('0', '2', "Bits:", iter([""])) == ""
+    with pytest.raises(ValueError, match='^Invalid input "1111" for "Bits:": expected between 1 and 3 bits.$'):
+        read_input('1', '3', "Bits:", iter(["1111"]))
+    with pytest.raises(ValueError, match='^Invalid input "12" for "Bits:"'):
+        read_input('1', '3', "Bits:", iter(["12"]))
+    with pytest.raises(ValueError, match='^No input left for "Bits:".$'):
+        read_input('1', '3', "Bits:", iter([]))
+
+
+def test_closed_standard_input(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO(""))
+    with pytest.raises(ValueError, match='^No input left for "Bits:".$'):
+        read_input('1', '3', "Bits:")
+
+
+def test_inputs_are_written_to_the_tape():
+    program = Program.compile('@main() a\n'
+                              '    a * !flag(start) b\n'
+                              '    b * !input(0, 5, "Bits:") c\n'
+                              '    c * !flag(end) d\n'
+                              '    d * !print_val(start, end) return\n')
+    output = io.StringIO()
+    assert Machine(program).run(output=output, inputs=["10110"]) == 4
+    # The head moves past the bits it writes
+    assert output.getvalue() == "10110\n"
+    with pytest.raises(IndexError):
+        Machine(program, max_tape=3).run(output=io.StringIO(), inputs=["10110"])
+
+
+def run_script(interpreter, examples, *arguments, stdin=""):
+    "Runs the add example with the given arguments and standard input, and returns the finished process."
+    return subprocess.run([sys.executable, interpreter, os.path.join(examples, "add.ftm"), "--no-cache", *arguments],
+                          input=stdin, capture_output=True, text=True, timeout=60)
+
+
+def test_input_file(interpreter, examples, tmp_path):
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("101\n11\n")
+    result = run_script(interpreter, examples, "--input-file", str(inputs))
+    assert result.returncode == 0
+    # Prompts are not printed when the inputs come from a file
+    assert result.stdout == "The sum of the two numbers you entered is:\n00001000\n"
+
+
+@pytest.mark.parametrize("arguments", [(), ("--input-file", "-")])
+def test_piped_inputs(interpreter, examples, arguments):
+    result = run_script(interpreter, examples, *arguments, stdin="101\n11\n")
+    assert result.returncode == 0
+    assert result.stdout == "The sum of the two numbers you entered is:\n00001000\n"
+
+
+@pytest.mark.parametrize("stdin, error", [
+    ("101\n", 'ValueError: No input left for "Enter second number (1-7 bits):".'),
+    ("101\n2\n", 'ValueError: Invalid input "2" for "Enter second number (1-7 bits):": expected between 1 and 7 bits.'),
+    # An invalid input is an error rather than a retry that takes the next line
+    ("101\n11111111\n11\n", 'ValueError: Invalid input "11111111" for "Enter second number (1-7 bits):"'),
+])
+def test_piped_input_errors(interpreter, examples, stdin, error):
+    result = run_script(interpreter, examples, stdin=stdin)
+    assert result.returncode != 0
+    assert error in result.stderr
+
+
+def test_input_file_and_batch(interpreter, examples, tmp_path):
+    result = run_script(interpreter, examples, "--input-file", "-", "--batch", str(tmp_path / "batch.jsonl"))
+    assert "ValueError: Arguments --input-file and --batch cannot be combined." in result.stderr
@@ -0,0 +1,87 @@
+import io
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from functional_turing_machine import Machine, Program
+
+SOURCE = ("@main() s\n"
+          "    s * !flag(start) a\n"
+          "    a 1 * > a\n"
+          "    a 0 !flag(end) p\n"
+          "    p * !print_val(start, end) return\n")
+
+
+def test_compile_from_text_and_path(tmp_path):
+    path = tmp_path / "ones.ftm"
+    path.write_text(SOURCE)
+    from_text = Program.compile(SOURCE)
+    from_path = Program.compile(str(path), use_cache=False)
+    from_path_like = Program.compile(path, use_cache=False)
+    assert from_text.path is None
+    assert from_path.path == from_path_like.path == str(path)
+    assert from_text.source_hash == from_path.source_hash == from_path_like.source_hash
+    for program in [from_text, from_path, from_path_like]:
+        result = io.StringIO()
+        Machine(program).run("110", output=result)
+        assert result.getvalue() == "11\n"
+
+
+def test_invalid_file_name_is_script_text():
+    # Only single lines ending in ".ftm" are paths, so anything else is parsed as a script
+    with pytest.raises(ValueError, match="Expression on line 1, column 1 is not inside a function."):
+        Program.compile("examples/helloworld.txt")
+
+
+def test_machine_runs_any_number_of_times():
+    machine = Machine(Program.compile(SOURCE))
+    for tape_contents, output in [("1110", "111\n"), ("10", "1\n"), (iter([1, 1, 0]), "11\n")]:
+        result = io.StringIO()
+        machine.run(tape_contents, output=result)
+        assert result.getvalue() == output
+    # Every run starts with a fresh tape
+    assert [machine.tape.get_value_at(position) for position in range(3)] == [1, 1, 0]
+
+
+def test_machines_share_a_program():
+    program = Program.compile(SOURCE)
+    first, second = Machine(program), Machine(program)
+    first.run("11", output=io.StringIO())
+    second.run("1", output=io.StringIO())
+    assert first.tape.get_position() == 2
+    assert second.tape.get_position() == 1
+
+
+def test_programs_can_be_pickled():
+    program = pickle.loads(pickle.dumps(Program.compile(SOURCE)))
+    result = io.StringIO()
+    Machine(program).run("1", output=result)
+    assert result.getvalue() == "1\n"
+
+
+def test_inputs(examples):
+    program = Program.compile(os.path.join(examples, "invert.ftm"), use_cache=False)
+    with pytest.raises(ValueError, match='No input left for "Enter a number:".'):
+        Machine(program).run(output=io.StringIO(), inputs=[])
+    with pytest.raises(ValueError, match='Invalid input "12" for "Enter a number:"'):
+        Machine(program).run(output=io.StringIO(), inputs=["12"])
+
+
+def test_invalid_settings():
+    program = Program.compile(SOURCE)
+    with pytest.raises(ValueError, match="Maximum tape size must be at least 1."):
+        Machine(program, max_tape=0)
+    with pytest.raises(ValueError, match="Maximum stack size must be at least 1."):
+        Machine(program, max_stack=0)
+    with pytest.raises(ValueError, match="Invalid backend: c."):
+        Machine(program, backend="c")
+
+
+def test_importing_does_not_run_the_interpreter(interpreter):
+    # The command line interface only runs when the file is run as a script
+    result = subprocess.run([sys.executable, "-c", "import functional_turing_machine"], capture_output=True, text=True,
+                            input="", cwd=os.path.dirname(interpreter), timeout=60)
+    assert (result.returncode, result.stdout) == (0, "")
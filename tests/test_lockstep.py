@@ -0,0 +1,119 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from functional_turing_machine import Program, run_batch, run_lockstep
+
+pytest.importorskip("numpy")
+
+# Scans in both directions, calls with and without flags, recursion, ifs, fills, input and output
+SOURCE = ("@main() s\n"
+          "    s * !flag(a) i\n"
+          "    i * !input(0, 6, \"bits:\") b\n"
+          "    b * !flag(b) c\n"
+          "    c * !count(a, b) p\n"
+          "    p * !print_val(a, b) q\n"
+          "    q * !print_val() return\n"
+          "@count(from, to) g\n"
+          "    g * !goto(from) t\n"
+          "    t * !if(to) return : n\n"
+          "    n 0 1 > h\n"
+          "    n 1 0 > h\n"
+          "    h * !flag(from) r\n"
+          "    r * !count(from, to) x\n"
+          "    x * * >2:1 y\n"
+          "    y 1 * < y\n"
+          "    y 0 * * return\n")
+
+
+def assert_same_results(program, runs, **settings):
+    "Checks that the lockstep engine gives the same result for every run as running each one alone."
+    assert run_lockstep(program, runs, **settings) == run_batch(program, runs, jobs=1, **settings)
+
+
+@pytest.mark.parametrize("name, runs", [
+    ("helloworld", [[], []]),
+    ("add", [["101", "11"], ["1111111", "1111111"], ["1", "0"], ["1"], ["12", "1"]]),
+    ("count", [[""], ["1"], ["110010111010101"]]),
+    ("palindrome", [["1"], ["1001"], ["10"], ["110011"]]),
+    ("reverse", [["1"], ["10110"], ["0" * 50]]),
+])
+def test_examples(examples, name, runs):
+    assert_same_results(Program.compile(os.path.join(examples, f"{name}.ftm"), use_cache=False), runs)
+
+
+@pytest.mark.parametrize("settings", [
+    {},
+    {"max_tape": 12},
+    {"max_stack": 4},
+    {"max_steps": 30},
+    {"max_steps": 100},
+])
+def test_limits(settings):
+    runs = [[""], ["1"], ["01"], ["1101"], ["000000"], ["111111"], ["2"], []]
+    assert_same_results(Program.compile(SOURCE), runs, **settings)
+
+
+def test_flag_errors():
+    program = Program.compile("@main() s\n"
+                              "    s 0 !f(a) return\n"
+                              "    s 1 !if(b) return : t\n"
+                              "    t * * * return\n"
+                              "@f(x) g\n"
+                              "    g * !goto(x) return\n")
+    results = run_lockstep(program, [[]])
+    assert results == run_batch(program, [[]], jobs=1)
+    assert results[0]["error"] == "KeyError: 'Flag name a referenced before creation.'"
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_random_programs(seed):
+    rng = random.Random(seed)
+    functions = {"main": [], "g": ["x"], "h": ["x", "y"]}
+    lines = []
+    for name, parameters in functions.items():
+        lines.append(f"@{name}({', '.join(parameters)}) a")
+        flags = parameters + ["p", "q"]
+        for state in "abcde":
+            for value in rng.choice([['*'], ['0', '1'], ['1']]):
+                kind = rng.random()
+                next_state = rng.choice("abcdez")
+                if next_state == state:
+                    next_state = "z"
+                if kind < 0.4:
+                    operation = rng.choice("<>*")
+                    if operation != '*':
+                        operation += rng.choice(['', '2', '3']) + rng.choice(['', ':0', ':1'])
+                    lines.append(f"    {state} {value} {rng.choice('01*')} {operation} {next_state}")
+                elif kind < 0.5:
+                    lines.append(f"    {state} {value} * {rng.choice('<>')}{rng.choice(['', '2'])} *")
+                elif kind < 0.6:
+                    lines.append(f"    {state} {value} !flag({rng.choice(flags)}) {next_state}")
+                elif kind < 0.65:
+                    lines.append(f"    {state} {value} !goto({rng.choice(flags)}) {next_state}")
+                elif kind < 0.7:
+                    false_state = rng.choice("abcde".replace(state, ''))
+                    lines.append(f"    {state} {value} !if({rng.choice(flags)}) {next_state} : {false_state}")
+                elif kind < 0.75:
+                    lines.append(f"    {state} {value} !input(0, 2, \"in\") {next_state}")
+                elif kind < 0.8:
+                    lines.append(f"    {state} {value} !print_val({rng.choice(['', rng.choice(flags)])}) {next_state}")
+                else:
+                    callee = rng.choice(["g", "h"])
+                    arguments = ', '.join(rng.choice(flags) for _ in functions[callee])
+                    lines.append(f"    {state} {value} !{callee}({arguments}) {rng.choice([next_state, 'a'])}")
+    program = Program.compile('\n'.join(lines) + '\n')
+    runs = [[''.join(rng.choice("01") for _ in range(rng.randrange(3))) for _ in range(rng.randrange(4))]
+            for _ in range(10)]
+    assert_same_results(program, runs, max_tape=rng.choice([30, 200]), max_stack=rng.choice([3, 50]),
+                        max_steps=rng.choice([50, 2000]))
+
+
+def test_numpy_is_only_imported_by_the_lockstep_engine(interpreter):
+    script = "import sys, functional_turing_machine\nprint('numpy' in sys.modules)\n"
+    result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(interpreter), capture_output=True,
+                            text=True, check=True)
+    assert result.stdout == "False\n"
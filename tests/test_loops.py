@@ -0,0 +1,67 @@
+import pytest
+
+from conftest import run
+from functional_turing_machine import HashedTape, TuringTape
+
+# Reads bits at the start of the tape until it reads a 0, which is a loop that input gets the program out of
+RETRY = ("@main() a\n"
+         "    a * !input(1, \"bit:\") b\n"
+         "    b * * < c\n"
+         "    c 1 * * a\n"
+         "    c 0 * * return\n")
+
+
+def test_loops_are_detected():
+    assert run("@main() a\n    a * * > b\n    b * * < a\n", detect_loops=True)[:2] == \
+        ("ValueError: Infinite loop detected: the program repeats every 2 steps in states @main b, @main a.", 1)
+    assert run("@main() a\n    a * * > b\n    b * !g() a\n@g() s\n    s * * < return\n", detect_loops=True).result == \
+        "ValueError: Infinite loop detected: the program repeats every 3 steps in states @main a, @main b, @g s."
+
+
+def test_programs_that_keep_changing_are_not_loops():
+    # Infinite recursion grows the stack, and a scan over 0s grows the tape
+    assert run("@main() a\n    a * !main() b\n    b * * * return\n", detect_loops=True, max_stack=50).result == \
+        "IndexError: Stack has reached its maximum size of 50."
+    assert run("@main() a\n    a 0 1 > a\n", detect_loops=True, max_tape=500).result == \
+        "IndexError: TuringTape has reached its maximum size of 500."
+
+
+def test_loops_that_read_input_are_not_loops():
+    # Every input can be different, so a configuration seen before an input is not a loop
+    inputs = ["1"] * 10 + ["0"]
+    assert run(RETRY, inputs=inputs, detect_loops=True)[:2] == run(RETRY, inputs=inputs)[:2] == (33, 0)
+
+
+def test_hashed_tape():
+    tape, other = HashedTape(TuringTape(100)), HashedTape(TuringTape(100))
+    tape.right(5, 1)
+    tape.left(2, '*')
+    tape.selected = 0
+    other.write("011011")
+    other.set_position(3)
+    assert tape.hash == other.hash
+    tape.selected = 1
+    assert tape.hash != other.hash
+
+
+@pytest.mark.parametrize("source, tape_contents", [
+    ("@main() a\n    a * * > b\n    b * * < a\n", ""),
+    ("@main() a\n" + ''.join(f"    s{i} * * > s{i + 1}\n" for i in range(200)).replace("s0", "a", 1), ""),
+    ("@main() a\n    a * !g() a\n@g() s\n    s 0 1 > return\n    s 1 0 > return\n", ""),
+    ("@main() a\n    a 1 * > a\n", "1" * 500),
+    ("@main() s\n    s * * >498 a\n    a * * <2 a\n", ""),
+])
+@pytest.mark.parametrize("max_steps", [1, 99, 100, 101])
+def test_step_limit(source, tape_contents, max_steps):
+    result = run(source, tape_contents, max_steps=max_steps, max_tape=1000).result
+    assert result == f"IndexError: Program has reached its maximum of {max_steps} steps."
+    assert result == run(source, tape_contents, print_tape=True, max_steps=max_steps, max_tape=1000).result
+
+
+def test_scans_stop_at_the_step_limit():
+    # Scans run many moves at once, but must stop at the step limit like single moves do
+    assert run("@main() a\n    a 0 * > a\n", max_tape=10 ** 6, max_steps=100)[:2] == \
+        ("IndexError: Program has reached its maximum of 100 steps.", 100)
+    assert run("@main() a\n    a 1 * > a\n", "1" * 50, max_steps=50)[:2] == (50, 50)
+    assert run("@main() a\n    a 1 * > a\n", "1" * 51, max_steps=50)[:2] == \
+        ("IndexError: Program has reached its maximum of 50 steps.", 50)
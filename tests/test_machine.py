@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from conftest import run
+from functional_turing_machine import OP_CALL, OP_FLAG, OP_MOVE, Program
+
+
+@pytest.mark.parametrize("name, inputs, steps, output", [
+    ("helloworld", [], 1, "Hello, world!\n"),
+    ("add", ["101", "11"], 47, "The sum of the two numbers you entered is:\n00001000\n"),
+    ("add_single_bit", ["1", "1"], 14, "The sum of the two bits is:\n10\n"),
+    ("count", ["101"], 38, "Number of 1's entered:\n0010\nNumber of 0's entered:\n0001\n"),
+    ("invert", ["1100"], 14, "The inverse of your input is:\n0011\n"),
+    ("palindrome", ["101"], 13, "You entered a palindrome!\n"),
+    ("palindrome", ["100"], 7, "You did not enter a palindrome!\n"),
+    ("reverse", ["0011101"], 34, "Your string reversed is:\n1011100\n"),
+])
+def test_examples(examples, name, inputs, steps, output):
+    program = Program.compile(os.path.join(examples, f"{name}.ftm"), use_cache=False)
+    result = run(program, inputs=inputs)
+    assert (result.result, result.output) == (steps, output)
+
+
+def test_tables_are_indexed_by_state_and_cell():
+    program = Program.compile("@main() start\n"
+                              "    start 0 1 > mark\n"
+                              "    start 1 !flag(here) mark\n"
+                              "    mark * !helper(here) end\n"
+                              "    end * * * return\n"
+                              "@helper(x) s\n")
+    assert program.function_ids == {"main": 0, "helper": 1}
+    main = program.functions[program.main]
+    assert main["state_names"] == ["start", "mark", "end", "return"]
+    assert main["flag_names"] == ["here"]
+    start, mark = main["table"][0], main["table"][1]
+    assert start[0] == (OP_MOVE, 1, 1, '*', 1, 1)
+    assert start[1] == (OP_FLAG, 0, 1)
+    # Expressions matching '*' fill both cells with the same entry
+    assert mark[0] is mark[1]
+    assert mark[0][:4] == (OP_CALL, 1, "helper", (0,))
+    # States without expressions return
+    assert main["table"][3] == [None, None]
+
+
+def test_star_expressions_take_priority():
+    result = run("@main() s\n"
+                 "    s * !print_str(\"star\") return\n"
+                 "    s 0 !print_str(\"zero\") return\n")
+    assert (result.result, result.output) == (1, "star\n")
+
+
+def test_flag_used_before_creation():
+    assert run("@main() s\n    s * !goto(f) return\n").result == \
+        "KeyError: 'Flag name f referenced before creation.'"
+
+
+def test_tape_and_stack_limits():
+    assert run("@main() s\n    s * * > s\n", max_tape=5).result == \
+        "IndexError: TuringTape has reached its maximum size of 5."
+    assert run("@main() s\n    s * * < s\n").result == "IndexError: TuringTape cannot extend below position 0."
+    assert run("@main() s\n    s * !main() t\n    t * * > return\n", max_stack=10).result == \
+        "IndexError: Stack has reached its maximum size of 10."
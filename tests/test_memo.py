@@ -0,0 +1,183 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import run
+from functional_turing_machine import CallMemo, Machine, Program, TuringTape
+
+# Calls a function for each of twelve cells, which calls another one that flips a cell and flips it back, so that all
+# but the first few calls are found in the memo
+REPEAT = ("@main() fill\n"
+          "    fill * * >12:1 back\n"
+          "    back * * <11 loop\n"
+          "    loop 1 !work() next\n"
+          "    loop 0 * * return\n"
+          "    next * * > loop\n"
+          "\n"
+          "@work() a\n"
+          "    a * !flag(x) b\n"
+          "    b * * >3 c\n"
+          "    c * !inner() d\n"
+          "    d * * <3 e\n"
+          "    e * !goto(x) return\n"
+          "\n"
+          "@inner() a\n"
+          "    a 1 0 > b\n"
+          "    a 0 1 > b\n"
+          "    b * * < c\n"
+          "    c 1 0 * return\n"
+          "    c 0 1 * return\n")
+
+# The same, but work() ends with a tail call and passes its flag on
+TAIL = REPEAT.replace("    e * !goto(x) return\n", "    e * !back(x) return\n") + \
+    "\n@back(x) a\n    a * !goto(x) return\n"
+
+# Calls that print are never summarized, and neither are the calls that made them
+PRINTS = REPEAT.replace("    b * * < c\n", "    b * !print_str(\"x\") d\n    d * * < c\n")
+
+# Counts in binary up to 512 with a call of inc() for every number, which takes a few steps and is never repeated with
+# the same cells, and then calls twice(), which calls inc() and dec(), from main() and from another function
+COUNTER = ("@main() s\n"
+           "    s * !flag(lo) m\n"
+           "    m * * >9 h\n"
+           "    h * !flag(hi) l\n"
+           "    l * !inc(hi) c\n"
+           "    c * !goto(lo) d\n"
+           "    d 0 * * l\n"
+           "    d 1 * >12 t\n"
+           "    t * !twice() u\n"
+           "    u * !twice() v\n"
+           "    v * !deep() w\n"
+           "    w * * > return\n"
+           "\n"
+           "@inc(x) g\n"
+           "    g * !goto(x) t\n"
+           "    t 1 0 < t\n"
+           "    t 0 1 * return\n"
+           "\n"
+           "@dec(x) g\n"
+           "    g * !goto(x) t\n"
+           "    t 0 1 < t\n"
+           "    t 1 0 * return\n"
+           "\n"
+           "@twice() a\n"
+           "    a * !flag(x) b\n"
+           "    b * !inc(x) c\n"
+           "    c * !dec(x) return\n"
+           "\n"
+           "@deep() a\n"
+           "    a * !twice() b\n"
+           "    b * * > return\n")
+
+
+@pytest.mark.parametrize("source", [REPEAT, TAIL, PRINTS], ids=["repeat", "tail", "prints"])
+def test_memoized_runs_match(source):
+    result = run(source, memoize=True)
+    assert result[:4] == run(source)[:4]
+    machine = result.machine
+    if source is PRINTS:
+        assert machine.memo.hits == 0
+    else:
+        assert machine.memo.hits > 0
+
+
+@pytest.mark.parametrize("source", [REPEAT, TAIL], ids=["repeat", "tail"])
+@pytest.mark.parametrize("runs", [1, 2])
+def test_step_limits(source, runs):
+    # With every limit up to the length of the run, memoized runs stop at the same step as ones that are not, both
+    # with an empty memo and with the memo of an earlier run, which found all of the calls
+    steps = run(source).result
+    hits = 0
+    for max_steps in range(1, steps + 2):
+        result = run(source, runs=runs, memoize=True, max_steps=max_steps)
+        assert result[:4] == run(source, max_steps=max_steps)[:4], max_steps
+        hits += result.machine.memo.hits
+    assert run(source, max_steps=steps - 1).result == f"IndexError: Program has reached its maximum of " \
+        f"{steps - 1} steps."
+    assert hits > 0
+
+
+def test_short_calls_are_skipped():
+    result = run(COUNTER, memoize=True)
+    assert result[:4] == run(COUNTER)[:4]
+    machine = result.machine
+    # inc() is only looked up until its summaries are checked, and twice() is found when deep() calls it
+    program = machine.program
+    assert machine.memo.skipped == {program.function_ids["inc"]}
+    assert machine.memo.misses < CallMemo.CHECK_LOOKUPS + 10
+    assert machine.memo.hits == 1
+
+
+@pytest.mark.parametrize("max_stack", [2, 3, 4, 5])
+def test_skipped_calls_count_towards_the_stack_of_their_caller(max_stack):
+    assert run(COUNTER, memoize=True, max_stack=max_stack)[:4] == run(COUNTER, max_stack=max_stack)[:4]
+
+
+@pytest.mark.parametrize("max_tape", [10, 13, 14, 16, 17])
+def test_tape_limits(max_tape):
+    assert run(REPEAT, runs=2, memoize=True, max_tape=max_tape)[:4] == run(REPEAT, max_tape=max_tape)[:4]
+
+
+@pytest.mark.parametrize("max_stack", [1, 2, 3])
+def test_stack_limits(max_stack):
+    assert run(REPEAT, runs=2, memoize=True, max_stack=max_stack)[:4] == run(REPEAT, max_stack=max_stack)[:4]
+
+
+def test_step_limit_command(interpreter, tmp_path):
+    path = tmp_path / "repeat.ftm"
+    path.write_text(REPEAT)
+    for max_steps in ["60", "100", "122", "123"]:
+        results = [subprocess.run([sys.executable, interpreter, str(path), "--no-cache", "--max-steps", max_steps,
+                                   *memoize], capture_output=True, text=True, stdin=subprocess.DEVNULL, timeout=60)
+                   for memoize in [[], ["--memoize"]]]
+        assert results[0].returncode == results[1].returncode
+        assert results[0].stdout == results[1].stdout
+        if max_steps == "123":
+            assert results[0].returncode == 0
+        else:
+            errors = [result.stderr.strip().splitlines()[-1] for result in results]
+            assert errors[0] == errors[1] == f"IndexError: Program has reached its maximum of {max_steps} steps."
+
+
+@pytest.mark.parametrize("settings", [{"print_tape": True}, {"print_state": True}, {"trace_window": 3},
+                                      {"trace_changes": True}, {"profile": True}, {"record": "run.trace"},
+                                      {"detect_loops": True}])
+def test_unsupported_settings(settings):
+    with pytest.raises(ValueError, match="^Memoizing calls cannot be combined with tracing, profiling, recording or "
+                                         "loop detection.$"):
+        Machine(Program.compile(REPEAT), memoize=True, **settings)
+
+
+def test_python_backend():
+    with pytest.raises(ValueError, match="^The python backend cannot memoize calls.$"):
+        Machine(Program.compile(REPEAT), backend="python", memoize=True)
+
+
+def test_memo_size():
+    with pytest.raises(ValueError, match="^Memo size must be at least 1.$"):
+        CallMemo(0)
+    memo = CallMemo(max_size=2)
+    tape = TuringTape(100)
+    tape.set_bits(0, "0" * 10)
+    # The first call of a function only finds its window, and later ones are summarized
+    assert memo.lookup(0, (), tape, 5) == (None, None)
+    memo.store(0, (), None, tape, 5, -1, 1, 0, 4, 1)
+    assert len(memo) == 0
+    for cells, position in [("010", 2), ("011", 5), ("110", 8)]:
+        tape.set_bits(position - 1, cells)
+        summary, window = memo.lookup(0, (), tape, position)
+        assert summary is None
+        memo.store(0, (), window, tape, position, -1, 1, 0, 4, 1)
+    # Only the two most recent summaries are kept
+    assert len(memo) == 2
+    assert memo.lookup(0, (), tape, 2) == (None, (-1, 1, "010"))
+    assert memo.lookup(0, (), tape, 8)[0] == (-1, "110", 0, 4, 1)
+    # Windows grow to cover every call
+    memo.store(0, (), None, tape, 5, -2, 0, 0, 4, 1)
+    assert memo.lookup(0, (), tape, 5) == (None, (-2, 1, "0011"))
+    # Functions with calls that visit more cells than the memo's largest window are no longer looked up
+    memo = CallMemo(max_window=2)
+    memo.store(0, (), None, tape, 5, -1, 1, 0, 4, 1)
+    assert memo.skipped == {0}
+    assert memo.lookup(0, (), tape, 5) is None
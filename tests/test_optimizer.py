@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from conftest import run
+from functional_turing_machine import MAX_MERGED_STEPS, OP_MOVE, Program
+
+
+def test_moves_are_merged():
+    program = Program.compile("@main() a\n"
+                              "    a * * > b\n"
+                              "    b * * > c\n"
+                              "    c * 1 * d\n"
+                              "    d * * <2 e\n"
+                              "    e 0 * * return\n"
+                              "    e 1 0 >:1 return\n"
+                              "    f * * * a\n")
+    main = program.functions[program.main]
+    fast_table = main["fast_table"]
+    assert fast_table[0] == [(OP_MOVE, None, 2, '*', 2, 2)] * 2
+    # The value written by c is known, so the merged move also takes the entry of e for 1
+    assert fast_table[2] == [(OP_MOVE, 1, -2, '*', 4, 2)] * 2
+    assert fast_table[4] == main["table"][4]
+    # f cannot be reached from the initial state, and neither can the states that are merged through
+    assert main["state_names"][5:] == ["return", "f"]
+    assert main["live_states"] == [0, 2, 4, 5]
+    assert run(program)[:3] == run(program, print_tape=True)[:3]
+
+
+def test_merged_moves_keep_known_cells():
+    program = Program.compile("@main() a\n"
+                              "    a * * * b\n"
+                              "    b 0 1 * c\n"
+                              "    b 1 0 * c\n"
+                              "    c 1 * > return\n"
+                              "    c 0 * < return\n")
+    fast_row = program.functions[program.main]["fast_table"][0]
+    assert fast_row == [(OP_MOVE, 1, 1, '*', 3, 3), (OP_MOVE, 0, -1, '*', 3, 3)]
+    assert run(program)[:3] == (3, 1, "10")
+
+
+def test_merged_moves_are_limited():
+    source = "@main() s0\n" + ''.join(f"    s{i} * * > s{i + 1}\n" for i in range(200))
+    program = Program.compile(source)
+    fast_table = program.functions[program.main]["fast_table"]
+    assert max(row[0][5] for row in fast_table if row[0] is not None) == MAX_MERGED_STEPS
+    assert run(program)[:3] == run(program, print_tape=True)[:3] == (200, 200, "0" * 201)
+
+
+def test_long_chains():
+    # Each entry is merged once, so long chains compile quickly
+    source = "@main() s0\n" + ''.join(f"    s{i} * {i % 2} > s{i + 1}\n" for i in range(50000))
+    program = Program.compile(source)
+    assert run(program, max_tape=60000)[:2] == (50000, 50000)
+
+
+def test_loops():
+    program = Program.compile("@main() a\n    a * * > b\n    b * * < c\n    c * * * a\n")
+    assert run(program, max_steps=1000).result == "IndexError: Program has reached its maximum of 1000 steps."
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_programs_match_unmerged_runs(seed):
+    rng = random.Random(seed)
+    lines = ["@main() s0"]
+    for state in range(12):
+        for value in rng.choice([['*'], ['0', '1']]):
+            next_value = rng.choice(['*', '0', '1'])
+            operation = rng.choice(['*', '<', '>'])
+            if operation != '*':
+                operation += rng.choice(['', '2']) + rng.choice(['', ':0', ':1'])
+            next_state = rng.choice([f"s{rng.randrange(12)}", f"s{state + 1}", "return"])
+            if operation == '*' and next_state == f"s{state}":
+                # The parser rejects states that stay where they are forever
+                next_state = "return"
+            lines.append(f"    s{state} {value} {next_value} {operation} {next_state}")
+    program = Program.compile('\n'.join(lines) + '\n')
+    result = run(program, max_tape=40, max_steps=500)[:3]
+    traced = run(program, print_tape=True, max_tape=40, max_steps=500)[:3]
+    if isinstance(result[0], str):
+        # Merged moves stop at a different cell when they fail
+        assert result[0] == traced[0]
+    else:
+        assert result == traced
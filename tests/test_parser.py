@@ -0,0 +1,83 @@
+import io
+
+import pytest
+
+from functional_turing_machine import Program, parse_script, tokenize
+
+
+def errors(source):
+    "Returns the lines of the error raised by compiling the script source."
+    with pytest.raises(ValueError) as error:
+        Program.compile(source)
+    return str(error.value).splitlines()
+
+
+def test_tokenize():
+    assert tokenize("    a 0 1 >3:1 b # comment") == (["a", "0", "1", ">", "3", ":", "1", "b"],
+                                                      [True, True, True, True, False, False, False, True])
+    assert tokenize("s * !f(x,y) t")[0] == ["s", "*", "!", "f", "(", "x", ",", "y", ")", "t"]
+
+
+def test_parse_script():
+    functions = parse_script(io.StringIO("@main() a\n"
+                                         "  # Comment\n"
+                                         "\n"
+                                         "    a   0   1   >3:1   b   # Trailing comment\n"
+                                         "    b * !flag( x ) c\n"
+                                         "    c * !input(2, 5, \"in: # not a comment\") d\n"
+                                         "    d * !if(x) a : return\n"))
+    main = functions["main"]
+    assert main["initial_state"] == "a"
+    assert main["expressions"][("a", 0)]["count"] == 3
+    assert main["expressions"][("a", 0)]["fill"] == 1
+    assert main["expressions"][("b", '*')]["parameters"] == ["x"]
+    assert main["expressions"][("c", '*')]["prompt"] == "in: # not a comment"
+    assert main["expressions"][("d", '*')]["false_state"] == "return"
+
+
+def test_every_error_is_reported():
+    assert errors("@main() a\n"
+                  "    a 0 1 > b c\n"
+                  "    b * !nope(x) c\n"
+                  "    c * !g(x, y) d\n"
+                  "    d 2 1 > a\n"
+                  "@g(x) s\n") == ['Invalid expression on line 2, column 15.',
+                                   'Invalid function "!nope" on line 3, column 9.',
+                                   'Incorrect number of parameters for function "!g" on line 4, column 9.',
+                                   'Invalid expression on line 5, column 7.']
+
+
+def test_calls_of_functions_defined_later():
+    assert Program.compile("@main() a\n    a * !g(x) return\n@g(y) s\n").function_ids == {"main": 0, "g": 1}
+    assert errors("@main() a\n    a * !g() return\n@g(y) s\n    s * !g(y, y) return\n") == [
+        'Incorrect number of parameters for function "!g" on line 2, column 9.',
+        'Incorrect number of parameters for function "!g" on line 4, column 9.']
+
+
+def test_calls_with_blank_arguments():
+    # Only "()" passes no arguments, so whitespace between the brackets is an error whatever the function takes
+    assert errors("@main() a\n    a 0 !g( ) return\n    a 1 !g (\t) return\n@g() s\n") == [
+        'Incorrect number of parameters for function "!g" on line 2, column 9.',
+        'Incorrect number of parameters for function "!g" on line 3, column 9.']
+    assert errors("@main() a\n    a * !g( ) return\n@g(x) s\n") == [
+        'Incorrect number of parameters for function "!g" on line 2, column 9.']
+    assert Program.compile("@main() a\n    a * !g() return\n@g( ) s\n").function_ids == {"main": 0, "g": 1}
+
+
+@pytest.mark.parametrize("source, message", [
+    ("@f() a\n    a * * > b\n", "No main function specified."),
+    ("@main(x) a\n", "Main function on line 1, column 2 must not take any parameters."),
+    ("@main() a\n@main() b\n", "Repeated function name on line 2, column 2."),
+    ("    a * * > b\n@main() a\n", "Expression on line 1, column 5 is not inside a function."),
+    ("@main() a\n    a 0 * > b\n    a 0 * < c\n", "Repeated expression on line 3, column 5."),
+    ("@main() a\n    a * !print_str(\"unterminated) b\n", "Invalid expression on line 2, column 20."),
+    ("@main() a\n    a * * * a\n", "Infinite loop detected on line 2, column 13."),
+])
+def test_errors(source, message):
+    assert message in errors(source)
+
+
+def test_errors_in_large_scripts():
+    lines = ["@main() s0"] + [f"    s{i} * * > s{i + 1}" for i in range(20000)]
+    lines[12345] = "    s12344 * * > > s12345"
+    assert errors('\n'.join(lines) + '\n') == ["Invalid expression on line 12346, column 18."]
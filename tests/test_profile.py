@@ -0,0 +1,67 @@
+import io
+import json
+import os
+import pstats
+
+from functional_turing_machine import Machine, Program
+
+# main calls mark twice, and the second call of mark calls fill
+SOURCE = ("@main() s\n"
+          "    s * !mark() t\n"
+          "    t * * >4 u\n"
+          "    u * !mark() v\n"
+          "    v * * * return\n"
+          "@mark() m\n"
+          "    m 0 1 > n\n"
+          "    m 1 0 > n\n"
+          "    n * * < o\n"
+          "    o 1 * * return\n"
+          "    o 0 !fill() p\n"
+          "    p * * * return\n"
+          "@fill() f\n"
+          "    f 0 1 < f\n")
+
+
+def profile_run():
+    "Runs SOURCE with profiling and returns the machine and the number of steps."
+    machine = Machine(Program.compile(SOURCE), profile=True)
+    steps = machine.run("00001", output=io.StringIO())
+    return machine, steps
+
+
+def test_profile_counts():
+    machine, steps = profile_run()
+    profile = machine.profile
+    assert steps == Machine(machine.program).run("00001", output=io.StringIO())
+    assert profile.steps == steps
+    assert profile.calls == [1, 2, 1]
+    assert profile.callers == [{}, {0: 2}, {1: 1}]
+    assert sum(map(profile.self_steps, range(3))) == steps
+    assert profile.self_steps(2) == 4
+    assert profile.inclusive_steps[0] == steps
+    assert profile.inclusive_steps[1] == profile.self_steps(1) + profile.self_steps(2)
+    assert profile.max_stack == 3
+    assert profile.hot_states()[0] == (4, "fill", "f", 0)
+
+
+def test_profile_report():
+    machine, steps = profile_run()
+    report = io.StringIO()
+    machine.profile.report(report)
+    assert report.getvalue().startswith(f"Profile: {steps} steps, max tape length 6, max stack depth 3\n")
+    assert "mark" in report.getvalue()
+
+
+def test_profile_files(tmp_path):
+    machine, steps = profile_run()
+    machine.profile.save(str(tmp_path / "profile.json"))
+    with open(tmp_path / "profile.json") as profile_file:
+        saved = json.load(profile_file)
+    assert saved["steps"] == steps
+    assert [function["calls"] for function in saved["functions"]] == [1, 2, 1]
+    assert saved["functions"][1]["callers"] == {"main": 2}
+
+    machine.profile.save(str(tmp_path / "profile.pstats"))
+    stats = pstats.Stats(str(tmp_path / "profile.pstats"), stream=io.StringIO())
+    assert {key[2]: value[0] for key, value in stats.stats.items()} == {"main": 1, "mark": 2, "fill": 1}
+    assert os.path.getsize(tmp_path / "profile.pstats") > 0
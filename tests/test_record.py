@@ -0,0 +1,120 @@
+import io
+import re
+
+import pytest
+
+from functional_turing_machine import Machine, Program, TraceReader
+
+# Moves, fills, scans, flags, gotos, ifs, calls, tail calls and input
+SOURCE = ("@main() s\n"
+          "    s * !flag(a) i\n"
+          "    i * !input(1, 8, \"bits:\") b\n"
+          "    b * !flag(b) c\n"
+          "    c * !invert(a, b) m\n"
+          "    m * * >3:1 n\n"
+          "    n * * < n\n"
+          "@invert(from, to) g\n"
+          "    g * !goto(from) t\n"
+          "    t * !if(to) return : f\n"
+          "    f 0 1 > h\n"
+          "    f 1 0 > h\n"
+          "    h * !flag(from) r\n"
+          "    r * !invert(from, to) return\n")
+
+
+def state(tape):
+    "Returns the position and cells of tape."
+    return tape.get_position(), tape.get_bits(0, len(tape))
+
+
+def traced_states(program, inputs):
+    """Runs program with the tape printed before every step, and returns the state of the tape after every number of
+    steps."""
+    output = io.StringIO()
+    machine = Machine(program, print_tape=True)
+    with pytest.raises(IndexError):
+        machine.run(output=output, inputs=inputs)
+    states = []
+    for line in output.getvalue().splitlines():
+        cells = re.findall(r"(>?)([01])", line)
+        position = [marker for marker, _ in cells].index('>')
+        states.append((position, ''.join(value for _, value in cells)))
+    return states + [state(machine.tape)]
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    "Records a run of SOURCE with a snapshot every 7 steps, and returns the program, trace path and step count."
+    program = Program.compile(SOURCE)
+    path = str(tmp_path / "run.trace")
+    with pytest.raises(IndexError, match="TuringTape cannot extend below position 0."):
+        Machine(program, record=path, snapshot_every=7).run(output=io.StringIO(), inputs=["1011"])
+    return program, path
+
+
+def test_seek_every_step(recorded):
+    program, path = recorded
+    reader = TraceReader(path, program)
+    tape, _, total = reader.seek(None)
+    assert total > 20
+    states = traced_states(program, ["1011"])
+    assert len(states) > total
+    for step in range(1, total):
+        tape, _, steps = reader.seek(step)
+        assert steps == step
+        assert state(tape) == states[step]
+    # Seeking past the end of the trace stops at the end
+    assert reader.seek(total + 100)[2] == total
+    reader.close()
+
+
+def test_seek_stack(recorded):
+    program, path = recorded
+    reader = TraceReader(path, program)
+    # After the first flag, input, flag and the call of invert
+    _, stack, _ = reader.seek(4)
+    assert [(program.functions[function]["name"], flags) for function, flags, _ in stack] == \
+        [("main", [0, 4]), ("invert", [0, 4])]
+    reader.close()
+
+
+def test_trace_without_an_index(recorded):
+    program, path = recorded
+    reader = TraceReader(path, program)
+    end = reader.seek(None)
+    index_offset = reader._end
+    reader.close()
+    # A run that is killed leaves a trace without the index at the end, which is rebuilt from the records
+    with open(path, 'r+b') as trace_file:
+        trace_file.truncate(index_offset)
+    reader = TraceReader(path, program)
+    tape, _, steps = reader.seek(None)
+    assert (state(tape), steps) == (state(end[0]), end[2])
+    reader.close()
+    # The last record is a snapshot of the end of the run. If it is cut off part way through, it is ignored, and the
+    # records before it are replayed to the same place instead.
+    with open(path, 'r+b') as trace_file:
+        trace_file.truncate(index_offset - 1)
+    reader = TraceReader(path, program)
+    tape, _, steps = reader.seek(None)
+    assert (state(tape), steps) == (state(end[0]), end[2])
+    reader.close()
+
+
+def test_trace_of_another_program(recorded):
+    _, path = recorded
+    with pytest.raises(ValueError, match="Trace was recorded from a different program."):
+        TraceReader(path, Program.compile("@main() s\n"))
+
+
+def test_snapshots_during_scans(tmp_path):
+    # Bulk scans stop at every snapshot, so that snapshots are taken at the same steps as between single moves
+    program = Program.compile("@main() s\n    s * * >10:1 b\n    b 1 * < b\n")
+    path = str(tmp_path / "run.trace")
+    Machine(program, record=path, snapshot_every=3).run(output=io.StringIO())
+    reader = TraceReader(path, program)
+    assert reader._index_steps == [0, 3, 6, 9]
+    assert state(reader.seek(0)[0]) == (0, "0")
+    for step in range(1, 12):
+        assert state(reader.seek(step)[0]) == (11 - step, "0" + "1" * 10)
+    reader.close()
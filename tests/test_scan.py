@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import run
+from functional_turing_machine import OP_MOVE, OP_SCAN, Program
+
+
+def test_self_loops_compile_to_scans():
+    program = Program.compile("@main() a\n"
+                              "    a 1 * > *\n"
+                              "    a 0 0 <3 a\n"
+                              "    b * * > b\n"
+                              "    c 1 * > c\n"
+                              "    c 0 1 > c\n")
+    a, b, c = program.functions[program.main]["table"][:3]
+    assert a == [(OP_SCAN, 0, -3, '*', 0, 0), (OP_SCAN, None, 1, '*', 0, 1)]
+    assert b[0] == (OP_SCAN, None, 1, '*', 1, None)
+    # Moves that change the cell are not scans
+    assert c[0][0] == OP_MOVE
+
+
+@pytest.mark.parametrize("source, tape_contents", [
+    ("@main() a\n    a 1 * > a\n", "111110"),
+    ("@main() a\n    a 1 * > a\n", "1111"),
+    ("@main() a\n    a 1 * >3 a\n", "1001001001"),
+    ("@main() a\n    a 0 * > a\n", ""),
+    ("@main() s\n    s * * >6 a\n    a 0 * < a\n", "1100000"),
+    ("@main() s\n    s * * >6 a\n    a 1 * <2 a\n", "0101010"),
+    ("@main() s\n    s * * >6 a\n    a * * <4 a\n", ""),
+    ("@main() a\n    a 1 * > a\n    a 0 1 > b\n    b 1 * > b\n    b 0 * <2 c\n    c 1 * <2 c\n", "0111101"),
+])
+def test_scans_match_single_moves(source, tape_contents):
+    assert run(source, tape_contents, max_tape=100)[:3] == run(source, tape_contents, print_tape=True, max_tape=100)[:3]
+
+
+def test_scan_counts_every_move():
+    assert run("@main() a\n    a 1 * > a\n", "111110")[:3] == (5, 5, "1111100")
+
+
+def test_scan_limits():
+    assert run("@main() a\n    a 0 * > a\n", "", max_tape=50)[:3] == \
+        ("IndexError: TuringTape has reached its maximum size of 50.", 49, "0" * 50)
+    assert run("@main() s\n    s * * >7 a\n    a * * <2 a\n", "")[:3] == \
+        ("IndexError: TuringTape cannot extend below position 0.", 1, "0" * 8)
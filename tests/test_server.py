@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+LOOP = "@main() a\n    a * * > b\n    b * * < a\n"
+# A loop whose steps fill so many cells that it reaches any short time limit long before the step limit
+SLOW_LOOP = "@main() a\n    a * * >50000000:1 b\n    b * * <50000000:0 a\n"
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    "Starts a server with one worker, a step limit and a large tape, and returns the path of its socket."
+    interpreter = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "functional_turing_machine.py")
+    path = str(tmp_path_factory.mktemp("server") / "ftm.sock")
+    process = subprocess.Popen([sys.executable, interpreter, "--serve", path, "--jobs", "1", "--max-steps", "100000",
+                                "--max-tape", "100000000", "--no-cache"])
+    deadline = time.monotonic() + 30
+    while not os.path.exists(path):
+        assert process.poll() is None and time.monotonic() < deadline, "The server did not start."
+        time.sleep(0.05)
+    yield path
+    process.terminate()
+    assert process.wait(30) == 0
+    # The server removes its socket when it stops
+    assert not os.path.exists(path)
+
+
+class Client:
+    "A connection to a server."
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('r')
+
+    def send(self, line):
+        "Sends a line, and returns the output and the result of the job."
+        self.socket.sendall(line.encode() + b'\n')
+        output = []
+        while True:
+            message = json.loads(self.file.readline())
+            if "output" not in message:
+                return ''.join(output), message
+            output.append(message["output"])
+
+    def job(self, **request):
+        "Runs a job, and returns the output and the result."
+        return self.send(json.dumps(request))
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+@pytest.fixture
+def client(server):
+    "Returns a new connection to the server."
+    client = Client(server)
+    yield client
+    client.close()
+
+
+def test_jobs(client, examples):
+    output, result = client.job(path=os.path.join(examples, "add.ftm"), inputs=["101", "11"])
+    assert output == "The sum of the two numbers you entered is:\n00001000\n"
+    assert result == {"hash": result["hash"], "steps": 47, "error": None}
+    # Compiled programs are kept by the hash of their script
+    assert client.job(hash=result["hash"], inputs=["1", "1"])[1]["steps"] == 26
+    output, result = client.job(source="@main() s\n    s * !print_str(\"from source\") return\n")
+    assert (output, result["steps"], result["error"]) == ("from source\n", 1, None)
+
+
+def test_errors(client, examples):
+    add = os.path.join(examples, "add.ftm")
+    assert client.job(path=add, inputs=["101"])[1]["error"] == \
+        'ValueError: No input left for "Enter second number (1-7 bits):".'
+    assert client.job(hash="0" * 64)[1] == {"hash": None, "steps": None,
+                                             "error": "KeyError: 'No program with hash " + "0" * 64 + " is cached.'"}
+    assert client.job(path=add, source=LOOP)[1]["error"] == \
+        'ValueError: Job must have exactly one of "path", "source" and "hash".'
+    assert client.job(source="@main() a\n    a 0 0 > b c\n")[1]["error"] == \
+        "ValueError: Invalid expression on line 2, column 15."
+    assert client.send("not json")[1]["error"].startswith("JSONDecodeError")
+
+
+def test_limits(client):
+    assert client.job(source=LOOP)[1]["error"] == "IndexError: Program has reached its maximum of 100000 steps."
+    assert client.job(source=LOOP, max_steps=10)[1]["error"] == \
+        "IndexError: Program has reached its maximum of 10 steps."
+    # Jobs can only lower the server's limits
+    assert client.job(source=LOOP, max_steps=10 ** 9)[1]["error"] == \
+        "IndexError: Program has reached its maximum of 100000 steps."
+
+
+def test_time_limit(server):
+    client = Client(server)
+    assert client.job(source=SLOW_LOOP, time_limit=0.2)[1]["error"] == \
+        "TimeoutError: Program has reached its time limit of 0.2 seconds."
+    client.close()
+    # The worker that was killed is replaced
+    client = Client(server)
+    assert client.job(source="@main() s\n    s * * > return\n")[1]["steps"] == 1
+    client.close()
+
+
+def test_connections_are_independent(server):
+    first, second = Client(server), Client(server)
+    assert second.job(source="@main() s\n    s * * > return\n")[1]["steps"] == 1
+    assert first.job(source="@main() s\n    s * * > t\n    t * * > return\n")[1]["steps"] == 2
+    first.close()
+    second.close()
+
+
+def test_runs_do_not_import_asyncio(interpreter, examples):
+    result = subprocess.run([sys.executable, "-X", "importtime", interpreter, os.path.join(examples, "helloworld.ftm"),
+                             "--no-cache"], capture_output=True, text=True, check=True)
+    assert result.stdout == "Hello, world!\n"
+    assert "asyncio" not in result.stderr
+
+
+def test_serve_requires_a_socket_path(interpreter):
+    result = subprocess.run([sys.executable, interpreter, "--serve"], capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "ValueError: Argument --serve requires the path of the socket to serve on." in result.stderr
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import run
+from functional_turing_machine import OP_CALL, Frame, Program, Stack
+
+# walk moves right until it finds a 1, calling itself as its last expression for every cell, and main prints the
+# distance with a call that is not a tail call
+SOURCE = ("@main() s\n"
+          "    s * !flag(a) w\n"
+          "    w * !walk(a) f\n"
+          "    f * !flag(b) p\n"
+          "    p * !other(a, b) return\n"
+          "@walk(a) c\n"
+          "    c 0 * > n\n"
+          "    n * !walk(a) return\n"
+          "@other(a, b) p\n"
+          "    p * !print_val(a, b) return\n")
+
+
+def test_calls_before_returning_are_tail_calls():
+    program = Program.compile(SOURCE)
+    main, walk = program.functions[0], program.functions[1]
+    assert main["table"][1][0][0] == OP_CALL and not main["table"][1][0][5]
+    # Tail calls of other functions, and of the function itself
+    assert main["table"][3][0][5]
+    assert walk["table"][1][0][5]
+
+
+def test_tail_calls_do_not_grow_the_stack():
+    result = run(SOURCE, "0" * 5000 + "1", max_stack=3)
+    assert (result.result, result.output) == (10005, "0" * 5000 + "\n")
+
+
+def test_other_calls_grow_the_stack():
+    source = SOURCE.replace("    n * !walk(a) return\n", "    n * !walk(a) r\n    r * * * return\n")
+    result = run(source, "00001", max_stack=6)
+    assert (result.result, result.output) == (17, "0000\n")
+    assert run(source, "000001", max_stack=6).result == "IndexError: Stack has reached its maximum size of 6."
+
+
+def test_stack():
+    stack = Stack(2)
+    stack.add(0, [None], 3)
+    stack.add(1, [4, None], 5)
+    with pytest.raises(IndexError, match="Stack has reached its maximum size of 2."):
+        stack.add(2, [], 0)
+    stack.set_flag(1, 7)
+    stack.replace(2, [], 6)
+    assert list(stack) == [(0, [None], 3), (2, [], 6)]
+    stack.pop()
+    assert (stack.function, stack.flags, stack.state, len(stack)) == (0, [None], 3, 1)
+    stack.pop()
+    assert stack.is_empty()
+
+
+def test_frames_are_slotted():
+    frame = Frame(0, [], 0)
+    with pytest.raises(AttributeError):
+        frame.caller = None
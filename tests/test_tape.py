@@ -0,0 +1,203 @@
+import io
+
+import pytest
+
+from functional_turing_machine import Machine, PagedTuringTape, Program, TuringTape
+
+
+@pytest.fixture(params=["bytearray", "paged", "mapped"])
+def make_tape(request, tmp_path):
+    """Returns a function that creates a tape of each kind whose first cells are tape_contents, with the cursor at
+    position 0. Paged tapes have pages of 4 cells, so that the tests cross the edges of pages."""
+    tapes = []
+
+    def make(max_size, tape_contents="", new_cell_value=0):
+        if request.param == "bytearray":
+            tape = TuringTape(max_size, new_cell_value)
+        else:
+            path = str(tmp_path / f"{len(tapes)}.tape") if request.param == "mapped" else None
+            tapes.append(PagedTuringTape(max_size, new_cell_value, page_size=4, path=path))
+            tape = tapes[-1]
+        tape.write(tape_contents)
+        tape.set_position(0)
+        return tape
+
+    yield make
+    for tape in tapes:
+        tape.close()
+
+
+def test_right_extends_and_fills(make_tape):
+    tape = make_tape(100)
+    tape.right(3, '*')
+    assert tape.get_position() == 3
+    assert len(tape) == 4
+    tape.right(4, 1)
+    assert tape.get_bits(0, 8) == "00001111"
+    tape.selected = 0
+    assert tape.get_value_at(7) == 0
+    with pytest.raises(IndexError):
+        tape.get_value_at(8)
+
+
+def test_left_fills(make_tape):
+    tape = make_tape(100, "1111111")
+    tape.set_position(6)
+    tape.left(4, 0)
+    assert tape.get_position() == 2
+    assert tape.get_bits(0, 7) == "1100001"
+
+
+def test_limits(make_tape):
+    tape = make_tape(10)
+    tape.right(9, '*')
+    with pytest.raises(IndexError, match="TuringTape has reached its maximum size of 10."):
+        tape.right(1, '*')
+    with pytest.raises(IndexError, match="TuringTape cannot extend below position 0."):
+        tape.left(10, '*')
+    assert tape.get_position() == 9
+
+
+def test_write(make_tape):
+    tape = make_tape(100)
+    tape.right(2, '*')
+    tape.write("1011")
+    assert tape.get_position() == 6
+    assert tape.get_bits(0, 7) == "0010110"
+
+
+def test_write_past_the_end_sets_the_cells_that_fit(make_tape):
+    tape = make_tape(5)
+    tape.right(2, '*')
+    with pytest.raises(IndexError, match="TuringTape has reached its maximum size of 5."):
+        tape.write("1111")
+    assert tape.get_position() == 4
+    assert tape.get_bits(0, 5) == "00111"
+
+
+def test_set_bits(make_tape):
+    tape = make_tape(10)
+    tape.set_bits(3, "101")
+    assert tape.get_position() == 0
+    assert tape.get_bits(0, len(tape)) == "000101"
+    with pytest.raises(IndexError, match="Index out of range of tape"):
+        tape.set_bits(8, "111")
+
+
+def test_new_cell_value(make_tape):
+    tape = make_tape(100, new_cell_value=1)
+    tape.right(3, '*')
+    assert tape.get_bits(0, 4) == "1111"
+
+
+def test_pack_and_restore(make_tape):
+    tape = make_tape(1000, "0000000000001101")
+    tape.right(500, '*')
+    restored = make_tape(1000)
+    data = b"xx" + tape.pack()
+    assert restored.restore(data, 2) == len(data)
+    assert restored.get_position() == 500
+    assert len(restored) == len(tape)
+    assert restored.get_bits(0, len(tape)) == tape.get_bits(0, len(tape))
+
+
+def test_restore_checks_the_maximum_size(make_tape):
+    tape = make_tape(1000)
+    tape.right(500, '*')
+    with pytest.raises(ValueError, match="Saved tape does not fit within the maximum tape size."):
+        make_tape(100).restore(tape.pack())
+
+
+def test_repr_and_window(make_tape):
+    tape = make_tape(100, "0110100")
+    tape.set_position(3)
+    assert repr(tape) == "[ 0 1 1>0<1 0 0 0 ]"
+    assert tape.window(1) == "[... 1>0<1 ...]"
+
+
+def test_scan_right(make_tape):
+    tape = make_tape(100, "1111011")
+    assert tape.scan_right(1, 1) == 4
+    assert tape.get_position() == 4
+    tape.set_position(0)
+    assert tape.scan_right(2, 1) == 2
+    assert tape.get_position() == 4
+    # Cells past the end of the tape are new cells, which are 0
+    tape.set_position(5)
+    assert tape.scan_right(1, 1) == 2
+    assert tape.get_position() == 7
+    assert tape.get_bits(0, 8) == "11110110"
+
+
+def test_scan_left(make_tape):
+    tape = make_tape(100, "0111011")
+    tape.set_position(6)
+    assert tape.scan_left(1, 1) == 2
+    assert tape.get_position() == 4
+    tape.set_position(6)
+    assert tape.scan_left(3, 1) == 2
+    assert tape.get_position() == 0
+
+
+def test_scan_limit(make_tape):
+    tape = make_tape(100)
+    assert tape.scan_right(3, None, 5) == 5
+    assert tape.get_position() == 15
+    assert tape.scan_left(1, 0, 4) == 4
+    assert tape.get_position() == 11
+
+
+def test_scan_past_the_limits(make_tape):
+    tape = make_tape(10)
+    with pytest.raises(IndexError, match="TuringTape has reached its maximum size of 10."):
+        tape.scan_right(2, 0)
+    assert tape.get_position() == 8
+    with pytest.raises(IndexError, match="TuringTape cannot extend below position 0."):
+        tape.scan_left(3, None)
+    assert tape.get_position() == 2
+
+
+def test_pack_and_restore_between_kinds():
+    tape = TuringTape(1000)
+    tape.right(3, '*')
+    tape.right(20, 1)
+    paged = PagedTuringTape(1000, page_size=4)
+    paged.restore(tape.pack())
+    assert (paged.get_position(), paged.get_bits(0, len(paged))) == (tape.get_position(), tape.get_bits(0, len(tape)))
+    restored = TuringTape(1000)
+    restored.restore(paged.pack())
+    assert (restored.get_position(), restored.get_bits(0, len(restored))) == \
+        (tape.get_position(), tape.get_bits(0, len(tape)))
+
+
+def test_paged_tapes_only_allocate_written_pages():
+    tape = PagedTuringTape(10 ** 12)
+    tape.right(10 ** 11, '*')
+    tape.write("101")
+    assert len(tape) == 10 ** 11 + 4
+    assert tape.get_bits(10 ** 11 - 1, 10 ** 11 + 4) == "01010"
+    assert len(tape._pages) == 1
+
+
+def test_paged_fills_store_whole_pages_as_values():
+    tape = PagedTuringTape(10 ** 9, page_size=16)
+    tape.right(10 ** 6, 1)
+    # Only the pages that are partly filled hold cells
+    assert sum(not isinstance(page, int) for page in tape._pages.values()) == 2
+    assert tape.get_bits(0, 3) == "011"
+    assert tape.get_bits(10 ** 6 - 2, 10 ** 6 + 1) == "111"
+    # Whole pages are packed as their value
+    assert len(tape.pack()) < 10 ** 6 // 16 * 10
+
+
+def test_machine_with_a_tape_file(tmp_path):
+    path = tmp_path / "run.tape"
+    program = Program.compile("@main() s\n    s * 1 >5:1 t\n    t * * >1000000 u\n    u * !flag(a) v\n"
+                              "    v * 1 < w\n    w * !print_val() return\n")
+    machine = Machine(program, max_tape=10 ** 7, tape_file=str(path))
+    output = io.StringIO()
+    assert machine.run(output=output) == 5
+    assert output.getvalue() == "0\n"
+    assert machine.tape.get_bits(0, 7) == "1111110"
+    assert path.stat().st_size >= 10 ** 6
+    machine.tape.close()
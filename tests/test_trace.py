@@ -0,0 +1,84 @@
+import io
+
+from functional_turing_machine import BufferedOutput, Machine, Program
+
+SOURCE = ("@main() s\n"
+          "    s 0 1 > s\n"
+          "    s 1 * >2 t\n"
+          "    t * !print_str(\"hi\") return\n")
+
+
+class CountingFile(io.StringIO):
+    "A file that counts how many times it is written to."
+    writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+def trace(**settings):
+    "Runs SOURCE with the given trace settings and returns the output."
+    output = io.StringIO()
+    Machine(Program.compile(SOURCE), **settings).run("0011", output=output)
+    return output.getvalue()
+
+
+def test_buffered_output():
+    file = CountingFile()
+    output = BufferedOutput(file, max_items=3)
+    output.write("a")
+    output.write("b")
+    assert (file.getvalue(), file.writes) == ("", 0)
+    output.write("c")
+    output.write("d")
+    assert (file.getvalue(), file.writes) == ("abc", 1)
+    output.flush()
+    assert (file.getvalue(), file.writes) == ("abcd", 2)
+
+
+def test_output_is_written_in_one_piece():
+    file = CountingFile()
+    Machine(Program.compile(SOURCE), print_tape=True).run("0011", output=file)
+    assert file.writes == 1
+    assert file.getvalue().endswith("hi\n")
+
+
+def test_output_is_flushed_before_input():
+    output = io.StringIO()
+
+    def inputs():
+        # The prompt's earlier output must already be visible when the input is read
+        assert output.getvalue() == "first\n"
+        yield "1"
+
+    program = Program.compile("@main() p\n    p * !print_str(\"first\") i\n    i * !input(1, \"bit:\") return\n")
+    Machine(program).run(output=output, inputs=inputs())
+    assert output.getvalue() == "first\n"
+
+
+def test_print_state():
+    assert trace(print_state=True) == ("[>0<0 1 1 0 ] Next state: s\n"
+                                       "[ 1>0<1 1 0 ] Next state: s\n"
+                                       "[ 1 1>1<1 0 ] Next state: s\n"
+                                       "[ 1 1 1 1>0<] Next state: t\n"
+                                       "hi\n")
+
+
+def test_trace_window():
+    assert trace(print_tape=True, trace_window=1) == ("[>0<0 ...] Position: 0\n"
+                                                      "[ 1>0<1 ...] Position: 1\n"
+                                                      "[... 1>1<1 ...] Position: 2\n"
+                                                      "[... 1>0<] Position: 4\n"
+                                                      "hi\n")
+
+
+def test_trace_changes():
+    assert trace(trace_changes=True) == ("0: 0 -> 1, Position: 1\n"
+                                         "1: 0 -> 1, Position: 2\n"
+                                         "Position: 4\n"
+                                         "hi\n"
+                                         "Position: 4\n")
+    assert trace(trace_changes=True, print_state=True).splitlines()[:3] == ["0: 0 -> 1, Position: 1 State: s",
+                                                                            "1: 0 -> 1, Position: 2 State: s",
+                                                                            "Position: 4 State: s"]
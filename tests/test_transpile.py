@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import run
+from functional_turing_machine import Machine, Program
+
+# Calls, tail calls of a function to itself and of other functions, scans, ifs and fills
+CALLS = ("@main() s\n"
+         "    s * !flag(a) w\n"
+         "    w * 1 >:1 x\n"
+         "    x 1 * > x\n"
+         "    x 0 * >2 y\n"
+         "    y * !flag(b) c\n"
+         "    c * !wrap(a, b) p\n"
+         "    p * !print_val(a, b) return\n"
+         "@wrap(from, to) c\n"
+         "    c * !clear(from, to) return\n"
+         "@clear(from, to) g\n"
+         "    g * !goto(from) i\n"
+         "    i * !if(to) return : n\n"
+         "    n * 0 > t\n"
+         "    t * !flag(from) u\n"
+         "    u * !clear(from, to) return\n")
+
+
+@pytest.mark.parametrize("name, inputs", [
+    ("helloworld", []),
+    ("add", ["101", "11"]),
+    ("add", ["1111111", "1111111"]),
+    ("add_single_bit", ["0", "1"]),
+    ("compare", ["1", "0"]),
+    ("count", ["1100101"]),
+    ("invert", ["10"]),
+    ("palindrome", ["1001"]),
+    ("reverse", ["110"]),
+    ("reverse", ["10", "extra"]),
+    ("invert", []),
+])
+def test_examples_match_the_interpreter(examples, name, inputs):
+    program = Program.compile(os.path.join(examples, f"{name}.ftm"), use_cache=False)
+    assert run(program, inputs=inputs, backend="python")[:4] == run(program, inputs=inputs)[:4]
+
+
+@pytest.mark.parametrize("source, settings", [
+    (CALLS, {}),
+    (CALLS, {"max_tape": 20}),
+    ("@main() s\n    s * !main() t\n    t * * > return\n", {"max_stack": 50}),
+    ("@main() s\n    s * * >5 s\n", {"max_tape": 23}),
+    ("@main() s\n    s * !goto(f) return\n", {}),
+])
+def test_programs_match_the_interpreter(source, settings):
+    program = Program.compile(source)
+    assert run(program, backend="python", **settings)[:4] == run(program, **settings)[:4]
+
+
+def test_tail_calls_of_other_functions_do_not_grow_the_stack():
+    # ping and pong call each other as their last expression for every cell until they find a 1
+    program = Program.compile("@main() s\n"
+                              "    s * !flag(a) w\n"
+                              "    w * !ping(a) f\n"
+                              "    f * !flag(b) p\n"
+                              "    p * !print_val(a, b) return\n"
+                              "@ping(a) c\n"
+                              "    c 0 * > n\n"
+                              "    n * !pong(a) return\n"
+                              "@pong(a) c\n"
+                              "    c 0 * > n\n"
+                              "    n * !ping(a) return\n")
+    result = run(program, "0" * 5000 + "1", backend="python", max_stack=2)
+    assert result[:4] == run(program, "0" * 5000 + "1", max_stack=2)[:4]
+    assert (result.result, result.output) == (10004, "0" * 5000 + "\n")
+
+
+def test_python_backend_settings():
+    program = Program.compile(CALLS)
+    with pytest.raises(ValueError, match="The python backend cannot trace or profile the program."):
+        Machine(program, backend="python", print_tape=True)
+    with pytest.raises(ValueError, match="The python backend cannot limit the steps or detect loops."):
+        Machine(program, backend="python", max_steps=10)
+
+
+def test_emitted_python_runs_on_its_own(interpreter, examples, tmp_path):
+    emitted = tmp_path / "helloworld.py"
+    subprocess.run([sys.executable, interpreter, os.path.join(examples, "helloworld.ftm"), "--emit-python",
+                    str(emitted), "--no-cache"], check=True)
+    result = subprocess.run([sys.executable, str(emitted)], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.path.dirname(interpreter)))
+    assert result.stdout == "Hello, world!\n"